@@ -4,10 +4,14 @@ import numpy as np
 from queue import Empty
 import pandas as pd
 from collections import namedtuple
-from bisect import bisect_right
+from bisect import bisect_left, bisect_right
 from os.path import basename
+from pathlib import Path
 
 from stytra.utilities import save_df
+from stytra.collectors.columnar import ColumnarBuffer
+from stytra.collectors.streaming import StreamingLogWriter
+from stytra.collectors.namedtuplering import NamedTupleRing
 
 
 class Accumulator(QObject):
@@ -42,11 +46,32 @@ class DataFrameAccumulator(Accumulator):
     Data can be retrieved from the Accumulator as a pandas DataFrame with the
     :meth:`get_dataframe() <Accumulator.get_dataframe()>` method.
 
+    For high-rate streams the data can instead be kept in a
+    :class:`ColumnarBuffer <stytra.collectors.columnar.ColumnarBuffer>`,
+    with a typed column for each field of the first stored NamedTuple.
+    In this case stored_data and times are read-only sequences which
+    behave like the lists.
+
+    The accumulated data can also be streamed to disk while the experiment
+    is running (see :meth:`start_streaming()
+    <DataFrameAccumulator.start_streaming()>`), in which case only the most
+    recent data are kept in memory.
+
 
     Parameters
     ----------
     fps_calc_points : int
         number of data points used to calculate the sampling rate of the data.
+    columnar : bool
+        if True, store the data in preallocated numpy arrays instead of
+        lists of NamedTuples
+    chunk_size : int
+        growth granularity (in rows) of the columnar storage
+    stream_chunk_size : int
+        number of new data points which are written to disk at once when
+        streaming
+    max_history_if_streaming : int
+        number of data points kept in memory when streaming
 
     Returns
     -------
@@ -58,12 +83,31 @@ class DataFrameAccumulator(Accumulator):
     sig_acc_reset = pyqtSignal()
     sig_acc_init = pyqtSignal()
 
-    def __init__(self, *args, fps_calc_points=10, monitored_headers=None, **kwargs):
+    def __init__(
+        self,
+        *args,
+        fps_calc_points=10,
+        monitored_headers=None,
+        columnar=False,
+        chunk_size=4096,
+        stream_chunk_size=1000,
+        max_history_if_streaming=10000,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
         """ """
         self.plot_columns = monitored_headers
         self.fps_calc_points = fps_calc_points
         self._header_dict = None
+        self.columnar = columnar
+        self.chunk_size = chunk_size
+        self._buffer = None
+        self._data_type = None
+
+        self.stream_chunk_size = stream_chunk_size
+        self.max_history_if_streaming = max_history_if_streaming
+        self._stream = None
+        self._n_unflushed = 0
 
     def __getitem__(self, item):
         if isinstance(item, tuple):
@@ -90,13 +134,17 @@ class DataFrameAccumulator(Accumulator):
 
         """
         find_time = (time - self.exp.t0).total_seconds()
-        i = bisect_right(self.times, find_time)
+        if self._buffer is not None:
+            i = self._buffer.index_at_time(find_time)
+        else:
+            i = bisect_right(self.times, find_time)
         return self.stored_data[i - 1]
 
     @property
     def columns(self):
         try:
-            return ("t",) + self.stored_data[-1]._fields
+            data_type = self._data_type or type(self.stored_data[-1])
+            return ("t",) + data_type._fields
         except IndexError:
             raise ValueError("Accumulator empty, data types not known")
 
@@ -123,18 +171,140 @@ class DataFrameAccumulator(Accumulator):
         if monitored_headers is not None:
             self.plot_columns = monitored_headers
 
+        # data of the previous type still have to be written
+        self.flush()
+
         self.stored_data = []
         self.times = []
+        self._buffer = None
+        self._data_type = None
+        self._n_unflushed = 0
 
         self._header_dict = None
 
+    def _append(self, t, data):
+        """Stores a new data point, creating the columnar storage from the
+        first one if required.
+        """
+        self._data_type = type(data)
+        if not self.columnar:
+            self.times.append(t)
+            self.stored_data.append(data)
+        else:
+            if self._buffer is None:
+                self._buffer = ColumnarBuffer.from_tuple(
+                    data, chunk_size=self.chunk_size
+                )
+                self.stored_data = self._buffer.rows
+                self.times = self._buffer.times
+            self._buffer.append(t, data)
+
+        self._n_unflushed += 1
+        if self._stream is not None and self._n_unflushed >= self.stream_chunk_size:
+            self.flush()
+
+    def _extend(self, ts, tuple_type, values):
+        """Stores a block of data points at once.
+
+        Parameters
+        ----------
+        ts : np.array
+            N timestamps
+        tuple_type : type
+            namedtuple class of the data
+        values : np.array
+            NxJ array of numeric values, one column for each field
+
+        """
+        if len(ts) == 0:
+            return
+        self._data_type = tuple_type
+        if not self.columnar:
+            self.times.extend(ts.tolist())
+            self.stored_data.extend(map(tuple_type._make, values.tolist()))
+        else:
+            if self._buffer is None:
+                self._buffer = ColumnarBuffer(
+                    tuple_type,
+                    np.dtype([(f, np.float64) for f in tuple_type._fields]),
+                    chunk_size=self.chunk_size,
+                )
+                self.stored_data = self._buffer.rows
+                self.times = self._buffer.times
+            self._buffer.extend(ts, values)
+
+        self._n_unflushed += len(ts)
+        if self._stream is not None and self._n_unflushed >= self.stream_chunk_size:
+            self.flush()
+
     def trim_data(self):
-        if (
-            not self.exp.protocol_runner.running
-            and len(self.times) > self.max_history_if_not_running * 1.5
-        ):
-            self.times[: -self.max_history_if_not_running] = []
-            self.stored_data[: -self.max_history_if_not_running] = []
+        if self._stream is not None:
+            # data already written to disk can be discarded
+            n_keep = max(self.max_history_if_streaming, self._n_unflushed)
+        elif not self.exp.protocol_runner.running:
+            n_keep = self.max_history_if_not_running
+        else:
+            return
+
+        if len(self.times) > n_keep * 1.5:
+            if self._buffer is not None:
+                self._buffer.drop_first(len(self._buffer) - n_keep)
+            else:
+                self.times[:-n_keep] = []
+                self.stored_data[:-n_keep] = []
+
+    @property
+    def streaming(self):
+        return self._stream is not None
+
+    def start_streaming(self, path):
+        """Starts writing the accumulated data to a chunked HDF5 table as
+        they arrive, from a background thread. Data which are already in
+        the accumulator are written as well.
+
+        Parameters
+        ----------
+        path : str
+            output path, without extension name
+
+        """
+        self.stop_streaming()
+        self._stream = StreamingLogWriter(path)
+        self._n_unflushed = len(self.stored_data)
+        self.flush()
+
+    def flush(self):
+        """Sends the data points not yet written to the streaming writer"""
+        if self._stream is None or self._n_unflushed == 0:
+            return
+        self._stream.put(self.get_last_n(self._n_unflushed))
+        self._n_unflushed = 0
+
+    def stop_streaming(self, path=None):
+        """Writes the remaining data and closes the streamed file.
+
+        Parameters
+        ----------
+        path : str
+            (optional) final output path without extension name, if different
+            from the one streaming was started with
+
+        Returns
+        -------
+        Path
+            the path of the streamed file, None if not streaming
+
+        """
+        if self._stream is None:
+            return None
+        self.flush()
+        stream, self._stream = self._stream, None
+        outpath = stream.close()
+        if path is not None:
+            final_path = Path(str(path) + ".hdf5")
+            if final_path != outpath:
+                outpath = outpath.replace(final_path)
+        return outpath
 
     def get_fps(self):
         """ """
@@ -169,6 +339,9 @@ class DataFrameAccumulator(Accumulator):
         if last_n == 0:
             return None
 
+        if self._buffer is not None:
+            return self._buffer.to_dataframe(last_n)
+
         df = pd.DataFrame.from_records(
             self.stored_data[-last_n:], columns=self.stored_data[-1]._fields
         )
@@ -199,6 +372,76 @@ class DataFrameAccumulator(Accumulator):
         except (OverflowError, ValueError):
             return self.get_last_n(1)
 
+    def get_last_n_arrays(self, n=None, columns=None):
+        """Return the time vector and selected columns of the last n data
+        points as read-only numpy arrays, without building a DataFrame.
+        With columnar storage the arrays are views of the stored data, and
+        are valid only until new data are added to the accumulator.
+
+        Parameters
+        ----------
+        n : int
+            number of data points to be returned
+        columns : list of str
+            names of the columns to be returned, all if None
+
+
+        Returns
+        -------
+        tuple(np.array, dict)
+            the timestamps and a dictionary of column arrays, or None if
+            the accumulator is empty
+
+        """
+        if n is not None:
+            last_n = min(n, len(self.stored_data))
+        else:
+            last_n = len(self.stored_data)
+
+        if last_n <= 0:
+            return None
+
+        fields = self.columns[1:]
+        if columns is None:
+            columns = fields
+
+        if self._buffer is not None:
+            t, data = self._buffer.last_n(last_n)
+            arrays = {c: t if c == "t" else data[c] for c in columns}
+        else:
+            rows = self.stored_data[-last_n:]
+            t = np.array(self.times[-last_n:])
+            arrays = dict()
+            for c in columns:
+                if c == "t":
+                    arrays[c] = t
+                else:
+                    i_col = fields.index(c)
+                    arrays[c] = np.array([row[i_col] for row in rows])
+
+        for arr in (t, *arrays.values()):
+            arr.flags.writeable = False
+        return t, arrays
+
+    def get_last_t_arrays(self, t, columns=None):
+        """Return the time vector and selected columns of the data points
+        in the last t seconds as read-only numpy arrays, see
+        :meth:`get_last_n_arrays() <DataFrameAccumulator.get_last_n_arrays()>`
+
+        Parameters
+        ----------
+        t : float
+            Time window in seconds from which data should be returned
+        columns : list of str
+            names of the columns to be returned, all if None
+
+        """
+        try:
+            n = int(self.get_fps() * t)
+            return self.get_last_n_arrays(n, columns)
+        except (OverflowError, ValueError):
+            return self.get_last_n_arrays(1, columns)
+
     def get_dataframe(self):
         """Returns pandas DataFrame with data and headers."""
         return self.get_last_n(len(self.stored_data))
@@ -214,9 +457,13 @@ class DataFrameAccumulator(Accumulator):
         path : str
             output path, without extension name
         format : str
-            output format, csv, feather, hdf5, json
+            output format, csv, feather, hdf5, json. If the accumulator is
+            streaming, the data are always saved in hdf5
 
         """
+        if self._stream is not None:
+            return basename(self.stop_streaming(path))
+
         df = self.get_dataframe()
         if df is None:
             return
@@ -240,16 +487,19 @@ class QueueDataAccumulator(DataFrameAccumulator):
     Parameters
     ----------
     data_queue : (multiprocessing.Queue object)
-        queue from witch to retrieve data.
+        queue from witch to retrieve data, either a NamedTupleQueue or a
+        NamedTupleRing, which is read in a single vectorized step.
     header_list : list of str
         headers for the data to stored.
+    latency_trace : LatencyTrace
+        if given, the ingestion of the newest frame is marked in it
 
     Returns
     -------
 
     """
 
-    def __init__(self, data_queue, **kwargs):
+    def __init__(self, data_queue, latency_trace=None, **kwargs):
         """ """
         super().__init__(**kwargs)
 
@@ -257,17 +507,21 @@ class QueueDataAccumulator(DataFrameAccumulator):
         # only time differences in milliseconds in the list (faster)
         self.starting_time = None
         self.data_queue = data_queue
+        self.latency_trace = latency_trace
 
     def update_list(self):
         """Upon calling put all available data into a list."""
+        if isinstance(self.data_queue, NamedTupleRing):
+            self.update_from_ring()
+            return
+
+        t = None
         while True:
             try:
                 # Get data from queue:
                 t, data = self.data_queue.get(timeout=0.001)
                 newtype = False
-                if len(self.stored_data) == 0 or type(data) != type(
-                    self.stored_data[-1]
-                ):
+                if len(self.stored_data) == 0 or type(data) != self._data_type:
                     self.reset()
                     newtype = True
 
@@ -275,8 +529,7 @@ class QueueDataAccumulator(DataFrameAccumulator):
                 t_s = (t - self.exp.t0).total_seconds()
 
                 # append:
-                self.times.append(t_s)
-                self.stored_data.append(data)
+                self._append(t_s, data)
 
                 self.trim_data()
 
@@ -286,6 +539,142 @@ class QueueDataAccumulator(DataFrameAccumulator):
             except Empty:
                 break
 
+        if t is not None and self.latency_trace is not None:
+            self.latency_trace.accumulate(t)
+
+    def update_from_ring(self):
+        """Reads all available data from a shared-memory
+        :class:`NamedTupleRing <stytra.collectors.namedtuplering.NamedTupleRing>`
+        in one go.
+        """
+        t0 = self.exp.t0.timestamp()
+        for tuple_type, ts, values in self.data_queue.drain():
+            newtype = len(self.stored_data) == 0 or tuple_type != self._data_type
+            if newtype:
+                self.reset()
+
+            self._extend(ts - t0, tuple_type, values)
+            self.trim_data()
+
+            if newtype:
+                self.sig_acc_init.emit()
+
+            if self.latency_trace is not None and len(ts) > 0:
+                self.latency_trace.accumulate(ts[-1])
+
+
+class RecordQueueAccumulator(DataFrameAccumulator):
+    """Accumulator for the records of a variable number of items at each
+    time point (e.g. the fish which are tracked in each frame), stored in
+    long format, with a row for each record and the time repeated for the
+    records of the same time point.
+
+    Parameters
+    ----------
+    data_queue : multiprocessing.Queue
+        queue of (time, column names, array of records) tuples, where the
+        column names are sent only when they change, and are None otherwise
+
+    """
+
+    def __init__(self, data_queue, **kwargs):
+        super().__init__(**kwargs)
+        self.data_queue = data_queue
+        # kept across resets, as the column names are not sent again
+        self._record_type = None
+
+    def update_list(self):
+        """Puts all the available records in the accumulator"""
+        while True:
+            try:
+                t, columns, values = self.data_queue.get(timeout=0.001)
+            except Empty:
+                break
+            if columns is not None:
+                record_type = namedtuple("r", columns)
+                if record_type._fields != getattr(self._record_type, "_fields", None):
+                    self.reset()
+                self._record_type = record_type
+            if self._record_type is None:
+                continue
+
+            t_s = (t - self.exp.t0).total_seconds()
+            self._extend(np.full(len(values), t_s), self._record_type, values)
+            self.trim_data()
+
+    def records_at_abs_time(self, time):
+        """Finds the records of the last time point before the datetime time
+
+        Parameters
+        ----------
+        time : datetime
+            time to search for
+
+        Returns
+        -------
+        np.ndarray
+            records, one per row, without the time, or None if there are
+            no records before the time
+
+        """
+        find_time = (time - self.exp.t0).total_seconds()
+        if self._buffer is not None:
+            i_end = self._buffer.index_at_time(find_time)
+        else:
+            i_end = bisect_right(self.times, find_time)
+        if i_end == 0:
+            return None
+        i_start = bisect_left(self.times, self.times[i_end - 1])
+        return np.array([tuple(self.stored_data[i]) for i in range(i_start, i_end)])
+
+    def get_slot_arrays(self, t, columns, n_slots=None, slot_column="i_fish"):
+        """Values of the records at the time points t, arranged by the slot
+        of their item, as in the wide output of the tracking (e.g. the f0_x
+        and f1_x columns for the fish in the slots 0 and 1)
+
+        Parameters
+        ----------
+        t : np.ndarray
+            increasing time points, e.g. the times of the tracking data
+        columns : list of str
+            names of the record columns to be returned
+        n_slots : int
+            number of slots, by default up to the highest slot of the records
+            at the time points
+        slot_column : str
+            record column with the slot of each item
+
+        Returns
+        -------
+        dict
+            for each column, a len(t) x n_slots array, NaN where there is no
+            record for the slot at the time point
+
+        """
+        # the times of the records and of the tracking data are the same,
+        # but can be computed differently from the frame times
+        tolerance = 1e-5
+        n_recent = 0
+        if len(t) > 0 and not self.is_empty():
+            n_recent = len(self.stored_data) - bisect_left(self.times, t[0] - tolerance)
+        if n_recent > 0:
+            rec_t, arrays = self.get_last_n_arrays(
+                n_recent, list(columns) + [slot_column]
+            )
+            slots = arrays[slot_column].astype(int)
+        else:
+            slots = np.zeros(0, dtype=int)
+
+        if n_slots is None:
+            n_slots = int(slots.max()) + 1 if len(slots) > 0 else 0
+        slot_arrays = {c: np.full((len(t), n_slots), np.nan) for c in columns}
+        if n_recent > 0:
+            i_time = np.minimum(np.searchsorted(t, rec_t - tolerance), len(t) - 1)
+            sel = (np.abs(t[i_time] - rec_t) <= tolerance) & (slots < n_slots)
+            for c in columns:
+                slot_arrays[c][i_time[sel], slots[sel]] = arrays[c][sel]
+        return slot_arrays
+
 
 class FramerateAccumulator(Accumulator):
     def __init__(self, *args, goal_framerate=None, **kwargs):
@@ -331,6 +720,46 @@ class FramerateQueueAccumulator(FramerateAccumulator):
                 break
 
 
+class NodeTimingAccumulator(Accumulator):
+    """Collects the summaries of the execution times of the tracking
+    pipeline nodes, which the tracking processes send periodically when
+    the node timing is enabled.
+
+    Parameters
+    ----------
+    queue : multiprocessing.Queue
+        queue of (time, source process, dict of
+        :class:`TimingSummary <stytra.tracking.profiling.TimingSummary>`
+        by node) tuples
+
+    """
+
+    def __init__(self, *args, queue, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue = queue
+        self.summaries = dict()
+
+    def reset(self):
+        self.summaries = dict()
+
+    def update_list(self):
+        while True:
+            try:
+                t, source, summaries = self.queue.get(timeout=0.001)
+            except Empty:
+                break
+            for node, summary in summaries.items():
+                self.summaries[(source, node)] = summary
+
+    def get_metadata(self):
+        """The latest summaries, as a dictionary by source process and node
+        path with the mean, 95th percentile and maximum time in ms"""
+        return {
+            source + node: summary._asdict()
+            for (source, node), summary in sorted(self.summaries.items())
+        }
+
+
 class DynamicLog(DataFrameAccumulator):
     """Accumulator to save feature of a stimulus, e.g. velocity of gratings
     in a closed-loop experiment.
@@ -370,10 +799,11 @@ class DynamicLog(DataFrameAccumulator):
         -------
 
         """
-        self.times.append(time)
-        self.stored_data.append(
-            self._tupletype(*(data.get(f, np.nan) for f in self._tupletype._fields))
+        self._append(
+            time,
+            self._tupletype(*(data.get(f, np.nan) for f in self._tupletype._fields)),
         )
+        self.trim_data()
 
     def update_stimuli(self, stimuli):
         dynamic_params = []
@@ -407,8 +837,7 @@ class EstimatorLog(DataFrameAccumulator):
         -------
 
         """
-        self.times.append(t)
-        self.stored_data.append(data)
+        self._append(t, data)
 
         self.trim_data()
 
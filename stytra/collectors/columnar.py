@@ -0,0 +1,314 @@
+import numpy as np
+import pandas as pd
+
+
+def schema_from_tuple(tup, dtypes=None):
+    """Builds the typed schema of a columnar buffer from the first
+    namedtuple which is stored in it.
+
+    Numeric (and boolean) values are stored as float64, so that missing
+    values can be represented as NaN, everything else as a Python object.
+    The integer and boolean columns are converted back when they are read,
+    see :func:`value_dtypes_from_tuple`.
+
+    Parameters
+    ----------
+    tup : namedtuple
+        example of the data that will be stored
+    dtypes : dict
+        (optional) explicit dtypes for some of the fields
+
+    Returns
+    -------
+    np.dtype
+        structured dtype with one field for each field of the tuple
+
+    """
+    dtypes = dtypes or dict()
+    fields = []
+    for name, value in zip(tup._fields, tup):
+        if name in dtypes:
+            dtype = dtypes[name]
+        elif isinstance(value, (bool, int, float, np.number, np.bool_)):
+            dtype = np.float64
+        else:
+            dtype = object
+        fields.append((name, dtype))
+    return np.dtype(fields)
+
+
+def value_dtypes_from_tuple(tup, dtypes=None):
+    """Finds the fields of a namedtuple with integer or boolean values,
+    which are stored as float64 by :func:`schema_from_tuple` and are read
+    with their original dtype
+
+    Parameters
+    ----------
+    tup : namedtuple
+        example of the data that will be stored
+    dtypes : dict
+        (optional) explicit dtypes for some of the fields, which are
+        stored with them
+
+    Returns
+    -------
+    dict
+        dtype of the values of each integer or boolean field
+
+    """
+    dtypes = dtypes or dict()
+    value_dtypes = dict()
+    for name, value in zip(tup._fields, tup):
+        if name in dtypes:
+            continue
+        if isinstance(value, (bool, np.bool_)):
+            value_dtypes[name] = np.dtype(bool)
+        elif isinstance(value, (int, np.integer)):
+            value_dtypes[name] = np.dtype(np.int64)
+    return value_dtypes
+
+
+def _fits_dtype(values, dtype):
+    """Whether float values can be converted to an integer or
+    boolean dtype without loss"""
+    if dtype == bool:
+        return np.all((values == 0) | (values == 1))
+    return np.all(np.isfinite(values) & (values == np.round(values)))
+
+
+class ColumnarBuffer:
+    """Growable columnar storage for a stream of namedtuples with timestamps.
+
+    The data are kept in a preallocated structured array (one field for each
+    column of the namedtuple) and the timestamps in a separate float array.
+    The arrays are grown in multiples of chunk_size when they fill up, and
+    rows which are discarded from the beginning are reclaimed by shifting
+    the remaining data back, so the stored rows are always contiguous and
+    the last N of them can be sliced without constructing any Python object.
+
+    Integer and boolean values, stored as float64, are converted back to their
+    dtype when rows or DataFrames are read, if none of the values in the
+    column is missing or fractional, as they would be by pandas from the
+    namedtuples. The views of the columns stay float64.
+
+    Views returned by the slicing methods are only guaranteed to be valid
+    until the next append to the buffer.
+
+    Parameters
+    ----------
+    tuple_type : type
+        the namedtuple class of the stored rows
+    dtype : np.dtype
+        structured dtype of the rows, see :func:`schema_from_tuple`
+    chunk_size : int
+        the granularity (in rows) of the buffer growth
+    value_dtypes : dict
+        (optional) dtypes of the integer and boolean columns stored as
+        float64, see :func:`value_dtypes_from_tuple`
+
+    """
+
+    def __init__(self, tuple_type, dtype, chunk_size=4096, value_dtypes=None):
+        self.tuple_type = tuple_type
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.value_dtypes = value_dtypes or dict()
+        self._value_types = [
+            (i_field, bool if self.value_dtypes[name] == bool else int)
+            for i_field, name in enumerate(tuple_type._fields)
+            if name in self.value_dtypes
+        ]
+
+        self._data = np.empty(chunk_size, dtype)
+        self._t = np.empty(chunk_size, np.float64)
+        self._start = 0
+        self._end = 0
+
+        self.rows = RowSequence(self)
+        self.times = TimeSequence(self)
+
+    @classmethod
+    def from_tuple(cls, tup, dtypes=None, chunk_size=4096):
+        """Creates a buffer with the schema inferred from the first tuple"""
+        return cls(
+            type(tup),
+            schema_from_tuple(tup, dtypes),
+            chunk_size=chunk_size,
+            value_dtypes=value_dtypes_from_tuple(tup, dtypes),
+        )
+
+    @property
+    def fields(self):
+        return self.tuple_type._fields
+
+    @property
+    def capacity(self):
+        return len(self._t)
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _reserve(self, n):
+        """Makes sure there is space for n more rows at the end of the
+        buffer, compacting it or allocating a larger one if needed.
+        """
+        if self._end + n <= self.capacity:
+            return
+
+        n_rows = len(self)
+        if n_rows + n > self.capacity // 2:
+            capacity = (
+                (2 * (n_rows + n) + self.chunk_size - 1) // self.chunk_size
+            ) * self.chunk_size
+            data = np.empty(capacity, self.dtype)
+            t = np.empty(capacity, np.float64)
+        else:
+            data, t = self._data, self._t
+
+        data[:n_rows] = self._data[self._start : self._end]
+        t[:n_rows] = self._t[self._start : self._end]
+        self._data, self._t = data, t
+        self._start, self._end = 0, n_rows
+
+    def append(self, t, row):
+        """Adds a single timestamped row"""
+        self._reserve(1)
+        self._data[self._end] = tuple(row)
+        self._t[self._end] = t
+        self._end += 1
+
+    def extend(self, ts, rows):
+        """Adds many rows at once
+
+        Parameters
+        ----------
+        ts : array of float
+            timestamps of the rows
+        rows : structured array, 2D array or sequence of tuples
+            new data, with the same schema as the buffer. The columns of
+            2D arrays are taken in the order of the fields
+
+        """
+        n = len(ts)
+        if n == 0:
+            return
+        self._reserve(n)
+        if isinstance(rows, np.ndarray) and rows.dtype.names is not None:
+            for name in self.dtype.names:
+                self._data[name][self._end : self._end + n] = rows[name]
+        elif isinstance(rows, np.ndarray) and rows.ndim == 2:
+            for i_col, name in enumerate(self.dtype.names):
+                self._data[name][self._end : self._end + n] = rows[:, i_col]
+        else:
+            self._data[self._end : self._end + n] = [tuple(r) for r in rows]
+        self._t[self._end : self._end + n] = ts
+        self._end += n
+
+    def drop_first(self, n):
+        """Discards the n oldest rows"""
+        self._start = min(self._start + max(n, 0), self._end)
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def _index(self, i):
+        n_rows = len(self)
+        if i < 0:
+            i += n_rows
+        if not 0 <= i < n_rows:
+            raise IndexError("ColumnarBuffer index out of range")
+        return self._start + i
+
+    def _range(self, n=None):
+        if n is None:
+            return self._start, self._end
+        return max(self._end - n, self._start), self._end
+
+    def row(self, i):
+        """Returns the i-th row as a namedtuple"""
+        values = self._data[self._index(i)].item()
+        if self._value_types:
+            values = list(values)
+            for i_field, value_type in self._value_types:
+                value = values[i_field]
+                if value_type is bool:
+                    if value == 0 or value == 1:
+                        values[i_field] = bool(value)
+                elif value.is_integer():
+                    values[i_field] = int(value)
+        return self.tuple_type._make(values)
+
+    def time(self, i):
+        return float(self._t[self._index(i)])
+
+    def last_n(self, n=None):
+        """Returns views of the timestamps and structured data of the last
+        n rows (or all rows if n is None)
+        """
+        i_start, i_end = self._range(n)
+        return self._t[i_start:i_end], self._data[i_start:i_end]
+
+    def index_at_time(self, t):
+        """Equivalent of bisect_right on the timestamps"""
+        return int(np.searchsorted(self._t[self._start : self._end], t, side="right"))
+
+    def to_dataframe(self, n=None):
+        """Returns the last n rows as a pandas DataFrame, with the timestamps
+        in the t column
+        """
+        ts, data = self.last_n(n)
+        if len(ts) == 0:
+            return None
+        df = pd.DataFrame(data)
+        for name, dtype in self.value_dtypes.items():
+            if _fits_dtype(data[name], dtype):
+                df[name] = data[name].astype(dtype)
+        df["t"] = ts
+        return df
+
+
+class RowSequence:
+    """Read-only sequence of the rows of a :class:`ColumnarBuffer`,
+    behaving as the list of namedtuples kept by the list-based accumulators.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.buffer.row(i) for i in range(*item.indices(len(self)))]
+        return self.buffer.row(item)
+
+    def __iter__(self):
+        return (self.buffer.row(i) for i in range(len(self)))
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.buffer.last_n()[1]
+        return np.array(data.tolist(), dtype=dtype)
+
+
+class TimeSequence:
+    """Read-only sequence of the timestamps of a :class:`ColumnarBuffer`,
+    behaving as the list of times kept by the list-based accumulators.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.buffer.last_n()[0][item]
+        return self.buffer.time(item)
+
+    def __iter__(self):
+        return iter(self.buffer.last_n()[0].tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.buffer.last_n()[0], dtype=dtype)
@@ -0,0 +1,251 @@
+"""
+End-to-end latency tracing: the camera frames are followed, by their index,
+from their acquisition to the stimulus display, with a monotonic timestamp
+at each stage they go through.
+"""
+
+import datetime
+from multiprocessing import RawArray
+from os.path import basename
+import time
+
+import numpy as np
+import pandas as pd
+
+from stytra.utilities import save_df
+
+
+class LatencyTrace:
+    """Times at which the camera frames reach the successive stages of an
+    experiment, written by all the processes involved in shared memory.
+
+    The times are taken with time.perf_counter, which on Linux, macOS and
+    Windows uses a system-wide monotonic clock, so that times taken in
+    different processes can be compared. The last n_slots frames are kept,
+    each in the slot frame_id % n_slots.
+
+    The camera and tracking stages are marked for every frame. The stages in
+    the main process (accumulation of the tracking data, reading by the
+    estimator, protocol update and painting of the stimulus) happen at their
+    own pace, and are marked for the newest frame which was accumulated,
+    the first time it reaches them.
+
+    Parameters
+    ----------
+    n_slots : int
+        number of frames kept
+
+    """
+
+    stages = (
+        "capture",
+        "tracking_start",
+        "tracking_end",
+        "accumulated",
+        "estimated",
+        "protocol",
+        "painted",
+    )
+
+    def __init__(self, n_slots=4096):
+        self.n_slots = n_slots
+        self._frame_ids = RawArray("q", n_slots)
+        self._wall_times = RawArray("d", n_slots)
+        self._times = RawArray("d", n_slots * len(self.stages))
+        self.frame_ids[:] = -1
+        self.wall_times[:] = np.nan
+        self.times[:] = np.nan
+
+        # newest frame accumulated in the main process
+        self.last_frame = None
+
+    @property
+    def frame_ids(self):
+        return np.frombuffer(self._frame_ids, dtype=np.int64)
+
+    @property
+    def wall_times(self):
+        return np.frombuffer(self._wall_times, dtype=np.float64)
+
+    @property
+    def times(self):
+        return np.frombuffer(self._times, dtype=np.float64).reshape(
+            self.n_slots, len(self.stages)
+        )
+
+    def capture(self, frame_id, timestamp, t=None):
+        """Marks the acquisition of a frame, starting its trace.
+
+        Parameters
+        ----------
+        frame_id : int
+            index of the frame
+        timestamp : datetime.datetime
+            time stamp with which the frame is sent on
+        t : float
+            time of the acquisition, from time.perf_counter, now by default
+
+        """
+        slot = frame_id % self.n_slots
+        self._frame_ids[slot] = -1
+        self._times[slot * len(self.stages) : (slot + 1) * len(self.stages)] = [
+            np.nan
+        ] * len(self.stages)
+        self._times[slot * len(self.stages)] = time.perf_counter() if t is None else t
+        self._wall_times[slot] = timestamp.timestamp()
+        self._frame_ids[slot] = frame_id
+
+    def mark(self, stage, frame_id, t=None):
+        """Marks the time at which a frame reaches a stage, if it is still
+        traced and did not reach it before.
+
+        Parameters
+        ----------
+        stage : str
+            one of the stages
+        frame_id : int
+            index of the frame
+        t : float
+            time, from time.perf_counter, now by default
+
+        """
+        if frame_id is None:
+            return
+        slot = frame_id % self.n_slots
+        i = slot * len(self.stages) + self.stages.index(stage)
+        if self._frame_ids[slot] == frame_id and np.isnan(self._times[i]):
+            self._times[i] = time.perf_counter() if t is None else t
+
+    def frame_at(self, timestamp):
+        """Finds the traced frame sent with a given time stamp
+
+        Parameters
+        ----------
+        timestamp : datetime.datetime or float
+            time stamp of the frame, or the corresponding POSIX timestamp
+
+        Returns
+        -------
+        int
+            the index of the frame, None if it is not traced
+
+        """
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = timestamp.timestamp()
+        matching = np.flatnonzero(np.abs(self.wall_times - timestamp) < 1e-6)
+        if len(matching) == 0:
+            return None
+        return int(self.frame_ids[matching[-1]])
+
+    def accumulate(self, timestamp):
+        """Marks the newest frame ingested by the tracking accumulator, which
+        is then followed through the next stages of the main process
+
+        Parameters
+        ----------
+        timestamp : datetime.datetime or float
+            time stamp of the newest tracking output
+
+        """
+        frame_id = self.frame_at(timestamp)
+        if frame_id is not None:
+            self.last_frame = frame_id
+            self.mark("accumulated", frame_id)
+
+    def advance(self, stage):
+        """Marks the newest accumulated frame as having reached a stage of
+        the main process"""
+        self.mark(stage, self.last_frame)
+
+
+class LatencyHistograms:
+    """Histograms of the latencies from the frame acquisition to each of the
+    stages of a :class:`LatencyTrace`, updated with the frames which went
+    through all the stages or are too old to go further.
+
+    Parameters
+    ----------
+    trace : LatencyTrace
+        the trace of the frames
+    bin_ms : float
+        width of the histogram bins, in milliseconds
+    max_ms : float
+        upper limit of the histograms, longer latencies are counted in the
+        last bin
+    timeout : float
+        time (in s) after which a frame is counted with the stages it reached
+
+    """
+
+    def __init__(self, trace, bin_ms=0.5, max_ms=200.0, timeout=0.5):
+        self.trace = trace
+        self.bin_ms = bin_ms
+        self.timeout = timeout
+        self.bin_edges = np.arange(0, max_ms + bin_ms / 2, bin_ms)
+        self.stages = trace.stages[1:]
+        self.counts = None
+        self.counted_ids = None
+        self.reset()
+
+    def reset(self):
+        self.counts = np.zeros((len(self.stages), len(self.bin_edges) - 1), np.int64)
+        self.counted_ids = self.trace.frame_ids.copy()
+
+    def update(self):
+        ids = self.trace.frame_ids.copy()
+        times = self.trace.times.copy()
+        captured = times[:, 0]
+        done = ~np.isnan(times).any(1) | (captured < time.perf_counter() - self.timeout)
+        new = (ids >= 0) & (ids != self.counted_ids) & ~np.isnan(captured) & done
+        if not np.any(new):
+            return
+        self.counted_ids[new] = ids[new]
+
+        latencies = (times[new, 1:] - captured[new, None]) * 1000
+        i_bins = np.clip(
+            np.nan_to_num(latencies / self.bin_ms).astype(np.int64),
+            0,
+            self.counts.shape[1] - 1,
+        )
+        for i_stage in range(len(self.stages)):
+            reached = ~np.isnan(latencies[:, i_stage])
+            self.counts[i_stage] += np.bincount(
+                i_bins[reached, i_stage], minlength=self.counts.shape[1]
+            )
+
+    def n_frames(self):
+        """Number of frames counted for each stage"""
+        return dict(zip(self.stages, self.counts.sum(1)))
+
+    def percentile(self, stage, q):
+        """Latency (in ms) below which are q percent of the frames which
+        reached a stage, from the upper edge of the histogram bins"""
+        counts = self.counts[self.stages.index(stage)]
+        if counts.sum() == 0:
+            return np.nan
+        i_bin = np.searchsorted(np.cumsum(counts), counts.sum() * q / 100)
+        return self.bin_edges[i_bin + 1]
+
+    def is_empty(self):
+        return self.counts.sum() == 0
+
+    def get_dataframe(self):
+        """Returns pandas DataFrame with the lower edge of the bins in ms,
+        and a column of counts per stage"""
+        df = pd.DataFrame(self.counts.T, columns=self.stages)
+        df.insert(0, "latency_ms", self.bin_edges[:-1])
+        return df
+
+    def save(self, path, format="csv"):
+        """Saves the histograms in a tabular format
+
+        Parameters
+        ----------
+        path : str
+            output path, without extension name
+        format : str
+            output format, csv, feather, hdf5, json
+
+        """
+        saved_filename = save_df(self.get_dataframe(), path, format)
+        return basename(saved_filename)
@@ -0,0 +1,164 @@
+from multiprocessing import RawArray, RawValue
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+
+class NamedTupleRing:
+    """Single-producer single-consumer ring buffer in shared memory for
+    streams of numeric namedtuples, an alternative to the
+    :class:`NamedTupleQueue <stytra.collectors.namedtuplequeue.NamedTupleQueue>`
+    which avoids pickling every output of the tracking.
+
+    Every slot of the ring is a fixed-size float64 record, made of a header
+    (timestamp, record kind and length) followed by the values of the tuple.
+    When the type of the tuples changes, the producer first writes a schema
+    record containing the new field names, so the consumer can reconstruct
+    the namedtuples. The producer only advances the write counter and the
+    consumer only advances the read counter, so no locking is needed.
+
+    If the consumer is too slow and the ring fills up, new records are
+    dropped and counted in n_dropped.
+
+    Parameters
+    ----------
+    n_slots : int
+        number of records the ring can hold
+    max_fields : int
+        maximal number of fields of the stored tuples
+
+    """
+
+    DATA = 1
+    SCHEMA = 2
+    N_HEADER = 3
+
+    def __init__(self, n_slots=2048, max_fields=1024):
+        self.n_slots = n_slots
+        self.max_fields = max_fields
+        self._shared = RawArray("d", n_slots * (max_fields + self.N_HEADER))
+        self._write_idx = RawValue("q", 0)
+        self._read_idx = RawValue("q", 0)
+        self._n_dropped = RawValue("q", 0)
+
+        self._ring = None
+        self.tuple_type = None
+        self._consumer_type = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ring"] = None
+        return state
+
+    @property
+    def ring(self):
+        if self._ring is None:
+            self._ring = np.frombuffer(self._shared, dtype=np.float64).reshape(
+                self.n_slots, self.max_fields + self.N_HEADER
+            )
+        return self._ring
+
+    @property
+    def n_dropped(self):
+        return self._n_dropped.value
+
+    def _free_slots(self):
+        return self.n_slots - (self._write_idx.value - self._read_idx.value)
+
+    def _write(self, t, kind, values):
+        i_write = self._write_idx.value
+        slot = self.ring[i_write % self.n_slots]
+        slot[: self.N_HEADER] = (t, kind, len(values))
+        if kind == self.SCHEMA:
+            slot[self.N_HEADER :].view(np.uint8)[: len(values)] = values
+        else:
+            slot[self.N_HEADER : self.N_HEADER + len(values)] = values
+        # the record is complete, make it visible to the consumer
+        self._write_idx.value = i_write + 1
+
+    def put(self, t, obj):
+        """Puts a namedtuple of numbers in the ring
+
+        Parameters
+        ----------
+        t : datetime or float
+            timestamp of the data, datetimes are converted to POSIX timestamps
+        obj : namedtuple
+
+        """
+        if isinstance(t, datetime):
+            t = t.timestamp()
+        elif t is None:
+            t = np.nan
+
+        if len(obj) > self.max_fields:
+            raise ValueError(
+                "The tuple has {} fields, the ring supports at most {}".format(
+                    len(obj), self.max_fields
+                )
+            )
+
+        if type(obj) != self.tuple_type:
+            names = np.frombuffer("\n".join(obj._fields).encode(), np.uint8)
+            if len(names) > self.max_fields * 8:
+                raise ValueError("The field names do not fit in a schema record")
+            if self._free_slots() < 2:
+                self._n_dropped.value += 1
+                return
+            self._write(t, self.SCHEMA, names)
+            self.tuple_type = type(obj)
+
+        if self._free_slots() < 1:
+            self._n_dropped.value += 1
+            return
+        self._write(t, self.DATA, obj)
+
+    def drain(self):
+        """Reads all the records available in the ring at once
+
+        Returns
+        -------
+        list of tuples (tuple_type, np.array, np.array)
+            for each run of records with the same fields, the namedtuple type,
+            the N timestamps and a NxJ array of values
+
+        """
+        i_read = self._read_idx.value
+        i_write = self._write_idx.value
+        if i_write == i_read:
+            return []
+
+        slots = np.arange(i_read, i_write) % self.n_slots
+        headers = self.ring[slots, : self.N_HEADER]
+        kinds = headers[:, 1]
+
+        segments = []
+        i_schemas = np.flatnonzero(kinds == self.SCHEMA)
+        bounds = np.r_[0, i_schemas, len(slots)]
+        for i_start, i_end in zip(bounds[:-1], bounds[1:]):
+            if i_start < i_end and kinds[i_start] == self.SCHEMA:
+                n_bytes = int(headers[i_start, 2])
+                names = (
+                    self.ring[slots[i_start], self.N_HEADER :]
+                    .view(np.uint8)[:n_bytes]
+                    .tobytes()
+                    .decode()
+                )
+                self._consumer_type = namedtuple("t", names.split("\n"))
+                i_start += 1
+            if i_start == i_end or self._consumer_type is None:
+                continue
+            n_fields = len(self._consumer_type._fields)
+            segments.append(
+                (
+                    self._consumer_type,
+                    headers[i_start:i_end, 0].copy(),
+                    self.ring[
+                        slots[i_start:i_end], self.N_HEADER : self.N_HEADER + n_fields
+                    ],
+                )
+            )
+
+        self._read_idx.value = i_write
+        return segments
@@ -0,0 +1,82 @@
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+
+import pandas as pd
+
+
+class StreamingLogWriter(Thread):
+    """Appends chunks of a log to a chunked HDF5 table from a background
+    thread, so that the data are persisted while the experiment runs and
+    only a small part of the log has to be written when the protocol ends.
+
+    If the columns of the log change (e.g. the tracking method is changed),
+    the following chunks are appended to a new table, /data_1, /data_2...
+
+    Parameters
+    ----------
+    path : str
+        output path, without extension name
+    complib : str
+        compression library used for the HDF5 table
+    complevel : int
+        compression level
+
+    """
+
+    def __init__(self, path, complib="blosc", complevel=5):
+        super().__init__(daemon=True)
+        self.path = Path(str(path) + ".hdf5")
+        self.complib = complib
+        self.complevel = complevel
+        self.chunk_queue = Queue()
+        self.n_written = 0
+        self.exception = None
+        self.start()
+
+    def put(self, df):
+        """Schedules a DataFrame to be appended to the file"""
+        self.chunk_queue.put(df)
+
+    def close(self):
+        """Waits for all pending chunks to be written and closes the file
+
+        Returns
+        -------
+        Path
+            the path of the written file
+
+        """
+        self.chunk_queue.put(None)
+        self.join()
+        if self.exception is not None:
+            raise self.exception
+        return self.path
+
+    def run(self):
+        columns = None
+        i_table = 0
+        key = "/data"
+        try:
+            with pd.HDFStore(
+                str(self.path), mode="w", complib=self.complib, complevel=self.complevel
+            ) as store:
+                while True:
+                    df = self.chunk_queue.get()
+                    if df is None:
+                        break
+
+                    if columns is not None and list(df.columns) != columns:
+                        i_table += 1
+                        key = "/data_{}".format(i_table)
+                    columns = list(df.columns)
+
+                    df.index = pd.RangeIndex(self.n_written, self.n_written + len(df))
+                    store.append(key, df, format="table", index=False)
+                    store.flush()
+                    self.n_written += len(df)
+        except Exception as e:
+            self.exception = e
+            # keep consuming so that the accumulator never blocks
+            while self.chunk_queue.get() is not None:
+                pass
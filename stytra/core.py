@@ -86,14 +86,41 @@ class Stytra:
             estimator: str or class
                 for closed-loop experiments: either "vigor" for embedded experiments
                     or "position" for freely-swimming ones. A custom estimator can be supplied.
+            columnar_storage: bool (default False)
+                keep the tracking and estimator logs in preallocated numpy columns
+                instead of lists of tuples, which is faster for high framerates
+            shared_memory_output: bool (default False)
+                send the tracking results through a shared-memory ring buffer
+                instead of a pickling queue, for fast tracking with many columns
+            n_workers: int (default 1)
+                number of processes running the tracking in parallel, for cameras
+                faster than what one core can track
+            worker_assignment: str (default "auto")
+                "round_robin" to distribute the frames to all the workers,
+                "sticky" to send them all to the same worker, as required by
+                pipelines whose output depends on previous frames. "auto"
+                chooses depending on the pipeline, and warns if all frames go to
+                the same worker
 
         recording : dict
             for video-recording experiments
                 extension: mp4 (default) or h5
-                    take care, if saving as h5 all frames are first stored in memory,
-                    potentially overfilling it
+                    h5 recordings are written as they arrive to a chunked
+                    and compressed dataset, with the frame times in /times
                 kbit_rate: int
                     for mp4 format, target kilobits per second of video
+                lossless: bool (default False)
+                    compress the video losslessly with FFV1 in a mkv file,
+                    in several threads, for high-speed recordings
+                n_threads: int (default 4)
+                    number of threads for the lossless compression
+                bout_triggered: bool (default False)
+                    for tracking experiments, record to a h5 file only the
+                    frames around the bouts detected online, with an index
+                    of the segments (video_segments). Cannot be combined
+                    with lossless
+                pad_before, pad_after: float (default 0.5)
+                    seconds recorded before and after each bout
 
         embedded : bool
             if not embedded, use circle calibrator
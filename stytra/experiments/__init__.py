@@ -84,10 +84,18 @@ class Experiment(QObject):
         if stytra is used in offline analysis, stimulus is not displayed
     log_format : str
         one of "csv", "feather", "hdf5" (pytables-based) or "json"
+    stream_logs : bool
+        if True, the logs are written to disk (always in hdf5 format) in
+        chunks while the protocol is running instead of all at the end,
+        which bounds the memory used and preserves the data in case of crashes
     """
 
     sig_data_saved = pyqtSignal()
 
+    # trace of the latencies of the camera frames through the experiment,
+    # set by the experiments with tracking
+    latency_trace = None
+
     def __init__(
         self,
         app=None,
@@ -104,6 +112,7 @@ class Experiment(QObject):
         trigger_duration_queue=None,
         scope_triggering=None,
         offline=False,
+        stream_logs=False,
         **kwargs
     ):
         self.arguments = locals()
@@ -128,6 +137,7 @@ class Experiment(QObject):
         self.database = database
         self.use_db = True if database else False
         self.log_format = log_format
+        self.stream_logs = stream_logs
         self.loop_protocol = loop_protocol
 
         self.dc = DataCollector(
@@ -202,6 +212,22 @@ class Experiment(QObject):
 
         self.dc.add_static_data(logname, category + "/" + name)
 
+    def streamed_logs(self):
+        """Returns the logs which are written to disk during the protocol
+        if stream_logs is set, as (accumulator, name) pairs.
+        """
+        if self.protocol_runner.dynamic_log is not None:
+            return [(self.protocol_runner.dynamic_log, "stimulus_log")]
+        return []
+
+    def start_log_streaming(self):
+        for log, name in self.streamed_logs():
+            log.start_streaming(self.filename_base() + name)
+
+    def stop_log_streaming(self):
+        for log, _ in self.streamed_logs():
+            log.stop_streaming()
+
     def initialize_plots(self):
         pass
 
@@ -325,6 +351,8 @@ class Experiment(QObject):
         self.check_trigger()
         self.reset()
         self.protocol_runner.start()
+        if self.stream_logs:
+            self.start_log_streaming()
         self.read_scope_data()
 
     def abort_start(self):
@@ -435,6 +463,9 @@ class Experiment(QObject):
         if save:
             self.save_data()
 
+        # close the files of logs which were streamed but not saved
+        self.stop_log_streaming()
+
         self.i_run += 1
         self.current_timestamp = datetime.datetime.now()
 
@@ -1,4 +1,5 @@
 import traceback
+import datetime
 
 import numpy as np
 from multiprocessing import Queue, Event
@@ -19,17 +20,27 @@ from stytra.hardware.video import (
 # imports for tracking
 from stytra.collectors import (
     QueueDataAccumulator,
+    RecordQueueAccumulator,
     EstimatorLog,
     FramerateQueueAccumulator,
+    NodeTimingAccumulator,
 )
 from stytra.tracking.tracking_process import TrackingProcess, DispatchProcess
 from stytra.tracking.pipelines import Pipeline
 from stytra.collectors.namedtuplequeue import NamedTupleQueue
+from stytra.collectors.namedtuplering import NamedTupleRing
+from stytra.collectors.latency import LatencyTrace, LatencyHistograms
 from stytra.experiments.fish_pipelines import pipeline_dict
 
 from stytra.stimulation.estimators import estimator_dict
 
-from stytra.hardware.video.write import H5VideoWriter, StreamingVideoWriter
+from stytra.hardware.video.write import (
+    H5VideoWriter,
+    StreamingVideoWriter,
+    LosslessVideoWriter,
+    BoutTriggeredVideoWriter,
+)
+from stytra.tracking.online_bouts import BoutRecordingTrigger, warm_up_bout_detection
 
 import sys
 from typing import *
@@ -58,6 +69,7 @@ class CameraVisualExperiment(VisualExperiment):
             an entry 'video_file' with the path to the video).
         camera_queue_mb
             the maximum size of frames that are kept at once, if the limit is exceeded, frames will be dropped.
+            The frames are shared between tracking, display and recording, so this covers all of them.
         recording
             dictionary containing the parameters for the recording (i.e. to save to an mp4 file, add the 'extension'
             entry with the 'mp4' value). If None, no recording is performed.
@@ -81,6 +93,8 @@ class CameraVisualExperiment(VisualExperiment):
             )
             self.camera_state = VideoControlParameters(tree=self.dc)
 
+        self.saved_camera_buffers = []
+
         self.acc_camera_framerate = FramerateQueueAccumulator(
             self,
             queue=self.camera.framerate_queue,
@@ -97,6 +111,11 @@ class CameraVisualExperiment(VisualExperiment):
             self._setup_recording(
                 kbit_framerate=recording.get("kbit_rate", 1000),
                 extension=recording["extension"],
+                lossless=recording.get("lossless", False),
+                n_threads=recording.get("n_threads", 4),
+                bout_triggered=recording.get("bout_triggered", False),
+                pad_before=recording.get("pad_before", 0.5),
+                pad_after=recording.get("pad_after", 0.5),
             )
 
     def reset(self) -> None:
@@ -115,6 +134,35 @@ class CameraVisualExperiment(VisualExperiment):
         self.go_live()
         super().start_experiment()
 
+    def save_camera_buffer(self, filename: Optional[str] = None) -> Optional[str]:
+        """
+        Saves the frames currently in the camera replay buffer, with their times, to a HDF5 file. The saving happens
+        in the camera process in a background thread, so this can be called from stimuli or estimators (e.g. to
+        capture rare events) without blocking the acquisition.
+
+        Parameters
+        ----------
+        filename
+            path of the file, by default a timestamped file in the experiment folder.
+
+        Returns
+        -------
+        the path of the file, or None if the video source has no buffer
+        """
+        if not hasattr(self.camera, "buffer_save_queue"):
+            self.logger.info("The video source has no buffer to save")
+            return None
+        if filename is None:
+            filename = (
+                self.filename_base()
+                + datetime.datetime.now().strftime("%H%M%S_%f")
+                + "_buffer.h5"
+            )
+        self.camera.buffer_save_queue.put(str(filename))
+        self.saved_camera_buffers.append(str(filename))
+        self.dc.add_static_data(self.saved_camera_buffers, "camera/saved_buffers")
+        return str(filename)
+
     def start_protocol(self) -> None:
         """
         Starts the recording if the recording parameters are set.
@@ -131,6 +179,10 @@ class CameraVisualExperiment(VisualExperiment):
 
         super().start_protocol()
 
+        if self.recording is not None and hasattr(self.frame_recorder, "trigger_queue"):
+            # the segments of bout-triggered recordings are indexed in protocol time
+            self.frame_recorder.trigger_queue.put(("t0", self.t0.timestamp()))
+
     def end_protocol(self, save: bool = True) -> None:
         """
         Stops the recording if the recording parameters are set.
@@ -179,7 +231,14 @@ class CameraVisualExperiment(VisualExperiment):
         )
 
     def _setup_recording(
-        self, kbit_framerate: int = 1000, extension: str = "mp4"
+        self,
+        kbit_framerate: int = 1000,
+        extension: str = "mp4",
+        lossless: bool = False,
+        n_threads: int = 4,
+        bout_triggered: bool = False,
+        pad_before: float = 0.5,
+        pad_after: float = 0.5,
     ) -> None:
         """
         Does the necessary setup before performing the recording, such as creating events, setting up the dispatcher
@@ -191,7 +250,28 @@ class CameraVisualExperiment(VisualExperiment):
             the byte rate at which the video is encoded.
         extension
             the extension used at the end of the video file.
+        lossless
+            whether to compress the video losslessly with FFV1 (in a mkv file, unless extension is avi).
+        n_threads
+            number of threads used for the lossless compression.
+        bout_triggered
+            whether to record only the frames around the detected bouts, to a h5 file.
+        pad_before
+            for bout-triggered recordings, seconds recorded before each bout.
+        pad_after
+            for bout-triggered recordings, seconds recorded after each bout.
         """
+        if bout_triggered and lossless:
+            raise ValueError(
+                "Bout-triggered recordings are written to h5 files, "
+                "they cannot be compressed losslessly"
+            )
+        if bout_triggered and not isinstance(self, TrackingExperiment):
+            raise ValueError(
+                "Bout-triggered recordings are started from the bouts "
+                "detected in a tracking experiment"
+            )
+
         self.recording_event = Event()
         self.reset_event = Event()
         self.finish_event = Event()
@@ -199,7 +279,27 @@ class CameraVisualExperiment(VisualExperiment):
         self.frame_dispatcher = self._setup_frame_dispatcher(self.recording_event)
         self.frame_dispatcher.start()
 
-        if extension == "h5":
+        if bout_triggered:
+            self.frame_recorder = BoutTriggeredVideoWriter(
+                input_queue=self.frame_dispatcher.frame_copy_queue,
+                recording_event=self.recording_event,
+                reset_event=self.reset_event,
+                finish_event=self.finish_event,
+                pad_before=pad_before,
+                pad_after=pad_after,
+                log_format=self.log_format,
+            )
+        elif lossless:
+            self.frame_recorder = LosslessVideoWriter(
+                input_queue=self.frame_dispatcher.frame_copy_queue,
+                recording_event=self.recording_event,
+                reset_event=self.reset_event,
+                finish_event=self.finish_event,
+                extension="avi" if extension == "avi" else "mkv",
+                n_threads=n_threads,
+                log_format=self.log_format,
+            )
+        elif extension == "h5":
             self.frame_recorder = H5VideoWriter(
                 input_queue=self.frame_dispatcher.frame_copy_queue,
                 recording_event=self.recording_event,
@@ -219,6 +319,28 @@ class CameraVisualExperiment(VisualExperiment):
 
         self.frame_recorder.start()
 
+        self.acc_recording_framerate = FramerateQueueAccumulator(
+            self, queue=self.frame_recorder.framerate_queue, name="recording"
+        )
+        self.recording_accumulators = [self.acc_recording_framerate]
+        if isinstance(self.frame_recorder, LosslessVideoWriter):
+            self.recording_accumulators.extend(
+                [
+                    FramerateQueueAccumulator(
+                        self,
+                        queue=self.frame_recorder.throughput_queue,
+                        name="recording [MB/s]",
+                    ),
+                    FramerateQueueAccumulator(
+                        self,
+                        queue=self.frame_recorder.compression_queue,
+                        name="compression ratio",
+                    ),
+                ]
+            )
+        for acc in self.recording_accumulators:
+            self.gui_timer.timeout.connect(acc.update_list)
+
     def _start_recording(self, filename: str) -> None:
         """
         Pushes the filename to the queue and sets the recording event in order to start the recording.
@@ -290,6 +412,9 @@ class TrackingExperiment(CameraVisualExperiment):
             containing fields:  tracking_method
                                 estimator: can be vigor for embedded fish, position
                                     for freely-swimming, or a custom subclass of Estimator
+                                trace_latency: whether to follow the frames from the camera to the
+                                    stimulus display, saving histograms of the latency of each
+                                    stage (default False)
         recording
             dictionary containing the parameters for the recording (i.e. to save to an mp4 file, add the 'extension'
             entry with the 'mp4' value). If None, no recording is performed.
@@ -299,8 +424,15 @@ class TrackingExperiment(CameraVisualExperiment):
 
         self.processing_params_queue = Queue()
         self.second_output_queue = second_output_queue
-        self.tracking_output_queue = NamedTupleQueue()
+        if tracking.get("shared_memory_output", False):
+            self.tracking_output_queue = NamedTupleRing()
+        else:
+            self.tracking_output_queue = NamedTupleQueue()
         self.finished_sig = Event()
+        self.n_tracking_workers = tracking.get("n_workers", 1)
+        self.worker_assignment = tracking.get("worker_assignment", "auto")
+        if tracking.get("trace_latency", False):
+            self.latency_trace = LatencyTrace()
 
         self.pipeline_cls = (
             pipeline_dict.get(tracking["method"], None)
@@ -313,6 +445,7 @@ class TrackingExperiment(CameraVisualExperiment):
 
         if self.pipeline_cls is None:
             raise NameError("The selected tracking method does not exist!")
+        self.camera.latency_trace = self.latency_trace
         self.pipeline = self.pipeline_cls()
         assert isinstance(self.pipeline, Pipeline)
         self.pipeline.setup(tree=self.dc)
@@ -327,24 +460,86 @@ class TrackingExperiment(CameraVisualExperiment):
             experiment=self,
             data_queue=self.tracking_output_queue,
             monitored_headers=self.pipeline.headers_to_plot,
+            columnar=tracking.get("columnar_storage", False),
+            latency_trace=self.latency_trace,
         )
         self.acc_tracking.sig_acc_init.connect(self.refresh_plots)
 
+        # Records of the tracking nodes with a variable-length output
+        self.acc_tracking_records = RecordQueueAccumulator(
+            name="tracking records",
+            experiment=self,
+            data_queue=self.frame_dispatcher.record_queue,
+            columnar=tracking.get("columnar_storage", False),
+        )
+
         # Create and connect framerate accumulator.
         self.acc_tracking_framerate = FramerateQueueAccumulator(
             self,
             queue=self.frame_dispatcher.framerate_queue,
-            name="tracking",
+            name="tracking"
+            if self.n_tracking_workers == 1
+            else "tracking ({} workers)".format(self.n_tracking_workers),
             goal_framerate=kwargs["camera"].get("min_framerate", None),
         )
 
         self.gui_timer.timeout.connect(self.acc_tracking_framerate.update_list)
 
+        # With parallel tracking, also monitor the delay added by the workers
+        if self.n_tracking_workers > 1:
+            self.acc_tracking_latency = FramerateQueueAccumulator(
+                self,
+                queue=self.frame_dispatcher.latency_queue,
+                name="tracking latency [ms]",
+            )
+            self.gui_timer.timeout.connect(self.acc_tracking_latency.update_list)
+            self.dc.add_static_data(self.n_tracking_workers, "tracking/n_workers")
+        else:
+            self.acc_tracking_latency = None
+
+        # Execution times of the pipeline nodes, if they are measured
+        self.acc_node_timings = NodeTimingAccumulator(
+            self, queue=self.frame_dispatcher.timing_queue, name="node timings"
+        )
+        self.gui_timer.timeout.connect(self.acc_node_timings.update_list)
+
         # Data accumulator is updated with GUI timer:
         self.gui_timer.timeout.connect(self.acc_tracking.update_list)
+        self.gui_timer.timeout.connect(self.acc_tracking_records.update_list)
 
         # Tracking is reset at experiment start:
         self.protocol_runner.sig_protocol_started.connect(self.acc_tracking.reset)
+        self.protocol_runner.sig_protocol_started.connect(
+            self.acc_tracking_records.reset
+        )
+
+        # The latencies are counted for the frames acquired during the protocol
+        if self.latency_trace is not None:
+            self.latency_histograms = LatencyHistograms(self.latency_trace)
+            self.gui_timer.timeout.connect(self.latency_histograms.update)
+            self.protocol_runner.sig_protocol_started.connect(
+                self.latency_histograms.reset
+            )
+        else:
+            self.latency_histograms = None
+
+        # The bout detection of the GUI is compiled before the first bout
+        self.logger.info(
+            "Bout detection compiled in {:.2f} s".format(warm_up_bout_detection())
+        )
+
+        # Bout-triggered recordings are started and stopped from the tracking data
+        if self.recording is not None and hasattr(self.frame_recorder, "trigger_queue"):
+            self.bout_trigger = BoutRecordingTrigger(
+                self.acc_tracking,
+                self.frame_recorder.trigger_queue,
+                acc_records=self.acc_tracking_records,
+                tree=self.dc,
+            )
+            self.gui_timer.timeout.connect(self.bout_trigger.update)
+            self.protocol_runner.sig_protocol_started.connect(self.bout_trigger.reset)
+        else:
+            self.bout_trigger = None
 
         est_type = tracking.get("estimator", None)
         if est_type is None:
@@ -355,7 +550,9 @@ class TrackingExperiment(CameraVisualExperiment):
             est = est_type
 
         if est is not None:
-            self.estimator_log = EstimatorLog(experiment=self)
+            self.estimator_log = EstimatorLog(
+                experiment=self, columnar=tracking.get("columnar_storage", False)
+            )
             self.estimator = est(
                 self.acc_tracking,
                 experiment=self,
@@ -384,12 +581,20 @@ class TrackingExperiment(CameraVisualExperiment):
             second_output_queue=self.second_output_queue,
             recording_signal=recording_event,
             gui_framerate=20,
+            n_workers=self.n_tracking_workers,
+            worker_assignment=self.worker_assignment,
+            latency_trace=self.latency_trace,
         )
 
     def reset(self) -> None:
         super().reset()
         self.acc_tracking_framerate.reset()
+        if self.acc_tracking_latency is not None:
+            self.acc_tracking_latency.reset()
         self.acc_tracking.reset()
+        self.acc_tracking_records.reset()
+        if self.latency_histograms is not None:
+            self.latency_histograms.reset()
         if self.estimator is not None:
             self.estimator.reset()
             self.estimator_log.reset()
@@ -452,19 +657,35 @@ class TrackingExperiment(CameraVisualExperiment):
 
         # Save log and estimators:
         self.save_log(self.acc_tracking, "behavior_log")
+        if not self.acc_tracking_records.is_empty():
+            self.save_log(self.acc_tracking_records, "behavior_records")
         try:
             self.save_log(self.estimator.log, "estimator_log")
         except AttributeError:
             pass
+        if self.acc_node_timings.summaries:
+            self.dc.add_static_data(
+                self.acc_node_timings.get_metadata(), "tracking/node_timings"
+            )
+        if self.latency_histograms is not None:
+            self.latency_histograms.update()
+            self.save_log(self.latency_histograms, "latency_histograms")
 
         super().save_data()
 
+    def streamed_logs(self) -> List[Tuple[Any, str]]:
+        logs = super().streamed_logs() + [(self.acc_tracking, "behavior_log")]
+        if self.estimator is not None:
+            logs.append((self.estimator.log, "estimator_log"))
+        return logs
+
     def set_protocol(self, protocol: np.ndarray) -> None:
         """
         Connect new protocol start to resetting of the data accumulator.
         """
         super().set_protocol(protocol)
         self.protocol.sig_protocol_started.connect(self.acc_tracking.reset)
+        self.protocol.sig_protocol_started.connect(self.acc_tracking_records.reset)
 
     def wrap_up(self, *args, **kwargs) -> None:
         super().wrap_up(*args, **kwargs)
@@ -127,6 +127,16 @@ class CameraViewWidget(QWidget):
         self.btn_capture.clicked.connect(self.save_image)
         self.layout_control.addWidget(self.btn_capture)
 
+        if hasattr(self.camera, "buffer_save_queue"):
+            self.btn_save_buffer = IconButton(
+                icon_name="save_buffer", action_name="Save the last frames"
+            )
+            self.btn_save_buffer.setToolTip(
+                "Save the frames in the replay buffer to the experiment folder"
+            )
+            self.btn_save_buffer.clicked.connect(self.save_buffer)
+            self.layout_control.addWidget(self.btn_save_buffer)
+
         self.btn_autorange = ToggleIconButton(
             icon_off="autoscale", icon_on="autoscaleOFF", action_on="Autoscale"
         )
@@ -207,6 +217,10 @@ class CameraViewWidget(QWidget):
             name = self.experiment.filename_base() + timestamp + "_img.png"
         imsave(name, self.image_item.image)
 
+    def save_buffer(self):
+        """Save the frames in the camera replay buffer."""
+        self.experiment.save_camera_buffer()
+
     def show_params_gui(self):
         """ """
         self.param_widget = ParameterGui(self.control_params)
@@ -560,7 +574,7 @@ class CameraViewCalib(CameraViewWidget):
         pass
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _tail_points_from_coords(coords, seglen):
     """Computes the tail points from a list obtained from a data accumulator
 
@@ -615,26 +629,31 @@ class CameraViewFish(CameraViewCalib):
     def retrieve_image(self):
         super().retrieve_image()
 
-        if (
-            len(self.experiment.acc_tracking.stored_data) == 0
-            or self.current_image is None
-        ):
+        if self.tracking_params.sparse_output:
+            tracking_acc = self.experiment.acc_tracking_records
+        else:
+            tracking_acc = self.experiment.acc_tracking
+        if tracking_acc.is_empty() or self.current_image is None:
             return
 
-        current_data = self.experiment.acc_tracking.values_at_abs_time(
-            self.current_frame_time
-        )
-
         n_fish = self.tracking_params.n_fish_max
-
-        n_data_per_fish = (
-            len(current_data) - 1
-        ) // n_fish  # the first is time, the last is area
         n_points_tail = self.tracking_params.n_segments
+
+        # position, heading, their velocities and the tail angles
+        n_data_per_fish = 5 + n_points_tail
         try:
-            retrieved_data = np.array(
-                current_data[:-1]  # the -1 if for the diagnostic area
-            ).reshape(n_fish, n_data_per_fish)
+            if self.tracking_params.sparse_output:
+                # the records of the fish found start with the track ID
+                # and the index of the fish
+                records = tracking_acc.records_at_abs_time(self.current_frame_time)
+                if records is None:
+                    return
+                retrieved_data = records[:, 2:]
+            else:
+                current_data = tracking_acc.values_at_abs_time(self.current_frame_time)
+                retrieved_data = np.array(
+                    current_data[: n_fish * n_data_per_fish]
+                ).reshape(n_fish, n_data_per_fish)
             valid = np.logical_not(np.all(np.isnan(retrieved_data), 1))
             self.points_fish.setData(
                 y=retrieved_data[valid, 2], x=retrieved_data[valid, 0]
@@ -20,7 +20,11 @@ from stytra.gui.protocol_control import ProtocolControlToolbar
 from stytra.gui.camera_display import CameraViewWidget
 from stytra.gui.buttons import IconButton, ToggleIconButton
 from stytra.gui.status_display import StatusMessageDisplay
-from stytra.gui.framerate_viewer import MultiFrameratesWidget
+from stytra.gui.framerate_viewer import (
+    MultiFrameratesWidget,
+    LatencyHistogramWidget,
+    NodeTimingWidget,
+)
 
 from stytra.stimulation.stimulus_display import StimulusDisplayOnMainWindow
 
@@ -248,6 +252,10 @@ class CameraExperimentWindow(VisualExperimentWindow):
         self.plot_framerate.setMaximumHeight(120)
 
         self.status_display.addMessageQueue(self.experiment.camera.message_queue)
+        if self.experiment.recording is not None:
+            self.status_display.addMessageQueue(
+                self.experiment.frame_recorder.message_queue
+            )
 
     def construct_ui(self):
         super().construct_ui()
@@ -259,6 +267,9 @@ class CameraExperimentWindow(VisualExperimentWindow):
         dockCamera.setObjectName("dock_camera")
 
         self.plot_framerate.add_framerate(self.experiment.acc_camera_framerate)
+        if self.experiment.recording is not None:
+            for acc in self.experiment.recording_accumulators:
+                self.plot_framerate.add_framerate(acc)
 
         self.addDockWidget(Qt.LeftDockWidgetArea, dockCamera)
 
@@ -378,6 +389,33 @@ class TrackingExperimentWindow(CameraExperimentWindow):
         self.add_dock(monitoring_dock)
 
         self.plot_framerate.add_framerate(self.experiment.acc_tracking_framerate)
+        if self.experiment.acc_tracking_latency is not None:
+            self.plot_framerate.add_framerate(self.experiment.acc_tracking_latency)
+
+        # histograms of the latencies, next to the framerates
+        if self.experiment.latency_histograms is not None:
+            self.plot_latency = LatencyHistogramWidget(
+                self.experiment.latency_histograms
+            )
+            self.plot_latency.setMaximumHeight(160)
+            self.experiment.gui_timer.timeout.connect(self.plot_latency.refresh)
+            dock_latency = QDockWidget("Latencies", self)
+            dock_latency.setObjectName("dock_latencies")
+            dock_latency.setWidget(self.plot_latency)
+            self.add_dock(dock_latency)
+            self.splitDockWidget(
+                self.docks["dock_framerates"], dock_latency, Qt.Horizontal
+            )
+
+        self.node_timings = NodeTimingWidget(self.experiment.acc_node_timings)
+        self.experiment.gui_timer.timeout.connect(self.node_timings.refresh)
+        dock_timings = QDockWidget("Node timings", self)
+        dock_timings.setObjectName("dock_node_timings")
+        dock_timings.setWidget(self.node_timings)
+        self.add_dock(dock_timings)
+        self.addDockWidget(Qt.RightDockWidgetArea, dock_timings)
+        self.tabifyDockWidget(monitoring_dock, dock_timings)
+        monitoring_dock.raise_()
 
         if self.extra_widget:
             self.experiment.gui_timer.timeout.connect(self.extra_widget.update)
@@ -26,17 +26,17 @@ class StreamingPositionPlot(pg.GraphicsView):
 
         self.n_points = n_points
         self.data_accumulator = data_accumulator
-        self.ind_x = self.data_accumulator.columns.index("x")
-        self.ind_y = self.data_accumulator.columns.index("y")
 
     def update(self):
         """ """
         try:
-            data_array = self.data_accumulator.get_last_n(self.n_points)
+            _, data_arrays = self.data_accumulator.get_last_n_arrays(
+                self.n_points, ["x", "y"]
+            )
+            x, y = data_arrays["x"], data_arrays["y"]
             velocity = np.r_[
                 np.clip(
-                    np.diff(data_array[:, self.ind_x]) ** 2
-                    + np.diff(data_array[:, self.ind_y]) ** 2,
+                    np.diff(x) ** 2 + np.diff(y) ** 2,
                     0,
                     30,
                 )
@@ -44,8 +44,8 @@ class StreamingPositionPlot(pg.GraphicsView):
                 [0],
             ]
             self.curve.setData(
-                x=data_array[:, self.ind_x],
-                y=data_array[:, self.ind_y],
+                x=x,
+                y=y,
                 color=np.stack(
                     [
                         0.5 + 0.5 * velocity,
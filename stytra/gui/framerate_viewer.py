@@ -1,9 +1,17 @@
 from PyQt5.QtCore import QPoint
-from PyQt5.QtWidgets import QWidget, QLabel, QHBoxLayout, QSizePolicy, QSpacerItem
+from PyQt5.QtWidgets import (
+    QWidget,
+    QLabel,
+    QHBoxLayout,
+    QGridLayout,
+    QSizePolicy,
+    QSpacerItem,
+)
 from PyQt5.QtGui import QPainter, QColor, QPen, QBrush
 from PyQt5.QtCore import Qt
 
 import numpy as np
+import pyqtgraph as pg
 
 
 class FramerateWidget(QWidget):
@@ -168,6 +176,91 @@ class MultiFrameratesWidget(QWidget):
         self.layout().addWidget(fr_disp)
 
 
+class LatencyHistogramWidget(pg.PlotWidget):
+    """Live display of the histograms of the latencies from the frame
+    acquisition to each traced stage, normalized to the number of frames
+    which reached the stage.
+
+    Parameters
+    ----------
+    histograms : LatencyHistograms
+        the histograms to display
+
+    """
+
+    def __init__(self, histograms, **kwargs):
+        super().__init__(**kwargs)
+        self.histograms = histograms
+        self.setLabel("bottom", "latency from capture", units="ms")
+        self.addLegend(offset=(-10, 10))
+        self.curves = [
+            self.plot(
+                name=stage.replace("_", " "),
+                stepMode=True,
+                pen=pg.mkPen(pg.intColor(i_stage, len(histograms.stages))),
+            )
+            for i_stage, stage in enumerate(histograms.stages)
+        ]
+        self.n_counted = None
+
+    def refresh(self):
+        counts = self.histograms.counts
+        n_counted = counts.sum(1)
+        if self.n_counted is not None and np.all(n_counted == self.n_counted):
+            return
+        self.n_counted = n_counted
+
+        edges = self.histograms.bin_edges
+        for curve, stage_counts, n in zip(self.curves, counts, n_counted):
+            curve.setData(edges, stage_counts / max(n, 1))
+        upper = np.nanmax(
+            [self.histograms.percentile(stage, 99) for stage in self.histograms.stages]
+            + [edges[1]]
+        )
+        self.setXRange(0, upper, padding=0.05)
+
+
+class NodeTimingWidget(QWidget):
+    """Table of the latest summaries of the execution times of the tracking
+    pipeline nodes, from a
+    :class:`NodeTimingAccumulator <stytra.collectors.accumulators.NodeTimingAccumulator>`
+    """
+
+    columns = ("mean", "p95", "max")
+
+    def __init__(self, acc):
+        super().__init__()
+        self.acc = acc
+        self.setLayout(QGridLayout())
+        self.lbl_disabled = QLabel(
+            "Enable time_nodes in the profiling tracking parameters\n"
+            "to measure the execution time of the pipeline nodes"
+        )
+        self.layout().addWidget(self.lbl_disabled, 0, 0)
+        self.rows = dict()
+
+    def refresh(self):
+        if not self.acc.summaries:
+            return
+        if len(self.rows) == 0:
+            self.lbl_disabled.setVisible(False)
+            for i_col, column in enumerate(("node",) + self.columns):
+                label = QLabel(column if i_col == 0 else column + " [ms]")
+                self.layout().addWidget(label, 0, i_col)
+
+        for key, summary in self.acc.summaries.items():
+            if key not in self.rows:
+                i_row = len(self.rows) + 1
+                source, node = key
+                self.layout().addWidget(QLabel(source + node), i_row, 0)
+                self.rows[key] = [QLabel() for _ in self.columns]
+                for i_col, label in enumerate(self.rows[key]):
+                    label.setAlignment(Qt.AlignRight)
+                    self.layout().addWidget(label, i_row, i_col + 1)
+            for label, column in zip(self.rows[key], self.columns):
+                label.setText("{:.2f}".format(getattr(summary, column)))
+
+
 if __name__ == "__main__":
     from PyQt5.QtWidgets import QApplication
 
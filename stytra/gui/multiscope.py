@@ -208,6 +208,10 @@ class MultiStreamPlot(QWidget):
                     header_items = accumulator.plot_columns
                 else:
                     header_items = accumulator.columns[1:]  # first column is always t
+            if not accumulator.is_empty():
+                # the monitored columns might not all be in the output
+                # (e.g. with the sparse output of the fish tracking)
+                header_items = [h for h in header_items if h in accumulator.columns]
             self.colors = self.get_colors(len(self.stream_items) + len(header_items))
             self.accumulators.append(accumulator)
             self.selected_columns.append(header_items)
@@ -312,33 +316,37 @@ class MultiStreamPlot(QWidget):
             # try:
             # difference from data accumulator time and now in seconds:
             delta_t = (self.experiment.t0 - current_time).total_seconds()
-            data_frame = acc.get_last_t(self.time_past)
+            past_data = acc.get_last_t_arrays(self.time_past, sel_cols)
 
             # if this accumulator does not have enough data to plot, skip it
-            if data_frame is None or data_frame.shape[0] <= 1:
+            if past_data is None or len(past_data[0]) <= 1:
                 for _ in sel_cols:
                     self._set_labels(self.stream_items[i_stream])
                     self.stream_items[i_stream].curve.setData(x=[], y=[])
                     i_stream += 1
                 continue
 
+            t_array, data_arrays = past_data
+
             # downsampling if there are too many points
-            if len(data_frame) > self.n_points_max:
-                data_frame = data_frame[:: len(data_frame) // self.n_points_max]
+            if len(t_array) > self.n_points_max:
+                step = len(t_array) // self.n_points_max
+                t_array = t_array[::step]
+                data_arrays = {col: d[::step] for col, d in data_arrays.items()}
 
-            time_array = delta_t + data_frame.t.values
+            time_array = delta_t + t_array
 
             # loop to handle nan values in a single column
             new_bounds = np.zeros((len(sel_cols), 2))
 
             for id, col in enumerate(sel_cols):
                 # Exclude nans from calculation of percentile boundaries:
-                d = data_frame[col].values
+                d = data_arrays[col]
                 if d.dtype != np.float64:
                     continue
                 b = ~np.isnan(d)
                 if np.any(b):
-                    non_nan_data = data_frame[col][b]
+                    non_nan_data = d[b]
                     new_bounds[id, :] = np.percentile(non_nan_data, (0.5, 99.5), 0)
                     # if the bounds are the same, set arbitrary ones
                     if new_bounds[id, 0] == new_bounds[id, 1]:
@@ -353,11 +361,11 @@ class MultiStreamPlot(QWidget):
                 else:
                     self.stream_items[i_stream].curve.setData(
                         x=time_array,
-                        y=i_stream + ((data_frame[col].values - lb) / scale),
+                        y=i_stream + ((data_arrays[col] - lb) / scale),
                     )
                 self._set_labels(
                     self.stream_items[i_stream],
-                    values=(lb, ub, data_frame[col].values[-1]),
+                    values=(lb, ub, data_arrays[col][-1]),
                 )
                 i_stream += 1
 
@@ -5,20 +5,28 @@ implement video saving
 
 import numpy as np
 
+from datetime import datetime
 from multiprocessing import Queue, Event
 from queue import Empty, Full
+from threading import Thread
 
 from lightparam import Param
 from lightparam.param_qt import ParametrizedQt
 
 from stytra.hardware.video.cameras.interface import CameraError
 from stytra.utilities import FrameProcess
-from arrayqueues.shared_arrays import IndexedArrayQueue
+from stytra.hardware.video.frame_pool import FramePool
 import flammkuchen as fl
 
 from stytra.hardware.video.cameras import camera_class_dict
 
-from stytra.hardware.video.write import VideoWriter
+from stytra.hardware.video.write import VideoWriter, save_ring_buffer
+from stytra.hardware.video.read import (
+    H5VideoReader,
+    AvVideoReader,
+    ArrayVideoReader,
+    has_video_node,
+)
 
 from stytra.hardware.video.ring_buffer import RingBuffer
 
@@ -41,8 +49,10 @@ class VideoSource(FrameProcess):
     **Output Queues**
 
     self.frame_queue :
-        TimestampedArrayQueue from the arrayqueues module
-        where the frames read from the camera are sent.
+        FrameChannel where the frames read from the camera are sent, with
+        their time and index. The frames are stored once in a shared-memory
+        FramePool, from which they can be passed on to further consumers
+        (tracking, recording, display) without being copied.
 
 
     **Events**
@@ -51,12 +61,24 @@ class VideoSource(FrameProcess):
         When set kill the process.
 
 
+    **Latency tracing**
+
+    self.latency_trace :
+        if set to a :class:`LatencyTrace <stytra.collectors.latency.LatencyTrace>`
+        before the process is started, the acquisition of each frame sent
+        on is marked in it.
+
+
     Parameters
     ----------
     rotation : int
         n of times image should be rotated of 90 degrees
     max_mbytes_queue : int
-        maximum size of camera queue (Mbytes)
+        maximum size of the frame pool (Mbytes), shared by all the consumers
+        of the frames
+    n_consumers : int
+        ignored, as it always was, kept for compatibility. The consumers
+        are added with add_consumer, and counted by the n_consumers property
 
     Returns
     -------
@@ -68,23 +90,83 @@ class VideoSource(FrameProcess):
         super().__init__(name="camera")
         self.rotation = rotation
         self.control_queue = Queue()
-        self.frame_queue = IndexedArrayQueue(max_mbytes=max_mbytes_queue)
+        self.frame_pool = FramePool(max_mbytes=max_mbytes_queue)
+        self.frame_queue = self.frame_pool.channel(indexed=True)
+        self.consumer_queues = [self.frame_queue]
+        self.i_frame = 0
         self.kill_event = Event()
-        self.n_consumers = 1
         self.state = None
+        self.latency_trace = None
+
+    @property
+    def n_consumers(self):
+        return len(self.consumer_queues)
+
+    def add_consumer(self, maxsize=None):
+        """Adds a channel which receives all the frames, without them being
+        copied. Has to be called before the process is started.
 
-    def put_frame(self, frame, messages):
-        # If the queue is full, arrayqueues should print a warning!
+        Parameters
+        ----------
+        maxsize : int
+            maximal number of frames waiting in the channel, beyond which
+            they are not sent to this consumer
+
+        Returns
+        -------
+        FrameChannel
+
+        """
+        channel = self.frame_pool.channel(indexed=True, maxsize=maxsize)
+        self.consumer_queues.append(channel)
+        return channel
+
+    def frame_channels(self, messages=None):
+        """Channels to which the next frame is sent, none if the main
+        consumer is lagging behind, in which case the frame is dropped
+        (and reported in messages, if given)"""
         try:
-            if self.frame_queue.queue.qsize() < self.n_consumers + 2:
-                self.frame_queue.put(frame)
-            else:
-                messages.append("W:Dropped frame")
+            lagging = self.frame_queue.qsize() >= 3
         except NotImplementedError:
+            lagging = False
+        if lagging:
+            if messages is not None:
+                messages.append("W:Dropped frame")
+            return []
+        channels = [self.frame_queue]
+        for channel in self.consumer_queues[1:]:
             try:
-                self.frame_queue.put(frame)
+                channel._check_full()
+                channels.append(channel)
             except Full:
-                messages.append("W:Dropped frame")
+                pass
+        return channels
+
+    def trace_capture(self, t_capture=None):
+        """Time stamp for the frame about to be sent, whose acquisition
+        at t_capture (from time.perf_counter) is marked in the latency trace
+        """
+        timestamp = datetime.now()
+        if self.latency_trace is not None:
+            self.latency_trace.capture(self.i_frame, timestamp, t_capture)
+        return timestamp
+
+    def put_frame(self, frame, messages=None, t_capture=None, timestamp=None):
+        channels = self.frame_channels(messages)
+        if channels:
+            if timestamp is None:
+                timestamp = self.trace_capture(t_capture)
+            try:
+                self.frame_pool.put(
+                    frame,
+                    timestamp=timestamp,
+                    index=self.i_frame,
+                    channels=channels,
+                )
+                self.i_frame += 1
+            except Full:
+                if messages is not None:
+                    messages.append("W:Dropped frame")
         self.update_framerate()
 
 
@@ -98,6 +180,11 @@ class CameraSource(VideoSource):
     Avt      Add some info
     ======== ===========================================
 
+    The last frames are kept in a ring buffer, which is used for replaying
+    them and can be saved to disk by putting a filename in the
+    buffer_save_queue. The frames are then written in a background thread,
+    without interrupting the acquisition.
+
     Parameters
     ----------
     camera_type : str
@@ -136,6 +223,124 @@ class CameraSource(VideoSource):
 
         self.state = None
         self.ring_buffer = None
+        self.buffer_save_queue = Queue()
+        self.saving_threads = []
+
+        # array in which the frames are read when they are not read directly
+        # in the frame pool, and the pool slot reserved for the current frame
+        self.read_buffer = None
+        self.reserved = None
+
+        # time at which the current frame was read
+        self.t_read = None
+
+    def save_buffer(self, filename, messages):
+        """Hands the contents of the ring buffer over to a thread which
+        saves them, the buffer is then filled again from empty
+        """
+        if self.ring_buffer is None or self.ring_buffer.arr is None:
+            messages.append("W:No frames in the buffer to save")
+            return
+        frames, times, i_oldest = self.ring_buffer.detach()
+        thread = Thread(
+            target=self._write_buffer,
+            args=(filename, frames, times, i_oldest),
+            daemon=True,
+        )
+        thread.start()
+        self.saving_threads = [t for t in self.saving_threads if t.is_alive()]
+        self.saving_threads.append(thread)
+
+    def _write_buffer(self, filename, frames, times, i_oldest):
+        try:
+            n_frames = save_ring_buffer(filename, frames, times, i_oldest)
+            self.message_queue.put(
+                "I:Saved the last {} frames in {}".format(n_frames, filename)
+            )
+        except Exception as e:
+            self.message_queue.put("E:Saving the buffer failed: {}".format(e))
+
+    def read_frame(self, messages, to_pool=False):
+        """Reads a frame from the camera without allocating a new array, once
+        the shape of the frames is known. If to_pool, the frame is read
+        directly in a reserved slot of the frame pool, and has to be sent
+        on with send_frame, otherwise it is read in an array reused for
+        all the frames.
+
+        Returns
+        -------
+        np.ndarray
+            the frame, or None if no frame was read
+
+        """
+        self.reserved = None
+        buffer = self.read_buffer
+        if to_pool and buffer is not None:
+            channels = self.frame_channels(messages)
+            slot = None
+            if channels:
+                try:
+                    slot = self.frame_pool.reserve(
+                        buffer.dtype, buffer.shape, len(channels)
+                    )
+                    buffer = self.frame_pool.view(slot, buffer.dtype, buffer.shape)
+                except Full:
+                    messages.append("W:Dropped frame")
+            self.reserved = (slot, channels)
+
+        try:
+            frame = self.cam.read_into(buffer)
+            self.t_read = time.perf_counter()
+        except CameraError:
+            self._release_reserved()
+            raise
+
+        # the first frame, or one which changed shape, is allocated by the
+        # camera and sent on with put_frame
+        if frame is not buffer:
+            self._release_reserved()
+            if frame is not None:
+                self.read_buffer = np.empty_like(frame)
+        return frame
+
+    def buffer_and_send(self, frame, messages):
+        """Puts a frame obtained with read_frame in the replay buffer and
+        sends it on, with the same time stamp, so that the saved buffers
+        can be matched with the tracking data"""
+        timestamp = self.trace_capture(self.t_read)
+        try:
+            self.ring_buffer.put(frame, timestamp.timestamp())
+        except AttributeError:
+            pass
+        self.send_frame(frame, messages, timestamp)
+
+    def _release_reserved(self):
+        if self.reserved is not None and self.reserved[0] is not None:
+            slot, channels = self.reserved
+            self.frame_pool.release(slot, len(channels))
+            self.reserved = None
+
+    def send_frame(self, frame, messages, timestamp=None):
+        """Sends on a frame obtained with read_frame, with the given time
+        stamp, or one taken now"""
+        if self.reserved is None:
+            self.put_frame(frame, messages, self.t_read, timestamp)
+            return
+        slot, channels = self.reserved
+        self.reserved = None
+        if slot is not None:
+            if timestamp is None:
+                timestamp = self.trace_capture(self.t_read)
+            self.frame_pool.send(
+                slot,
+                frame.dtype,
+                frame.shape,
+                timestamp=timestamp,
+                index=self.i_frame,
+                channels=channels,
+            )
+            self.i_frame += 1
+        self.update_framerate()
 
     def retrieve_params(self, messages):
         while True:
@@ -173,18 +378,28 @@ class CameraSource(VideoSource):
         camera_messages = list(self.cam.open_camera())
         [self.message_queue.put(m) for m in camera_messages]
         prt = None
+        arr = None
         while not self.kill_event.is_set():
             # Try to get new parameters from the control queue:
             messages = []
             if self.control_queue is not None:
                 self.retrieve_params(messages)
-            # Grab the new frame, and put it in the queue if valid:
             try:
-                arr = self.cam.read()
-            except CameraError:
+                self.save_buffer(self.buffer_save_queue.get_nowait(), messages)
+            except Empty:
                 pass
+            # Grab the new frame, directly in the frame pool if it is sent
+            # on as it is, and put it in the queue if valid:
+            live = not (
+                self.state.paused or (self.state.replay and self.state.replay_fps > 0)
+            )
+            try:
+                arr = self.read_frame(messages, to_pool=live and not self.rotation)
+            except CameraError:
+                # the previous frame may be a view of a released pool slot
+                arr = None
 
-            if self.rotation:
+            if self.rotation and arr is not None:
                 arr = np.rot90(arr, self.rotation)
 
             res_len = int(round(self.state.framerate * self.state.ring_buffer_length))
@@ -204,7 +419,7 @@ class CameraSource(VideoSource):
                     "I:Ring_buffer_size:" + str(self.ring_buffer.length)
                 )
                 if self.ring_buffer.arr is not None:
-                    self.frame_queue.put(self.ring_buffer.get_most_recent())
+                    self.put_frame(self.ring_buffer.get_most_recent())
                 else:
                     self.message_queue.put("E:camera paused before any frames acquired")
                 prt = None
@@ -221,7 +436,7 @@ class CameraSource(VideoSource):
                         int(round(self.state.replay_limits[1] * old_fps)),
                     )
                 try:
-                    self.frame_queue.put(self.ring_buffer.get())
+                    self.put_frame(self.ring_buffer.get())
                 except ValueError:
                     pass
                 delta_t = 1 / self.state.replay_fps
@@ -233,15 +448,13 @@ class CameraSource(VideoSource):
             else:
                 prt = None
                 if arr is not None:
-                    try:
-                        self.ring_buffer.put(arr)
-                    except AttributeError:
-                        pass
-                    self.put_frame(arr, messages)
+                    self.buffer_and_send(arr, messages)
             for m in messages:
                 self.message_queue.put(m)
 
         self.cam.release()
+        for thread in self.saving_threads:
+            thread.join()
 
 
 class VideoFileSource(VideoSource):
@@ -253,7 +466,8 @@ class VideoFileSource(VideoSource):
         source_file
             path of the video file
         loop : bool
-            continue video from the beginning if the end is reached
+            continue video from the beginning if the end is reached,
+            otherwise stop streaming, for all video formats
 
     Returns
     -------
@@ -281,90 +495,54 @@ class VideoFileSource(VideoSource):
             except Empty:
                 break
 
+    def open_reader(self):
+        """Creates the reader which decodes or loads the frames in a
+        background thread"""
+        if self.source_file.endswith("h5") or self.source_file.endswith("hdf5"):
+            if has_video_node(self.source_file):
+                # frames are read lazily, as the video might not fit in memory
+                return H5VideoReader(
+                    self.source_file, start=self.offset, loop=self.loop
+                )
+            return ArrayVideoReader(
+                fl.load(self.source_file), start=self.offset, loop=self.loop
+            )
+        return AvVideoReader(self.source_file, start=self.offset, loop=self.loop)
+
     def run(self):
         if self.state is None:
             self.state = VideoControlParameters()
-        if self.source_file.endswith("h5") or self.source_file.endswith("hdf5"):
-            framedata = fl.load(self.source_file)
-
-            if isinstance(framedata, np.ndarray):
-                frames = framedata
-            else:
-                frames = framedata["video"]
-
-            i_frame = self.offset
-            prt = None
-            while not self.kill_event.is_set():
-                messages = []
-                # Try to get new parameters from the control queue:
-                message = ""
-                if self.control_queue is not None:
-                    self.update_params()
-
-                # we adjust the framerate
-                delta_t = 1 / self.state.framerate
-                if prt is not None:
-                    extrat = delta_t - (time.process_time() - prt)
-                    if extrat > 0:
-                        time.sleep(extrat)
-
-                self.put_frame(frames[i_frame, :, :], messages)
-
-                if not self.state.paused:
-                    i_frame += 1
 
-                if i_frame == frames.shape[0]:
-                    if self.loop:
-                        i_frame = self.offset
-                    else:
-                        break
+        reader = self.open_reader()
+        reader.start()
 
-                for m in messages:
-                    self.message_queue.put(m)
-                prt = time.process_time()
-
-        else:
-            import av
-
-            container = av.open(self.source_file)
-            container.streams.video[0].thread_type = "AUTO"
-            container.streams.video[0].thread_count = 1
-
-            prt = None
-            while not self.kill_event.is_set():
-                for framedata in container.decode(video=0):
-                    if self.kill_event.is_set():
-                        break
-
-                    messages = []
-                    if self.paused:
-                        frame = self.old_frame
-                    else:
-                        frame = framedata.to_ndarray(format="rgb24")
-
-                    # adjust the frame rate by adding extra time if the processing
-                    # is quicker than the specified framerate
-
-                    if self.control_queue is not None:
-                        self.update_params()
-
-                    delta_t = 1 / self.state.framerate
-                    if prt is not None:
-                        extrat = delta_t - (time.process_time() - prt)
-                        if extrat > 0:
-                            time.sleep(extrat)
-
-                    self.put_frame(frame[:, :, 0], messages)
-
-                    prt = time.process_time()
-                    self.old_frame = frame
-
-                    for m in messages:
-                        self.message_queue.put(m)
+        frame = None
+        prt = None
+        while not self.kill_event.is_set():
+            messages = []
+            # Try to get new parameters from the control queue:
+            if self.control_queue is not None:
+                self.update_params()
+
+            # we adjust the framerate
+            delta_t = 1 / self.state.framerate
+            if prt is not None:
+                extrat = delta_t - (time.process_time() - prt)
+                if extrat > 0:
+                    time.sleep(extrat)
+
+            # when paused, the last frame is repeated
+            if frame is None or not self.state.paused:
+                frame = reader.get()
+            if frame is None:
+                break
+            self.put_frame(frame, messages)
 
-                container.seek(0)
+            for m in messages:
+                self.message_queue.put(m)
+            prt = time.process_time()
 
-            return
+        reader.stop()
 
 
 class VideoControlParameters(ParametrizedQt):
@@ -4,6 +4,7 @@ from stytra.hardware.video.cameras.spinnaker import SpinnakerCamera
 from stytra.hardware.video.cameras.mikrotron import MikrotronCLCamera
 from stytra.hardware.video.cameras.opencv import OpenCVCamera
 from stytra.hardware.video.cameras.basler import BaslerCamera
+from stytra.hardware.video.cameras.synthetic import SyntheticCamera
 
 
 # Update this dictionary when adding a new camera!
@@ -14,4 +15,5 @@ camera_class_dict = dict(
     spinnaker=SpinnakerCamera,
     mikrotron=MikrotronCLCamera,
     opencv=OpenCVCamera,
+    synthetic=SyntheticCamera,
 )
@@ -101,6 +101,10 @@ class AvtCamera(Camera):
         return messages
 
     def read(self):
+        """ """
+        return self.read_into(None)
+
+    def read_into(self, buffer):
         """ """
         try:
             self.frame.wait_for_capture(self.timeout_ms)
@@ -113,10 +117,13 @@ class AvtCamera(Camera):
             )
 
             if self.interlacing:
-                new_frame = np.empty(frame.shape, dtype=np.uint8)
-                new_frame[1::2] = frame[:246]
-                new_frame[::2] = frame[246:]
-                frame = new_frame
+                if buffer is None or buffer.shape != frame.shape:
+                    buffer = np.empty(frame.shape, dtype=np.uint8)
+                buffer[1::2] = frame[:246]
+                buffer[::2] = frame[246:]
+                frame = buffer
+            else:
+                frame = self.fill_buffer(frame, buffer)
 
         except VimbaException:
             frame = None
@@ -15,6 +15,7 @@ class Camera:
         cam.open_camera()  # initialize the camera
         cam.set('exposure', 10)  # set exposure time in ms
         frame = cam.read()  # read frame
+        frame = cam.read_into(frame)  # read the next frame in the same array
         cam.release()  # close the camera
 
 
@@ -67,6 +68,41 @@ class Camera:
         """
         return None
 
+    def read_into(self, buffer):
+        """Grab frame from the camera and write it into a preallocated array,
+        so that no new array is allocated for each frame. Cameras which do
+        not implement it read the frame and copy it.
+
+        Parameters
+        ----------
+        buffer : np.array
+            array in which the frame is written, can be None if the shape
+            of the frames is not known yet
+
+        Returns
+        -------
+        np.array
+                buffer, if the frame was written in it, otherwise the
+                grabbed frame if it does not fit in the buffer, or None if
+                an error occurred.
+
+        """
+        return self.fill_buffer(self.read(), buffer)
+
+    @staticmethod
+    def fill_buffer(frame, buffer):
+        """Copies a frame in the buffer if they have the same shape and type,
+        and returns the buffer, otherwise returns the frame."""
+        if (
+            frame is None
+            or buffer is None
+            or buffer.shape != frame.shape
+            or buffer.dtype != frame.dtype
+        ):
+            return frame
+        buffer[...] = frame
+        return buffer
+
     def release(self):
         """Close the camera."""
         pass
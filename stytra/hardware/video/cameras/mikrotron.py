@@ -104,6 +104,19 @@ class MikrotronCLCamera(Camera):
         err = self.imaq.imgGrab(self.session_id, ctypes.byref(self.buffer_address), 1)
         return self.img_buffer
 
+    def read_into(self, buffer):
+        # the frame grabber can write directly in a contiguous buffer
+        if (
+            buffer is None
+            or buffer.shape != self.img_buffer.shape
+            or buffer.dtype != self.img_buffer.dtype
+            or not buffer.flags.c_contiguous
+        ):
+            return super().read_into(buffer)
+        address = buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_long))
+        err = self.imaq.imgGrab(self.session_id, ctypes.byref(address), 1)
+        return buffer
+
     def release(self):
         self.imaq.imgSessionStopAcquisition(self.session_id)
         self.imaq.imgClose(self.session_id, True)
@@ -26,6 +26,7 @@ class OpenCVCamera(Camera):
         # Test if API for the camera is available
         self.cam = cv2.VideoCapture(cam_idx)
         self.bw = bw
+        self.bgr_frame = None
 
     def open_camera(self):
         """ """
@@ -50,6 +51,26 @@ class OpenCVCamera(Camera):
         else:
             return rgb
 
+    def read_into(self, buffer):
+        """ """
+        if self.bw or buffer is None or self.bgr_frame is None:
+            frame = self.read()
+            self.bgr_frame = None if self.bw else np.empty_like(frame)
+            return self.fill_buffer(frame, buffer)
+        try:
+            # the frame is read in the same array each time, and converted
+            # directly into the buffer
+            ret, frame = self.cam.read(self.bgr_frame)
+            if not ret:
+                raise cv2.error()
+            if frame.shape != buffer.shape or frame.dtype != buffer.dtype:
+                self.bgr_frame = frame
+                return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buffer)
+        except cv2.error:
+            raise cv2.error("OpenCV can't find a camera!")
+        return buffer
+
     def release(self):
         """ """
         self.cam.release()
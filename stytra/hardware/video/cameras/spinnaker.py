@@ -225,6 +225,9 @@ class SpinnakerCamera(Camera):
         return messages
 
     def read(self):
+        return self.read_into(None)
+
+    def read_into(self, buffer):
         try:
             #  Retrieve next received image
             image_result = self.cam.GetNextImage()
@@ -234,9 +237,12 @@ class SpinnakerCamera(Camera):
                 return
 
             else:
-                image_converted = np.array(
-                    image_result.GetData(), dtype="uint8"
-                ).reshape((image_result.GetHeight(), image_result.GetWidth()))
+                image_data = np.asarray(image_result.GetData(), dtype="uint8").reshape(
+                    (image_result.GetHeight(), image_result.GetWidth())
+                )
+                image_converted = self.fill_buffer(image_data, buffer)
+                if image_converted is image_data:
+                    image_converted = image_data.copy()
                 #  Images retrieved directly from the camera (i.e. non-converted
                 #  images) need to be released in order to keep from filling the
                 #  buffer.
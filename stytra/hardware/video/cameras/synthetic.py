@@ -0,0 +1,382 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+from numba import jit
+
+from stytra.hardware.video.cameras.interface import Camera
+from stytra.utilities import reduce_to_pi
+
+import flammkuchen as fl
+
+
+# number of pixels of the first row in which the frame index is written
+N_INDEX_BITS = 32
+
+LarvaPose = namedtuple("LarvaPose", "t x y theta swimming tail_angles")
+LarvaPose.__doc__ = """Pose of the synthetic larva in a frame: time since the
+start of the acquisition (s), head position (px), heading (rad), whether it
+is performing a bout and absolute angles of the tail segments (rad)"""
+
+
+def encode_frame_index(frame, i_frame):
+    """Writes the frame index in binary in the first pixels of the frame,
+    as 0 or 255 for each bit"""
+    for i_bit in range(min(N_INDEX_BITS, frame.shape[1])):
+        frame[0, i_bit] = 255 if (i_frame >> i_bit) & 1 else 0
+
+
+def decode_frame_index(frame):
+    """Reads the index of a frame generated by :class:`SyntheticCamera`"""
+    bits = frame[0, :N_INDEX_BITS] > 127
+    return int(np.sum(bits.astype(np.int64) << np.arange(N_INDEX_BITS)))
+
+
+@jit(nopython=True, cache=True)
+def _draw_larva(frame, xs, ys, widths, value, eye_pos, eye_radius, eye_value):
+    """Draws a larva, as a chain of segments with decreasing width and two
+    eyes, darkening the frame with antialiased edges"""
+    h, w = frame.shape
+    for i_seg in range(len(xs) - 1):
+        x0, y0, x1, y1 = xs[i_seg], ys[i_seg], xs[i_seg + 1], ys[i_seg + 1]
+        dx, dy = x1 - x0, y1 - y0
+        seg_len2 = max(dx * dx + dy * dy, 1e-6)
+        r = max(widths[i_seg], widths[i_seg + 1]) + 1
+        for y in range(max(int(min(y0, y1) - r), 0), min(int(max(y0, y1) + r) + 1, h)):
+            for x in range(
+                max(int(min(x0, x1) - r), 0), min(int(max(x0, x1) + r) + 1, w)
+            ):
+                p = min(max(((x - x0) * dx + (y - y0) * dy) / seg_len2, 0.0), 1.0)
+                d = np.sqrt((x0 + p * dx - x) ** 2 + (y0 + p * dy - y) ** 2)
+                width = widths[i_seg] + p * (widths[i_seg + 1] - widths[i_seg])
+                alpha = min(max(width - d + 0.5, 0.0), 1.0)
+                new = frame[y, x] + alpha * (value - frame[y, x])
+                if new < frame[y, x]:
+                    frame[y, x] = new
+
+    for i_eye in range(eye_pos.shape[0]):
+        xe, ye = eye_pos[i_eye, 0], eye_pos[i_eye, 1]
+        for y in range(
+            max(int(ye - eye_radius - 1), 0), min(int(ye + eye_radius) + 2, h)
+        ):
+            for x in range(
+                max(int(xe - eye_radius - 1), 0), min(int(xe + eye_radius) + 2, w)
+            ):
+                d = np.sqrt((xe - x) ** 2 + (ye - y) ** 2)
+                alpha = min(max(eye_radius - d + 0.5, 0.0), 1.0)
+                new = frame[y, x] + alpha * (eye_value - frame[y, x])
+                if new < frame[y, x]:
+                    frame[y, x] = new
+
+
+class SyntheticCamera(Camera):
+    """Camera generating frames at a given framerate, for testing the
+    acquisition, tracking and stimulation without hardware.
+
+    The frames either show a procedurally animated larva, dark on a noisy
+    bright background, which performs regular bouts with a travelling
+    wave along the tail, or replay the frames of an HDF5 video file (such as
+    the ones in stytra/examples/assets), tiled to fill the frame.
+
+    The index of each frame is written in binary in the first pixels of
+    the first row, and can be read with :func:`decode_frame_index`. As the
+    animation depends only on the parameters of the camera and the frame
+    index, the ground-truth pose of the larva in any frame is given by
+    :meth:`pose`, also from another instance with the same parameters.
+
+    The frames are produced at the times given by the framerate. If they are
+    read too slowly, the frames which are late are skipped, as with a real
+    camera, and their indexes are missing.
+
+    Parameters
+    ----------
+    width : int
+        width of the frames (px), by default 640, or that of the video
+    height : int
+        height of the frames (px), by default 480, or that of the video
+    framerate : float
+        framerate (Hz), can be changed with set
+    video_file : str
+        HDF5 file with the video to replay, in the "video" entry,
+        instead of the larva
+    head_restrained : bool
+        if True, the larva moves only its tail, otherwise it swims
+        around the frame
+    fish_length : float
+        length of the larva (px)
+    n_segments : int
+        number of tail segments
+    bout_interval : float
+        time between the starts of bouts (s)
+    bout_duration : float
+        duration of the bouts (s)
+    tail_beat_frequency : float
+        frequency of the tail oscillation during bouts (Hz)
+    tail_amplitude : float
+        maximal angle of the tail tip during bouts (rad)
+    background : int
+        background level
+    fish_value : int
+        level of the body of the larva
+    eye_value : int
+        level of the eyes of the larva
+    noise : float
+        standard deviation of the background noise
+    seed : int
+        seed of the random bout parameters and of the noise
+
+    """
+
+    # number of noisy backgrounds used in turn
+    n_backgrounds = 8
+
+    def __init__(
+        self,
+        width=None,
+        height=None,
+        framerate=300.0,
+        video_file=None,
+        head_restrained=False,
+        fish_length=60.0,
+        n_segments=10,
+        bout_interval=1.0,
+        bout_duration=0.2,
+        tail_beat_frequency=30.0,
+        tail_amplitude=0.8,
+        background=200,
+        fish_value=80,
+        eye_value=20,
+        noise=4.0,
+        seed=0,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        # the default size of replayed videos is known when they are opened
+        self.width = width or (None if video_file else 640)
+        self.height = height or (None if video_file else 480)
+        self.framerate = framerate
+        self.video_file = video_file
+        self.head_restrained = head_restrained
+        self.fish_length = fish_length
+        self.n_segments = n_segments
+        self.bout_interval = bout_interval
+        self.bout_duration = bout_duration
+        self.tail_beat_frequency = tail_beat_frequency
+        self.tail_amplitude = tail_amplitude
+        self.background = background
+        self.fish_value = fish_value
+        self.eye_value = eye_value
+        self.noise = noise
+        self.seed = seed
+
+        self.video = None
+        self.backgrounds = None
+        # position and heading at the start of each bout, computed as needed
+        self.bout_starts = []
+
+        # time at which frame 0 is due, and index of the last frame read
+        self.t_start = None
+        self.i_frame = -1
+        self.last_pose = None
+
+    def open_camera(self):
+        if self.video_file is not None:
+            self.video = fl.load(self.video_file, "/video")
+            self.height = self.height or self.video.shape[1]
+            self.width = self.width or self.video.shape[2]
+            return [
+                "I:Synthetic camera replaying {} at {} Hz".format(
+                    self.video_file, self.framerate
+                )
+            ]
+
+        rng = np.random.default_rng(self.seed)
+        self.backgrounds = np.clip(
+            rng.normal(
+                self.background,
+                self.noise,
+                (self.n_backgrounds, self.height, self.width),
+            ),
+            0,
+            255,
+        ).astype(np.uint8)
+        # compile the drawing function before the first frame is due
+        self._draw(self.backgrounds[0].copy(), self.pose(0))
+        return [
+            "I:Synthetic camera with a {} larva, {}x{} at {} Hz".format(
+                "head-restrained" if self.head_restrained else "swimming",
+                self.width,
+                self.height,
+                self.framerate,
+            )
+        ]
+
+    def set(self, param, val):
+        if param == "framerate" and val > 0:
+            # continue from the last frame at the new framerate
+            if self.t_start is not None:
+                t_last = self.t_start + self.i_frame / self.framerate
+                self.t_start = t_last - self.i_frame / val
+            self.framerate = val
+
+    def _bout_params(self, i_bout):
+        """Turn angle (rad), distance travelled (px) and tail amplitude
+        of a bout"""
+        rng = np.random.default_rng([self.seed, i_bout])
+        turn, distance, amplitude = rng.normal(0, 1, 3)
+        return (
+            0.5 * turn,
+            self.fish_length * (0.5 + 0.2 * abs(distance)),
+            self.tail_amplitude * np.clip(1 + 0.2 * amplitude, 0.5, 1.5),
+        )
+
+    def _bout_start(self, i_bout):
+        """Position and heading of the head at the start of a bout"""
+        if not self.bout_starts:
+            self.bout_starts.append((self.width / 2, self.height / 2, 0.0))
+        while len(self.bout_starts) <= i_bout:
+            x, y, theta = self.bout_starts[-1]
+            turn, distance, _ = self._bout_params(len(self.bout_starts) - 1)
+            theta = self._turn_inwards(x, y, theta + turn, distance)
+            self.bout_starts.append(
+                (x + distance * np.cos(theta), y + distance * np.sin(theta), theta)
+            )
+        return self.bout_starts[i_bout]
+
+    def _turn_inwards(self, x, y, theta, distance):
+        """Turns the larva towards the centre if the bout would bring it
+        close to the border"""
+        margin = self.fish_length * 1.5
+        x_end, y_end = x + distance * np.cos(theta), y + distance * np.sin(theta)
+        if (
+            margin < x_end < self.width - margin
+            and margin < y_end < self.height - margin
+        ):
+            return theta
+        return np.arctan2(self.height / 2 - y, self.width / 2 - x)
+
+    def pose(self, i_frame):
+        """Ground-truth pose of the larva in a frame
+
+        Parameters
+        ----------
+        i_frame : int
+            index of the frame
+
+        Returns
+        -------
+        LarvaPose
+            pose of the larva, None if a video is replayed
+
+        """
+        if self.video_file is not None:
+            return None
+        t = i_frame / self.framerate
+        i_bout = int(t // self.bout_interval)
+        t_bout = t - i_bout * self.bout_interval
+        turn, distance, amplitude = self._bout_params(i_bout)
+        segment_angles = np.zeros(self.n_segments)
+        if self.head_restrained:
+            x, y, theta = self.width * 0.3, self.height / 2, 0.0
+        else:
+            x, y, theta = self._bout_start(i_bout)
+
+        swimming = t_bout < self.bout_duration
+        if swimming:
+            phase = t_bout / self.bout_duration
+            envelope = np.sin(np.pi * phase)
+            # travelling wave, increasing in amplitude towards the tail tip
+            position = np.arange(1, self.n_segments + 1) / self.n_segments
+            segment_angles = (
+                amplitude
+                * envelope
+                * position
+                * np.sin(2 * np.pi * (self.tail_beat_frequency * t_bout - position))
+            )
+            if not self.head_restrained:
+                progress = (1 - np.cos(np.pi * phase)) / 2
+                theta_end = self._bout_start(i_bout + 1)[2]
+                x_end, y_end = self._bout_start(i_bout + 1)[:2]
+                x, y = x + progress * (x_end - x), y + progress * (y_end - y)
+                theta = theta + progress * reduce_to_pi(theta_end - theta)
+        elif not self.head_restrained:
+            x, y, theta = self._bout_start(i_bout + 1)
+
+        # the tail points backwards from the heading
+        tail_angles = theta + np.pi + segment_angles
+        return LarvaPose(t, x, y, theta, swimming, tail_angles)
+
+    def _wait_for_frame(self):
+        """Waits until the next frame is due and returns its index,
+        skipping the frames which are already late"""
+        now = time.perf_counter()
+        if self.t_start is None:
+            self.t_start = now
+            return 0
+        i_next = max(self.i_frame + 1, int((now - self.t_start) * self.framerate))
+        t_due = self.t_start + i_next / self.framerate
+        while True:
+            remaining = t_due - time.perf_counter()
+            if remaining <= 0:
+                return i_next
+            # sleep is not precise enough for the last millisecond
+            time.sleep(remaining - 0.001 if remaining > 0.002 else 0)
+
+    def read(self):
+        return self.read_into(None)
+
+    def read_into(self, buffer):
+        if buffer is None or buffer.shape != (self.height, self.width):
+            buffer = np.empty((self.height, self.width), np.uint8)
+        self.i_frame = self._wait_for_frame()
+
+        if self.video is not None:
+            frame = self.video[self.i_frame % len(self.video)]
+            fh, fw = frame.shape
+            for y in range(0, self.height, fh):
+                for x in range(0, self.width, fw):
+                    tile = buffer[y : y + fh, x : x + fw]
+                    tile[...] = frame[: tile.shape[0], : tile.shape[1]]
+        else:
+            buffer[...] = self.backgrounds[self.i_frame % self.n_backgrounds]
+            self.last_pose = self.pose(self.i_frame)
+            self._draw(buffer, self.last_pose)
+
+        encode_frame_index(buffer, self.i_frame)
+        return buffer
+
+    def _draw(self, frame, pose):
+        segment_length = self.fish_length * 0.8 / self.n_segments
+        xs = pose.x + np.concatenate(
+            [[0.0], np.cumsum(segment_length * np.cos(pose.tail_angles))]
+        )
+        ys = pose.y + np.concatenate(
+            [[0.0], np.cumsum(segment_length * np.sin(pose.tail_angles))]
+        )
+        # the body extends a bit in front of the head point
+        head_length = self.fish_length * 0.2
+        xs = np.concatenate([[pose.x + head_length * np.cos(pose.theta)], xs])
+        ys = np.concatenate([[pose.y + head_length * np.sin(pose.theta)], ys])
+        w_max = self.fish_length * 0.07
+        widths = np.concatenate([[w_max], np.linspace(w_max, 0.5, self.n_segments + 1)])
+        eye_offset = self.fish_length * 0.06
+        eye_center = np.array(
+            [
+                pose.x + head_length * 0.6 * np.cos(pose.theta),
+                pose.y + head_length * 0.6 * np.sin(pose.theta),
+            ]
+        )
+        normal = np.array([-np.sin(pose.theta), np.cos(pose.theta)])
+        eye_pos = np.stack(
+            [eye_center + eye_offset * normal, eye_center - eye_offset * normal]
+        )
+        _draw_larva(
+            frame,
+            xs,
+            ys,
+            widths,
+            float(self.fish_value),
+            eye_pos,
+            self.fish_length * 0.05,
+            float(self.eye_value),
+        )
@@ -0,0 +1,291 @@
+import ctypes
+from datetime import datetime
+from multiprocessing import Array, RawArray, Queue
+from queue import Empty, Full
+
+import numpy as np
+
+# slots start at multiples of this number of bytes
+_SLOT_ALIGNMENT = 64
+
+
+class FramePool:
+    """Pool of frame slots in shared memory, in which each frame is written
+    once and then handed to any number of consumers, in this or other
+    processes, as the index of its slot. Each slot has a reference count of
+    the consumers which still have to read it, and it is reused once all
+    of them released it.
+
+    The consumers take the frames from :class:`FrameChannel` objects, created
+    with :meth:`channel` before the processes using them are started.
+
+    Parameters
+    ----------
+    max_mbytes : float
+        size of the pool in megabytes
+    max_slots : int
+        maximal number of slots, for small frames
+
+    """
+
+    def __init__(self, max_mbytes=200, max_slots=1024):
+        self.nbytes = int(max_mbytes * 1000000)
+        self.buffer = RawArray(ctypes.c_uint8, self.nbytes)
+        self.refcounts = Array(ctypes.c_int32, max_slots)
+        # start and size of the slots in bytes
+        self.offsets = RawArray(ctypes.c_int64, max_slots)
+        self.sizes = RawArray(ctypes.c_int64, max_slots)
+        # number of slots, next slot to be used and end of the last slot
+        self.layout = RawArray(ctypes.c_int64, 3)
+        self._view = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_view"] = None
+        return state
+
+    def channel(self, indexed=False, maxsize=None):
+        """Creates a new channel through which frames of the pool are sent
+        to a consumer, see :class:`FrameChannel`"""
+        return FrameChannel(self, indexed=indexed, maxsize=maxsize)
+
+    @property
+    def n_slots(self):
+        return self.layout[0]
+
+    def _allocate(self, nbytes, n_refs):
+        """Finds a free slot for an array of nbytes and reserves it
+        for n_refs consumers. If no free slot is large enough, one is added
+        after the last slot in use, or made by merging consecutive free
+        slots, so that frames of a new size do not have to wait for the
+        ones of the previous size to be released"""
+        slot_bytes = -(-nbytes // _SLOT_ALIGNMENT) * _SLOT_ALIGNMENT
+        if slot_bytes > self.nbytes:
+            raise ValueError("Frame of {} bytes larger than the pool".format(nbytes))
+
+        with self.refcounts.get_lock():
+            refcounts = self.refcounts.get_obj()
+            n_slots, next_slot, end = self.layout
+
+            for i in range(n_slots):
+                slot = (next_slot + i) % n_slots
+                if refcounts[slot] == 0 and self.sizes[slot] >= nbytes:
+                    return self._reserve_slot(slot, n_refs)
+
+            # the free slots at the end are too small, the space they take
+            # is used for a new slot
+            while n_slots > 0 and refcounts[n_slots - 1] == 0:
+                n_slots -= 1
+                end = self.offsets[n_slots]
+            self.layout[0] = n_slots
+            self.layout[2] = end
+            if n_slots < len(refcounts) and end + slot_bytes <= self.nbytes:
+                self.offsets[n_slots] = end
+                self.sizes[n_slots] = slot_bytes
+                self.layout[0] = n_slots + 1
+                self.layout[2] = end + slot_bytes
+                return self._reserve_slot(n_slots, n_refs)
+
+            # consecutive free slots are merged into the first one, the
+            # others are left empty at the end of the merged slot
+            for first in range(n_slots):
+                for last in range(first, n_slots):
+                    if refcounts[last] != 0:
+                        break
+                    merged = self.offsets[last] + self.sizes[last] - self.offsets[first]
+                    if merged >= nbytes:
+                        for slot in range(first + 1, last + 1):
+                            self.offsets[slot] = self.offsets[first] + merged
+                            self.sizes[slot] = 0
+                        self.sizes[first] = merged
+                        return self._reserve_slot(first, n_refs)
+        raise Full("All the {} slots of the frame pool are in use".format(n_slots))
+
+    def _reserve_slot(self, slot, n_refs):
+        self.refcounts.get_obj()[slot] = n_refs
+        self.layout[1] = slot + 1
+        return slot
+
+    def view(self, slot, dtype, shape):
+        """Array stored in a slot, without copying"""
+        if self._view is None:
+            self._view = np.frombuffer(self.buffer, np.uint8)
+        dtype = np.dtype(dtype)
+        start = self.offsets[slot]
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._view[start : start + nbytes].view(dtype).reshape(shape)
+
+    def reserve(self, dtype, shape, n_refs):
+        """Reserves a slot for an array which is going to be written
+        directly in it (through :meth:`view`) and then sent to n_refs
+        consumers with :meth:`send`
+
+        Raises
+        ------
+        Full
+            if no slot is free
+
+        """
+        return self._allocate(int(np.prod(shape)) * np.dtype(dtype).itemsize, n_refs)
+
+    def send(self, slot, dtype, shape, timestamp=None, index=None, channels=()):
+        """Sends the array written in a reserved slot to the channels, which
+        have to be as many as the references it was reserved for"""
+        item = (
+            datetime.now() if timestamp is None else timestamp,
+            index,
+            slot,
+            np.dtype(dtype).str,
+            tuple(shape),
+        )
+        for channel in channels:
+            channel.queue.put(item)
+
+    def put(self, array, timestamp=None, index=None, channels=()):
+        """Writes an array in a free slot and sends it to the channels
+
+        Parameters
+        ----------
+        array : np.ndarray
+            frame to be stored
+        timestamp
+            time of the frame, now by default
+        index : int
+            index of the frame, for indexed channels
+        channels : list of FrameChannel
+            consumers of the frame
+
+        Raises
+        ------
+        Full
+            if no slot is free
+
+        """
+        if len(channels) == 0:
+            return
+        slot = self.reserve(array.dtype, array.shape, len(channels))
+        self.view(slot, array.dtype, array.shape)[...] = array
+        self.send(slot, array.dtype, array.shape, timestamp, index, channels)
+
+    def retain(self, slot, n=1):
+        with self.refcounts.get_lock():
+            self.refcounts[slot] += n
+
+    def release(self, slot, n=1):
+        with self.refcounts.get_lock():
+            self.refcounts[slot] -= n
+
+    def n_used(self):
+        """Number of slots which have not been released by all consumers"""
+        with self.refcounts.get_lock():
+            return sum(1 for r in self.refcounts[: self.n_slots] if r > 0)
+
+
+class FrameChannel:
+    """Queue of frames stored in a :class:`FramePool`, through which they
+    are passed to one consumer. It can be used in place of the queues of the
+    arrayqueues package: get returns (time, frame) or, if indexed,
+    (time, index, frame), and put writes an array to the pool.
+
+    As with arrayqueues, the frame returned by get is a view in shared memory,
+    valid until the next call to get (or to release). It can be passed on
+    to other channels with share without being copied.
+
+    Parameters
+    ----------
+    pool : FramePool
+    indexed : bool
+        whether get returns the frame index as well
+    maxsize : int
+        maximal number of frames waiting in the channel, beyond which
+        put and share raise Full
+
+    """
+
+    def __init__(self, pool, indexed=False, maxsize=None):
+        self.pool = pool
+        self.indexed = indexed
+        self.maxsize = maxsize
+        self.queue = Queue()
+        self.counter = 0
+        self._held = None
+        self._held_frame = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_held"] = None
+        state["_held_frame"] = None
+        return state
+
+    def _check_full(self):
+        if self.maxsize is None:
+            return
+        try:
+            if self.queue.qsize() >= self.maxsize:
+                raise Full("Frame channel full")
+        except NotImplementedError:
+            pass
+
+    def put(self, element, timestamp=None):
+        """Writes an array to a slot of the pool and sends it through
+        this channel"""
+        self._check_full()
+        self.pool.put(element, timestamp, self.counter, channels=(self,))
+        self.counter += 1
+
+    def get(self, **kwargs):
+        """Returns the next frame, after releasing the previous one"""
+        self.release()
+        timestamp, index, slot, dtype, shape = self.queue.get(**kwargs)
+        self._held = (timestamp, index, slot, dtype, shape)
+        self._held_frame = self.pool.view(slot, dtype, shape)
+        if self.indexed:
+            return timestamp, index, self._held_frame
+        return timestamp, self._held_frame
+
+    def release(self):
+        """Releases the frame returned by the last get"""
+        if self._held is not None:
+            self.pool.release(self._held[2])
+            self._held = None
+            self._held_frame = None
+
+    def share(self, frame, channel, timestamp=None):
+        """Sends a frame to another channel. If it is the frame returned by
+        the last get, only its slot is passed on, otherwise it is written
+        to the pool.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+        channel : FrameChannel
+            destination channel
+        timestamp
+            time sent with the frame, by default that of the frame
+
+        """
+        if self._held is None or frame is not self._held_frame:
+            channel.put(frame, timestamp)
+            return
+        channel._check_full()
+        item = self._held
+        if timestamp is not None:
+            item = (timestamp,) + item[1:]
+        self.pool.retain(item[2])
+        channel.queue.put(item)
+
+    def clear(self):
+        """Releases all the frames waiting in the channel"""
+        self.release()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            self.pool.release(item[2])
+
+    def empty(self):
+        return self.queue.empty()
+
+    def qsize(self):
+        return self.queue.qsize()
@@ -0,0 +1,270 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+import cv2
+import numpy as np
+import tables
+
+
+def has_video_node(path):
+    """Whether the frames of a .h5 file are stored in the /video node,
+    as saved by stytra, in which case they can be read lazily"""
+    with tables.open_file(str(path), "r") as f:
+        return "/video" in f
+
+
+class PrefetchingVideoReader(Thread):
+    """Base class for reading the frames of a video in a background thread,
+    which keeps a limited number of frames ready to be taken with get.
+    Subclasses implement read_frames, which has to pass each frame to _put.
+
+    Parameters
+    ----------
+    start : int
+        first frame, also where the video restarts when looping
+    loop : bool
+        restart from the start frame when the end of the video is reached
+    n_prefetch : int
+        number of frames read in advance
+
+    """
+
+    def __init__(self, start=0, loop=True, n_prefetch=64):
+        super().__init__(daemon=True)
+        self.start_frame = start
+        self.loop = loop
+        self.n_prefetch = n_prefetch
+        self.frame_queue = Queue(maxsize=n_prefetch)
+        self.stop_event = Event()
+
+    def read_frames(self):
+        """Reads the whole video once, from the start frame, returns
+        False if the reader was stopped in the meantime"""
+        raise NotImplementedError
+
+    def run(self):
+        try:
+            while self.read_frames():
+                if not self.loop:
+                    self._put(None)
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        """Puts an item in the queue, waiting if it is full, unless the
+        reader is stopped. Returns False if stopped"""
+        while not self.stop_event.is_set():
+            try:
+                self.frame_queue.put(item, timeout=0.01)
+                return True
+            except Full:
+                pass
+        return False
+
+    def get(self, timeout=None):
+        """Returns the next frame, or None if the end of the video is reached
+        and the reader is not looping"""
+        item = self.frame_queue.get(timeout=timeout)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self):
+        self.stop_event.set()
+        # free the queue so that the thread is not blocked
+        while True:
+            try:
+                self.frame_queue.get_nowait()
+            except Empty:
+                break
+        if self.is_alive():
+            self.join()
+
+
+class H5VideoReader(PrefetchingVideoReader):
+    """Reads the frames of a video stored in an HDF5 file without loading it
+    in memory. Blocks of frames aligned to the chunks of the dataset are read
+    in advance, so that the start-up time and the memory used do not depend
+    on the length of the video.
+
+    Parameters
+    ----------
+    path : str or Path
+        path of the .h5 file
+    node : str
+        node of the file containing the frames
+
+    """
+
+    def __init__(self, path, node="/video", **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path)
+        self.node = node
+
+        with tables.open_file(self.path, "r") as f:
+            dataset = f.get_node(self.node)
+            self.n_frames = dataset.shape[0]
+            self.frame_shape = dataset.shape[1:]
+            chunkshape = dataset.chunkshape
+        # read at least a whole chunk at once, but not more than half of the
+        # prefetched frames
+        chunk_frames = chunkshape[0] if chunkshape is not None else 1
+        self.block_frames = max(min(max(chunk_frames, 8), self.n_prefetch // 2), 1)
+
+        if not 0 <= self.start_frame < self.n_frames:
+            raise ValueError(
+                "Start frame {} outside of the video with {} frames".format(
+                    self.start_frame, self.n_frames
+                )
+            )
+
+    def read_frames(self):
+        with tables.open_file(self.path, "r") as f:
+            dataset = f.get_node(self.node)
+            i_frame = self.start_frame
+            while i_frame < self.n_frames:
+                # align the blocks to the chunks after the first one
+                i_end = min(
+                    (i_frame // self.block_frames + 1) * self.block_frames,
+                    self.n_frames,
+                )
+                for frame in dataset[i_frame:i_end]:
+                    if not self._put(frame):
+                        return False
+                i_frame = i_end
+        return True
+
+
+class ArrayVideoReader(PrefetchingVideoReader):
+    """Serves the frames of a video already loaded in memory, with the same
+    interface as the other readers
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        array of frames, with time as the first dimension
+
+    """
+
+    def __init__(self, frames, **kwargs):
+        super().__init__(**kwargs)
+        self.frames = frames
+
+    def read_frames(self):
+        for frame in self.frames[self.start_frame :]:
+            if not self._put(frame):
+                return False
+        return True
+
+
+# Lookup table to expand the luma of limited range (MPEG) videos to 0-255,
+# as done when converting to RGB or gray
+_LIMITED_TO_FULL_RANGE = np.clip(
+    np.round((np.arange(256) - 16) * 255 / 219), 0, 255
+).astype(np.uint8)
+
+# pixel formats of 8 bits per sample whose first plane is the luma
+_LUMA_FORMATS = {
+    "gray",
+    "nv12",
+    "nv21",
+    "yuv410p",
+    "yuv411p",
+    "yuv420p",
+    "yuv422p",
+    "yuv440p",
+    "yuv444p",
+    "yuvj411p",
+    "yuvj420p",
+    "yuvj422p",
+    "yuvj440p",
+    "yuvj444p",
+}
+_COLOR_RANGE_JPEG = 2
+
+
+def _plane_array(frame, i_plane):
+    """View of a plane of a PyAV frame of 8 bits per sample and of the same
+    size as the frame, without the padding of the lines"""
+    plane = frame.planes[i_plane]
+    return np.frombuffer(plane, np.uint8).reshape(frame.height, plane.line_size)[
+        :, : frame.width
+    ]
+
+
+def av_frame_to_gray(frame, channel=0):
+    """Grayscale image of a decoded PyAV frame, one channel of the frame
+    converted to RGB or, without converting it, its luma plane
+
+    Parameters
+    ----------
+    frame : av.VideoFrame
+    channel : int or None
+        RGB channel taken, the red one by default. If None, for the usual
+        video pixel formats the luma plane is taken directly, which is
+        faster, and equal to the channels of videos without colour up to
+        a few levels of rounding
+
+    Returns
+    -------
+    np.ndarray
+        uint8 image
+
+    """
+    fmt = frame.format.name
+    if channel is not None and fmt != "gray":
+        # converted to planar RGB, in which the planes are green, blue, red
+        planar = frame.reformat(format="gbrp")
+        return _plane_array(planar, (2, 0, 1)[channel]).copy()
+    if fmt not in _LUMA_FORMATS:
+        return frame.to_ndarray(format="gray")
+
+    luma = _plane_array(frame, 0)
+    if (
+        fmt == "gray"
+        or fmt.startswith("yuvj")
+        or getattr(frame, "color_range", None) == _COLOR_RANGE_JPEG
+    ):
+        return luma.copy()
+    return cv2.LUT(luma, _LIMITED_TO_FULL_RANGE)
+
+
+class AvVideoReader(PrefetchingVideoReader):
+    """Decodes a video with PyAV (any format supported by ffmpeg) into
+    grayscale frames, in a background thread
+
+    Parameters
+    ----------
+    path : str or Path
+        path of the video
+    decoder_threads : int
+        number of threads used by the decoder
+    channel : int or None
+        RGB channel of the frames which is kept, or None for their luma,
+        see :func:`av_frame_to_gray`
+
+    """
+
+    def __init__(self, path, decoder_threads=1, n_prefetch=16, channel=0, **kwargs):
+        super().__init__(n_prefetch=n_prefetch, **kwargs)
+        self.path = str(path)
+        self.decoder_threads = decoder_threads
+        self.channel = channel
+
+    def read_frames(self):
+        import av
+
+        container = av.open(self.path)
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            stream.thread_count = self.decoder_threads
+            for i_frame, framedata in enumerate(container.decode(stream)):
+                if i_frame < self.start_frame:
+                    continue
+                if not self._put(av_frame_to_gray(framedata, self.channel)):
+                    return False
+        finally:
+            container.close()
+        return True
@@ -1,3 +1,5 @@
+import time
+
 import numpy as np
 
 
@@ -5,11 +7,12 @@ class RingBuffer:
     def __init__(self, length):
         self.length = length
         self.arr = None
+        self.times = None
         self.insert_idx = length - 1
         self.read_idx = 0
         self.replay_limits = (0, self.length)
 
-    def put(self, item):
+    def put(self, item, t=None):
         try:
             if (
                 self.arr is None
@@ -18,8 +21,10 @@ class RingBuffer:
             ):
                 self.insert_idx = 0
                 self.arr = np.zeros((self.length,) + item.shape, item.dtype)
+                self.times = np.full(self.length, np.nan)
 
             self.arr[self.insert_idx] = item
+            self.times[self.insert_idx] = time.time() if t is None else t
             self.insert_idx = (self.insert_idx + 1) % self.length
             self.read_idx = 0
         except AttributeError as e:
@@ -38,3 +43,24 @@ class RingBuffer:
 
     def get_most_recent(self):
         return self.arr[(self.insert_idx + 1) % self.length]
+
+    def detach(self):
+        """Hands over the stored frames and empties the buffer, without
+        copying them, so that they can be saved while new frames are put in
+        a new array
+
+        Returns
+        -------
+        tuple
+            the frames, their times (NaN for the slots which were not
+            filled) and the index of the oldest frame
+
+        """
+        if self.arr is None:
+            raise ValueError("Trying to detach an empty buffer")
+        contents = (self.arr, self.times, self.insert_idx)
+        self.arr = None
+        self.times = None
+        self.insert_idx = self.length - 1
+        self.read_idx = 0
+        return contents
@@ -1,10 +1,14 @@
 import numpy as np
-import flammkuchen as fl
+import tables
 
 from stytra.utilities import FrameProcess
 from multiprocessing import Queue, Event
-from queue import Empty
+from queue import Empty, Full
+from queue import Queue as ThreadQueue
+from collections import deque
+from threading import Thread
 from pathlib import Path
+from datetime import datetime
 from stytra.utilities import save_df
 import pandas as pd
 
@@ -17,6 +21,57 @@ except ImportError:
     print("PyAv not installed, writing videos in formats other than H5 not possible.")
 
 
+def save_ring_buffer(
+    filename: str,
+    frames: np.ndarray,
+    times: np.ndarray,
+    i_oldest: int = 0,
+    complib: str = "blosc",
+    complevel: int = 5,
+) -> int:
+    """
+    Writes the contents of a ring buffer in chronological order to a HDF5 file with the same layout as
+    the recordings of H5VideoWriter, the frames in /video and their POSIX timestamps in /times.
+
+    Parameters
+    ----------
+    filename
+        path of the file.
+    frames
+        array of frames, as stored in the ring buffer.
+    times
+        times of the frames, NaN for the slots that were never filled.
+    i_oldest
+        index of the oldest frame in the buffer.
+    complib
+        compression library, as in PyTables.
+    complevel
+        compression level, 0 for no compression.
+
+    Returns
+    -------
+    int
+        the number of frames saved.
+    """
+    order = np.roll(np.arange(len(frames)), -i_oldest)
+    order = order[~np.isnan(times[order])]
+    with tables.open_file(str(filename), mode="w") as f:
+        video = f.create_earray(
+            "/",
+            "video",
+            tables.Atom.from_dtype(frames.dtype),
+            shape=(0,) + frames.shape[1:],
+            filters=tables.Filters(complib=complib, complevel=complevel),
+            expectedrows=len(order),
+        )
+        # the frames are written in the two contiguous parts of the buffer
+        for part in np.split(order, np.flatnonzero(np.diff(order) != 1) + 1):
+            if len(part) > 0:
+                video.append(frames[part[0] : part[-1] + 1])
+        f.create_array("/", "times", times[order])
+    return len(order)
+
+
 class VideoWriter(FrameProcess):
     """
     Allows for recording the camera frames during the experiment and save it to disk.
@@ -92,7 +147,8 @@ class VideoWriter(FrameProcess):
                     is_recording = True
                 else:
                     self._ingest_frame(current_frame)
-                    self._times.append(t)
+                    self._ingest_time(t)
+                    self.update_framerate()
             elif not self.recording_event.is_set():
                 # We are not recording.
                 if is_recording:
@@ -112,8 +168,6 @@ class VideoWriter(FrameProcess):
                     self._reset()
                     is_recording = False
 
-            self.framerate_rec.update_framerate()
-
     def _configure(self, size: np.ndarray.shape) -> None:
         """ "
         Runs the necessary configuration before the recording starts.
@@ -147,6 +201,18 @@ class VideoWriter(FrameProcess):
         """
         raise NotImplementedError("Should be implemented by subclass.")
 
+    def _ingest_time(self, t: datetime) -> None:
+        """ "
+        Stores the timestamp of the frame which was just ingested.
+        Can be overridden by subclasses which save the times as they arrive.
+
+        Parameters
+        ----------
+        t
+            the time at which the frame was acquired.
+        """
+        self._times.append(t)
+
     def _complete(self, filename: str) -> None:
         """ "
         Saves a dataframe containing the timestamps of all the frames.
@@ -193,29 +259,297 @@ class VideoWriter(FrameProcess):
 
 class H5VideoWriter(VideoWriter):
     """
-    Writes the recorded frames to a HDF5 file.
+    Writes the recorded frames to a HDF5 file, as they arrive. The frames are
+    appended in batches to a chunked and compressed /video dataset, and their
+    times (as POSIX timestamps) to a /times dataset, so that the memory used
+    does not depend on the length of the recording.
     """
 
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(
+        self,
+        *args,
+        batch_frames: int = 32,
+        chunk_bytes: int = 2**20,
+        complib: str = "blosc",
+        complevel: int = 5,
+        **kwargs
+    ) -> None:
+        """
+        Parameters
+        ----------
+        batch_frames
+            number of frames kept in memory before they are written to the file.
+        chunk_bytes
+            approximate size of the chunks of the dataset.
+        complib
+            compression library, as in PyTables.
+        complevel
+            compression level, 0 for no compression.
+        """
         super().__init__(*args, **kwargs)
-        self._frames = []
+        self._batch_frames = batch_frames
+        self._chunk_bytes = chunk_bytes
+        self._filters = tables.Filters(complib=complib, complevel=complevel)
+        self._file = None
+        self._video = None
+        self._video_times = None
+        self._frame_batch = None
+        self._time_batch = None
+        self._n_batch = 0
+        self.__filename = self.__generate_filename(self.CONST_FALLBACK_FILENAME)
+
+    @staticmethod
+    def __generate_filename(filename: str) -> str:
+        return str(filename) + "video.hdf5"
 
-    def _reset(self) -> None:
-        super()._reset()
-        self._frames = []
+    def _configure(self, shape: np.ndarray.shape) -> None:
+        """
+        Creates the file with resizable datasets for the frames and their times.
+
+        Parameters
+        ----------
+        shape
+            the shape of the frames.
+        """
+        super()._configure(shape)
+        if self._get_filename_base() is not None:
+            self.__filename = self.__generate_filename(self._get_filename_base())
+
+        frame_bytes = int(np.prod(shape))
+        self._file = tables.open_file(self.__filename, mode="w")
+        self._video = self._file.create_earray(
+            "/",
+            "video",
+            tables.UInt8Atom(),
+            shape=(0,) + tuple(shape),
+            chunkshape=(max(1, self._chunk_bytes // frame_bytes),) + tuple(shape),
+            filters=self._filters,
+        )
+        self._video_times = self._file.create_earray(
+            "/", "times", tables.Float64Atom(), shape=(0,)
+        )
+        self._frame_batch = np.empty((self._batch_frames,) + tuple(shape), np.uint8)
+        self._time_batch = np.empty(self._batch_frames)
+        self._n_batch = 0
 
     def _ingest_frame(self, frame) -> None:
         """
-        Appends the frames to an array.
+        Adds the frame to the current batch.
         """
-        self._frames.append(frame)
+        self._frame_batch[self._n_batch] = frame
+
+    def _ingest_time(self, t) -> None:
+        """
+        Adds the time to the current batch and writes the batch if it is full.
+        """
+        self._time_batch[self._n_batch] = (
+            t.timestamp() if isinstance(t, datetime) else t
+        )
+        self._n_batch += 1
+        if self._n_batch == self._batch_frames:
+            self._write_batch()
+
+    def _write_batch(self) -> None:
+        self._video.append(self._frame_batch[: self._n_batch])
+        self._video_times.append(self._time_batch[: self._n_batch])
+        self._n_batch = 0
 
     def _complete(self, filename) -> None:
         """
-        Writes the frames to a hdf5 file.
+        Writes the remaining frames and closes the hdf5 file.
         """
+        self._write_batch()
+        times = self._video_times[:]
+        self._close()
+
+        self._times = [datetime.fromtimestamp(t) for t in times]
         super()._complete(filename)
-        fl.save(filename + "video.hdf5", np.array(self._frames, dtype=np.uint8))
+
+        # If the fallback filename was used, rename the file
+        generated_filename = self.__generate_filename(filename)
+        if generated_filename != self.__filename:
+            os.replace(self.__filename, generated_filename)
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._video = None
+        self._video_times = None
+        self._frame_batch = None
+        self._time_batch = None
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._close()
+        self.__filename = self.__generate_filename(self.CONST_FALLBACK_FILENAME)
+
+
+class BoutTriggeredVideoWriter(H5VideoWriter):
+    """
+        Records only the frames around the bouts detected during the experiment, to a HDF5 file as H5VideoWriter.
+
+        The beginning and the end of each bout are sent as ("start", t) and ("stop", t) to the trigger_queue, with t the
+        POSIX timestamp of the frame at which they were detected, e.g. by a
+        :class:`BoutRecordingTrigger <stytra.tracking.online_bouts.BoutRecordingTrigger>`. As the bouts are detected with
+        some delay, the frames of the last pad_before + max_trigger_delay seconds are kept in a pre-buffer, from which the
+    padding before the bout is taken.
+        The segments are listed in a video_segments table, with the indices of their first and last (excluded) frames in
+        the video and their times, absolute and from the protocol start (which is sent as ("t0", t)).
+    """
+
+    def __init__(
+        self,
+        *args,
+        pad_before: float = 0.5,
+        pad_after: float = 0.5,
+        max_trigger_delay: float = 1.0,
+        max_buffer_frames: int = None,
+        **kwargs
+    ) -> None:
+        """
+        Parameters
+        ----------
+        pad_before
+            seconds recorded before the start of each bout.
+        pad_after
+            seconds recorded after the end of each bout.
+        max_trigger_delay
+            maximal delay (in seconds) between a frame and the detection of a bout starting at that frame.
+        max_buffer_frames
+            maximal number of frames kept in the pre-buffer, by default as many as arrive in
+            pad_before + max_trigger_delay. If the frames which are dropped because of it could still be part of a
+            bout, a warning is sent.
+        """
+        super().__init__(*args, **kwargs)
+        self.trigger_queue = Queue()
+        self._pad_before = pad_before
+        self._pad_after = pad_after
+        self._keep_time = pad_before + max_trigger_delay
+        self._max_buffer_frames = max_buffer_frames
+        self._buffer = deque()
+        self._n_evicted = 0
+        self._windows = []
+        self._segments = []
+        self._t0 = None
+        self._n_written = 0
+        self._next_frame = None
+
+    def _read_triggers(self) -> None:
+        while True:
+            try:
+                event, t = self.trigger_queue.get_nowait()
+            except Empty:
+                break
+            if event == "t0":
+                self._t0 = t
+            elif event == "start":
+                start = t - self._pad_before
+                if len(self._windows) > 0 and start <= self._windows[-1][1]:
+                    # the bout starts within the padding of the previous one
+                    self._windows[-1][1] = np.inf
+                else:
+                    self._windows.append([start, np.inf])
+            elif event == "stop" and len(self._windows) > 0:
+                self._windows[-1][1] = t + self._pad_after
+
+    def _ingest_frame(self, frame: np.ndarray) -> None:
+        """
+        Keeps the frame until its time is ingested.
+        """
+        self._next_frame = frame
+
+    def _ingest_time(self, t) -> None:
+        """
+        Puts the frame in the pre-buffer and writes the buffered frames which are within the time windows around
+        the bouts.
+        """
+        t = t.timestamp() if isinstance(t, datetime) else t
+        if (
+            self._max_buffer_frames is not None
+            and len(self._buffer) >= self._max_buffer_frames
+        ):
+            t_evicted, _ = self._buffer.popleft()
+            if t_evicted >= t - self._keep_time:
+                if self._n_evicted == 0:
+                    self.message_queue.put(
+                        "W:Bout pre-buffer of {} frames shorter than {:.2f} s".format(
+                            self._max_buffer_frames, self._keep_time
+                        )
+                    )
+                self._n_evicted += 1
+        # frames from the input queue have to be copied to be kept
+        self._buffer.append((t, np.array(self._next_frame)))
+        self._next_frame = None
+        self._read_triggers()
+        self._write_buffered(t)
+
+    def _write_buffered(self, t_now: float) -> None:
+        while len(self._buffer) > 0:
+            t, frame = self._buffer[0]
+            if len(self._windows) > 0 and self._windows[0][0] <= t:
+                if t <= self._windows[0][1]:
+                    self._write_frame(t, frame)
+                    self._buffer.popleft()
+                    continue
+                # the window is over
+                self._windows.pop(0)
+                self._close_segment()
+                continue
+            if t < t_now - self._keep_time or len(self._windows) > 0:
+                # the frame cannot be part of a bout anymore
+                self._buffer.popleft()
+                continue
+            break
+
+    def _write_frame(self, t: float, frame: np.ndarray) -> None:
+        if len(self._segments) == 0 or self._segments[-1]["i_end"] is not None:
+            self._segments.append(dict(i_start=self._n_written, i_end=None, t_start=t))
+        super()._ingest_frame(frame)
+        super()._ingest_time(t)
+        self._n_written += 1
+        self._segments[-1]["t_end"] = t
+
+    def _close_segment(self) -> None:
+        if len(self._segments) > 0 and self._segments[-1]["i_end"] is None:
+            self._segments[-1]["i_end"] = self._n_written
+
+    def _complete(self, filename: str) -> None:
+        """
+        Writes the frames of the last segment and saves the table of segments.
+        """
+        self._read_triggers()
+        if len(self._buffer) > 0:
+            self._write_buffered(self._buffer[-1][0])
+        self._close_segment()
+
+        segments = pd.DataFrame(
+            self._segments, columns=["i_start", "i_end", "t_start", "t_end"]
+        )
+        if self._t0 is not None:
+            segments["t_protocol_start"] = segments.t_start - self._t0
+            segments["t_protocol_end"] = segments.t_end - self._t0
+        save_df(
+            segments.rename_axis("segment"),
+            Path(str(filename) + "video_segments"),
+            self._log_format,
+        )
+        if self._n_evicted > 0:
+            self.message_queue.put(
+                "W:Dropped {} frames from the bout pre-buffer before they were "
+                "{:.2f} s old".format(self._n_evicted, self._keep_time)
+            )
+        super()._complete(filename)
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._buffer.clear()
+        self._n_evicted = 0
+        self._windows = []
+        self._segments = []
+        self._t0 = None
+        self._n_written = 0
+        self._next_frame = None
 
 
 class StreamingVideoWriter(VideoWriter):
@@ -332,3 +666,172 @@ class StreamingVideoWriter(VideoWriter):
         generated_filename = self.__generate_filename(self._get_filename_base())
         if generated_filename != self.__container_filename:
             os.rename(self.__container_filename, generated_filename)
+
+
+class LosslessVideoWriter(StreamingVideoWriter):
+    """
+    Writes the recorded frames losslessly with the FFV1 codec (in a .mkv file
+    by default), which is fast enough for high-speed cameras as each frame is
+    split in slices compressed in parallel by a pool of encoder threads.
+
+    The frames are encoded in a separate thread, so that the writer keeps
+    taking frames from the input queue while they are compressed. If more
+    than max_pending_frames are waiting to be encoded, the new frames are
+    dropped. The throughput (in MB/s of uncompressed frames), the compression
+    ratio and the number of dropped frames are reported every time the
+    recording framerate is updated.
+    """
+
+    def __init__(
+        self,
+        *args,
+        extension: str = "mkv",
+        n_threads: int = 4,
+        n_slices: int = 16,
+        max_pending_frames: int = 256,
+        **kwargs
+    ) -> None:
+        """
+        Parameters
+        ----------
+        extension
+            the extension of the video file name, the container has to support FFV1 (e.g. mkv or avi).
+        n_threads
+            number of threads compressing the slices of each frame.
+        n_slices
+            number of slices each frame is divided into, one of 4, 6, 9, 12, 16, 24, 30...
+        max_pending_frames
+            maximum number of frames waiting to be encoded, beyond which frames are dropped.
+        """
+        super().__init__(*args, extension=extension, format="ffv1", **kwargs)
+        self._n_threads = n_threads
+        self._n_slices = n_slices
+        self._max_pending_frames = max_pending_frames
+
+        self.throughput_queue = Queue()
+        self.compression_queue = Queue()
+
+        self._pending_frames = None
+        self._encoder_thread = None
+        self._next_frame = None
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self._n_encoded = 0
+        self._n_dropped = 0
+        self._raw_bytes = 0
+        self._compressed_bytes = 0
+        self._last_report = (datetime.now(), 0, 0)
+
+    def _configure(self, shape: np.ndarray.shape) -> None:
+        """
+        Sets up the FFV1 stream and starts the encoding thread.
+
+        Parameters
+        ----------
+        shape
+            the width and height of the stream, should correspond to the shape of the frames.
+        """
+        super()._configure(shape)
+        self._stream.pix_fmt = "gray"
+        self._stream.codec_context.thread_type = "SLICE"
+        self._stream.codec_context.thread_count = self._n_threads
+        # version 3 of the codec is needed for slices and threading,
+        # and every frame is a key frame
+        self._stream.options = dict(
+            level="3", slices=str(self._n_slices), slicecrc="0", g="1"
+        )
+        self._reset_counters()
+
+        self._pending_frames = ThreadQueue(maxsize=self._max_pending_frames)
+        self._encoder_thread = Thread(target=self._encode_frames, daemon=True)
+        self._encoder_thread.start()
+
+    def _encode_frames(self) -> None:
+        """
+        Encodes the frames waiting in the queue until None is received.
+        """
+        while True:
+            frame = self._pending_frames.get()
+            if frame is None:
+                break
+            av_frame = av.VideoFrame.from_ndarray(frame, format="gray8")
+            for packet in self._stream.encode(av_frame):
+                self._compressed_bytes += packet.size
+                self._container.mux(packet)
+            self._raw_bytes += frame.nbytes
+            self._n_encoded += 1
+
+    def _ingest_frame(self, frame: np.ndarray) -> None:
+        """
+        Keeps the frame until its time is ingested.
+        """
+        self._next_frame = frame
+
+    def _ingest_time(self, t: datetime) -> None:
+        """
+        Passes the frame to the encoding thread, or drops it if too many frames are waiting.
+        The frame is copied, as the input queue can reuse its memory after the next frame.
+        """
+        try:
+            self._pending_frames.put_nowait(np.array(self._next_frame))
+            super()._ingest_time(t)
+        except Full:
+            self._n_dropped += 1
+        self._next_frame = None
+
+    def update_framerate(self) -> None:
+        super().update_framerate()
+        if self.framerate_rec.i_fps == 0:
+            self._report_stats()
+
+    def _report_stats(self) -> None:
+        """
+        Sends the throughput and the compression ratio since the last report,
+        and a warning if frames were dropped.
+        """
+        t = datetime.now()
+        t_last, raw_bytes_last, n_dropped_last = self._last_report
+        raw_bytes = self._raw_bytes
+        dt = (t - t_last).total_seconds()
+        if dt > 0:
+            self.throughput_queue.put((t, (raw_bytes - raw_bytes_last) / dt / 2**20))
+        if self._compressed_bytes > 0:
+            self.compression_queue.put((t, self.compression_ratio))
+        if self._n_dropped > n_dropped_last:
+            self.message_queue.put(
+                "W:Dropped {} frames from recording".format(self._n_dropped)
+            )
+        self._last_report = (t, raw_bytes, self._n_dropped)
+
+    @property
+    def compression_ratio(self) -> float:
+        if self._compressed_bytes == 0:
+            return 1.0
+        return self._raw_bytes / self._compressed_bytes
+
+    def _complete(self, filename: str) -> None:
+        """
+        Encodes the remaining frames and closes the container.
+        """
+        self._pending_frames.put(None)
+        self._encoder_thread.join()
+        self._encoder_thread = None
+        self._report_stats()
+        self.message_queue.put(
+            "I:Recorded {} frames, compression ratio {:.2f}, {} dropped".format(
+                self._n_encoded, self.compression_ratio, self._n_dropped
+            )
+        )
+        super()._complete(filename)
+
+    def _reset(self) -> None:
+        if self._encoder_thread is not None:
+            self._pending_frames.put(None)
+            self._encoder_thread.join()
+            self._encoder_thread = None
+            if self._container is not None:
+                self._container.close()
+        self._pending_frames = None
+        self._next_frame = None
+        super()._reset()
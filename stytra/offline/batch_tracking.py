@@ -0,0 +1,597 @@
+"""
+Headless tracking of many videos at once, with the parameters saved from the
+offline tracking GUI (stytra.offline.track_video), e.g.:
+
+    python -m stytra.offline.batch_tracking "data/*.mp4" --params
+    data/fish1_trackingparams.json --format hdf5 --n_workers 4
+
+Long videos can also be split in segments tracked in parallel, with
+--segment_frames. As the output of some tracking nodes depends on the previous
+frames (e.g. the background for background subtraction), each segment is
+preceded by --warmup_frames frames which are tracked but discarded.
+
+The records output by some pipelines (e.g. the fish tracked with the sparse
+output) are saved in long format, with the number of their frame, next to the
+tracking output with the _records suffix. They can be converted to the wide
+layout with stytra.tracking.fish.records_to_wide(records, index="frame").
+
+"""
+import argparse
+import datetime
+import json
+import time
+import warnings
+from glob import glob
+from itertools import islice
+from multiprocessing import Pool, Manager
+from pathlib import Path
+from queue import Empty
+
+import flammkuchen as fl
+import imageio
+import numpy as np
+import pandas as pd
+import tables
+
+from stytra.experiments.fish_pipelines import pipeline_dict
+from stytra.hardware.video.read import has_video_node
+from stytra.utilities import save_df
+
+
+def load_tracking_params(path):
+    """Loads the tracking parameters saved by the offline tracking GUI
+
+    Parameters
+    ----------
+    path : str or Path
+        path of the _trackingparams.json file
+
+    Returns
+    -------
+    tuple (str, dict)
+        the pipeline type (key of pipeline_dict) and the pipeline parameters
+
+    """
+    with open(str(path), "r") as f:
+        params = json.load(f)
+    return params["pipeline_type"], params["pipeline_params"]
+
+
+def is_hdf5(path):
+    return str(path).endswith("h5") or str(path).endswith("hdf5")
+
+
+def count_frames(path):
+    """Number of frames of a video file"""
+    if is_hdf5(path):
+        if has_video_node(path):
+            with tables.open_file(str(path), "r") as f:
+                return f.get_node("/video").shape[0]
+        return fl.load(str(path)).shape[0]
+    reader = imageio.get_reader(str(path), "ffmpeg")
+    if hasattr(reader, "count_frames"):
+        return reader.count_frames()
+    return reader.get_length()
+
+
+def read_frames(path, start=0, stop=None, block_frames=500):
+    """Iterates over the frames of a video file, as grayscale images
+
+    Parameters
+    ----------
+    path : str or Path
+        video file, either a stytra .h5 file or any format readable by ffmpeg
+    start : int
+        first frame
+    stop : int, optional
+        frame before which to stop, if None the whole video is read
+    block_frames : int
+        number of frames loaded at once from .h5 files
+
+    """
+    if is_hdf5(path):
+        if not has_video_node(path):
+            for frame in fl.load(str(path))[start:stop]:
+                yield frame
+            return
+        if stop is None:
+            stop = count_frames(path)
+        for block_start in range(start, stop, block_frames):
+            block = fl.load(
+                str(path),
+                "/video",
+                sel=fl.aslice[block_start : min(block_start + block_frames, stop)],
+            )
+            for frame in block:
+                yield frame
+    else:
+        # the reader seeks to the first frame with ffmpeg, instead of
+        # decoding the video from its beginning
+        reader = imageio.get_reader(str(path), "ffmpeg")
+        try:
+            i_frame = start
+            while stop is None or i_frame < stop:
+                try:
+                    frame = reader.get_data(i_frame)
+                except IndexError:
+                    break
+                yield frame[:, :, 0] if frame.ndim == 3 else frame
+                i_frame += 1
+        finally:
+            reader.close()
+
+
+def make_pipeline(pipeline_type, pipeline_params):
+    """Instantiates a pipeline from pipeline_dict and sets its parameters"""
+    pipeline = pipeline_dict[pipeline_type]()
+    pipeline.setup()
+    pipeline.deserialize_params(pipeline_params)
+    return pipeline
+
+
+def progress_reporter(progress_queue, video_path, n_frames):
+    """Reports to the progress queue that the tracking of a video started,
+    and returns the function reporting the number of newly tracked frames"""
+    progress_queue.put((video_path, n_frames, 0))
+
+    def progress(n_new):
+        progress_queue.put((video_path, n_frames, n_new))
+
+    return progress
+
+
+def track_frames(pipeline, frames, progress=None, progress_every=100, first_frame=0):
+    """Runs the pipeline on all the frames
+
+    Parameters
+    ----------
+    pipeline : Pipeline
+    frames : iterable of np.ndarray
+    progress : callable, optional
+        called with the number of newly tracked frames every progress_every
+        frames
+    first_frame : int
+        number of the first frame, for the index of the outputs
+
+    Returns
+    -------
+    tuple (DataFrame, DataFrame or None)
+        the tracking outputs, one row per frame, and the records output by
+        the pipeline (e.g. the fish tracked with the sparse output) in long
+        format, with the number of their frame in the frame column, or None
+        if the pipeline outputs no records
+
+    """
+    data = []
+    records = []
+    record_columns = None
+    n_unreported = 0
+    for i_frame, frame in enumerate(frames, first_frame):
+        data.append(pipeline.run(frame).data)
+        frame_records = pipeline.records()
+        if frame_records is not None:
+            record_columns, values = frame_records
+            records.append(np.column_stack([np.full(len(values), i_frame), values]))
+        n_unreported += 1
+        if progress is not None and n_unreported == progress_every:
+            progress(n_unreported)
+            n_unreported = 0
+    if progress is not None and n_unreported > 0:
+        progress(n_unreported)
+    if len(data) == 0:
+        return pd.DataFrame(), None
+
+    df = pd.DataFrame.from_records(data, columns=data[-1]._fields)
+    df.index = pd.RangeIndex(first_frame, first_frame + len(df))
+    if record_columns is None:
+        return df, None
+    records = pd.DataFrame(
+        np.concatenate(records), columns=("frame",) + tuple(record_columns)
+    )
+    return df, records.astype(dict(frame=int))
+
+
+def save_outputs(df, records, output_path, fileformat):
+    """Saves the tracking outputs, and the records if there are any in a
+    second file with the _records suffix
+
+    Returns
+    -------
+    str
+        the name of the file of the tracking outputs
+
+    """
+    if records is not None:
+        save_df(records, str(output_path) + "_records", fileformat)
+    return save_df(df, output_path, fileformat)
+
+
+def output_path_for(video_path, output_dir=None):
+    """Path (without extension) where the tracking of a video is saved,
+    by default next to the video"""
+    video_path = Path(video_path)
+    if output_dir is None:
+        return video_path.parent / video_path.stem
+    return Path(output_dir) / video_path.stem
+
+
+def track_video(
+    video_path,
+    pipeline_type,
+    pipeline_params,
+    output_path,
+    fileformat="hdf5",
+    progress_queue=None,
+):
+    """Tracks a whole video and saves the result
+
+    Parameters
+    ----------
+    video_path : str or Path
+    pipeline_type : str
+        key of pipeline_dict
+    pipeline_params : dict
+        parameters as saved by Pipeline.serialize_params
+    output_path : str or Path
+        output path, without extension
+    fileformat : str
+        one of the formats supported by save_df
+    progress_queue : Queue, optional
+        queue where the progress is reported as tuples of
+        (video path, total number of frames, number of newly tracked frames)
+
+    Returns
+    -------
+    str
+        the name of the saved file, the records output by the pipeline,
+        if any, are saved next to it with the _records suffix
+
+    """
+    video_path = str(video_path)
+    pipeline = make_pipeline(pipeline_type, pipeline_params)
+
+    progress = None
+    if progress_queue is not None:
+        progress = progress_reporter(
+            progress_queue, video_path, count_frames(video_path)
+        )
+    df, records = track_frames(pipeline, read_frames(video_path), progress=progress)
+    return save_outputs(df, records, output_path, fileformat)
+
+
+def _track_video_job(args):
+    return track_video(*args)
+
+
+def split_segments(n_frames, segment_frames):
+    """Splits a video in (start, stop) frame ranges of segment_frames frames"""
+    return [
+        (start, min(start + segment_frames, n_frames))
+        for start in range(0, n_frames, segment_frames)
+    ]
+
+
+def track_segment(
+    video_path,
+    pipeline_type,
+    pipeline_params,
+    start,
+    stop,
+    warmup_frames=0,
+    progress_queue=None,
+    n_frames=None,
+):
+    """Tracks a segment of a video, after running the pipeline on the
+    preceding warmup_frames frames so that the state of the pipeline
+    (e.g. the background) is close to the one it would have if the whole video
+    was tracked
+
+    Parameters
+    ----------
+    video_path : str or Path
+    pipeline_type : str
+        key of pipeline_dict
+    pipeline_params : dict
+        parameters as saved by Pipeline.serialize_params
+    start : int
+        first frame of the segment
+    stop : int
+        frame after the end of the segment
+    warmup_frames : int
+        number of frames tracked, but not returned, before the segment
+    progress_queue : Queue, optional
+        queue where the progress is reported, see track_video
+    n_frames : int, optional
+        total number of frames of the video, for progress reporting
+
+    Returns
+    -------
+    tuple (DataFrame, DataFrame or None)
+        the tracking outputs, indexed by frame number, and the records, see
+        track_frames
+
+    """
+    video_path = str(video_path)
+    pipeline = make_pipeline(pipeline_type, pipeline_params)
+    warmup_start = max(start - warmup_frames, 0)
+    frames = read_frames(video_path, warmup_start, stop)
+    for frame in islice(frames, start - warmup_start):
+        pipeline.run(frame)
+
+    progress = None
+    if progress_queue is not None:
+        progress = progress_reporter(progress_queue, video_path, n_frames)
+    return track_frames(pipeline, frames, progress=progress, first_frame=start)
+
+
+def _track_segment_job(args):
+    return track_segment(*args)
+
+
+def stitch_segments(segments):
+    """Concatenates the outputs of consecutive segments, the columns are
+    those of the first segment"""
+    segments = [df for df in segments if df is not None and len(df) > 0]
+    if len(segments) == 0:
+        return pd.DataFrame()
+    return pd.concat(segments).reindex(columns=segments[0].columns)
+
+
+def stitch_segment_records(segments):
+    """Concatenates the records of consecutive segments, or returns None if
+    the pipeline outputs no records"""
+    segments = [records for records in segments if records is not None]
+    if len(segments) == 0:
+        return None
+    return stitch_segments(segments).reset_index(drop=True)
+
+
+class ProgressReporter:
+    """Keeps track of the frames tracked in all videos, and estimates the
+    tracking speed and the remaining time
+
+    Parameters
+    ----------
+    n_videos : int
+        number of videos to be tracked
+
+    """
+
+    def __init__(self, n_videos):
+        self.n_videos = n_videos
+        self.totals = dict()
+        self.done = dict()
+        self.t_start = time.time()
+
+    def update(self, video, n_total, n_new):
+        self.totals[video] = n_total
+        self.done[video] = self.done.get(video, 0) + n_new
+
+    @property
+    def n_done(self):
+        return sum(self.done.values())
+
+    @property
+    def n_total(self):
+        """Total number of frames, for the videos which have not been
+        opened yet the average length of the others is assumed"""
+        if len(self.totals) == 0:
+            return None
+        known = sum(self.totals.values())
+        return known * self.n_videos / len(self.totals)
+
+    @property
+    def fps(self):
+        return self.n_done / max(time.time() - self.t_start, 1e-6)
+
+    @property
+    def eta(self):
+        if self.n_total is None or self.fps == 0:
+            return None
+        return datetime.timedelta(seconds=int((self.n_total - self.n_done) / self.fps))
+
+    def __str__(self):
+        return "{} frames of {}, {:.1f} fps, ETA {}".format(
+            self.n_done,
+            "?" if self.n_total is None else int(self.n_total),
+            self.fps,
+            "?" if self.eta is None else self.eta,
+        )
+
+
+def track_videos(
+    video_paths,
+    params_path,
+    fileformat="hdf5",
+    n_workers=1,
+    output_dir=None,
+    pipeline_type=None,
+    segment_frames=None,
+    warmup_frames=0,
+    report_every=2.0,
+    verbose=True,
+):
+    """Tracks a list of videos in parallel, by default one video per worker
+    process. If segment_frames is given, the videos are split in segments
+    which are tracked in parallel and then put back together
+
+    Parameters
+    ----------
+    video_paths : list
+        paths of the videos
+    params_path : str or Path
+        _trackingparams.json file saved from the offline tracking GUI
+    fileformat : str
+        output format, one of the formats supported by save_df
+    n_workers : int
+        number of worker processes
+    output_dir : str or Path, optional
+        where to save the outputs, by default next to the videos
+    pipeline_type : str, optional
+        overrides the pipeline type saved in the parameters file
+    segment_frames : int, optional
+        length of the segments in which the videos are split
+    warmup_frames : int
+        number of frames tracked before each segment, to bring the state of
+        the pipeline close to the one of continuous tracking. A warning is
+        issued if the pipeline is stateful and there are none
+    report_every : float
+        interval in seconds between progress reports
+    verbose : bool
+        whether to print the progress
+
+    Returns
+    -------
+    list
+        the names of the saved files, without those of the records
+
+    """
+    saved_type, pipeline_params = load_tracking_params(params_path)
+    pipeline_type = pipeline_type or saved_type
+    if pipeline_type not in pipeline_dict:
+        raise ValueError("Unknown tracking pipeline {}".format(pipeline_type))
+    if segment_frames is not None and warmup_frames == 0:
+        if make_pipeline(pipeline_type, pipeline_params).stateful:
+            warnings.warn(
+                "The output of the {} pipeline depends on the previous frames, "
+                "the tracking of the segments will differ from the one of the "
+                "whole videos without warm-up frames".format(pipeline_type)
+            )
+
+    video_paths = [str(p) for p in video_paths]
+    reporter = ProgressReporter(len(video_paths))
+    with Manager() as manager:
+        progress_queue = manager.Queue()
+        if segment_frames is None:
+            job = _track_video_job
+            args = [
+                (
+                    video_path,
+                    pipeline_type,
+                    pipeline_params,
+                    output_path_for(video_path, output_dir),
+                    fileformat,
+                    progress_queue,
+                )
+                for video_path in video_paths
+            ]
+        else:
+            job = _track_segment_job
+            args = []
+            for video_path in video_paths:
+                n_frames = count_frames(video_path)
+                args.extend(
+                    (
+                        video_path,
+                        pipeline_type,
+                        pipeline_params,
+                        start,
+                        stop,
+                        warmup_frames,
+                        progress_queue,
+                        n_frames,
+                    )
+                    for start, stop in split_segments(n_frames, segment_frames)
+                )
+
+        with Pool(min(n_workers, len(args))) as pool:
+            result = pool.map_async(job, args)
+            while True:
+                result.wait(report_every)
+                while True:
+                    try:
+                        reporter.update(*progress_queue.get_nowait())
+                    except Empty:
+                        break
+                if result.ready():
+                    break
+                if verbose:
+                    print(reporter)
+            outputs = result.get()
+
+    if segment_frames is None:
+        saved = outputs
+    else:
+        saved = []
+        for video_path in video_paths:
+            segments = [out for arg, out in zip(args, outputs) if arg[0] == video_path]
+            saved.append(
+                save_outputs(
+                    stitch_segments([df for df, _ in segments]),
+                    stitch_segment_records([records for _, records in segments]),
+                    output_path_for(video_path, output_dir),
+                    fileformat,
+                )
+            )
+
+    if verbose:
+        print("Tracked {} videos, {}".format(len(saved), reporter))
+    return saved
+
+
+def expand_paths(patterns):
+    """Expands glob patterns (e.g. on Windows, where the shell does not)"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob(pattern))
+        paths.extend(matches if len(matches) > 0 else [pattern])
+    return paths
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Track videos offline, with parameters saved from the "
+        "offline tracking GUI"
+    )
+    parser.add_argument("videos", nargs="+", help="video files or glob patterns")
+    parser.add_argument("--params", required=True, help="_trackingparams.json file")
+    parser.add_argument(
+        "--format",
+        default="hdf5",
+        choices=["csv", "feather", "hdf5", "json"],
+        help="output format",
+    )
+    parser.add_argument(
+        "--n_workers", type=int, default=1, help="number of parallel processes"
+    )
+    parser.add_argument(
+        "--output_dir", default=None, help="output folder, default next to videos"
+    )
+    parser.add_argument(
+        "--segment_frames",
+        type=int,
+        default=None,
+        help="split the videos in segments of this many frames, tracked in parallel",
+    )
+    parser.add_argument(
+        "--warmup_frames",
+        type=int,
+        default=0,
+        help="number of frames tracked before each segment and discarded, "
+        "needed for pipelines whose output depends on the previous frames",
+    )
+    parser.add_argument(
+        "--method",
+        default=None,
+        choices=list(pipeline_dict.keys()),
+        help="tracking pipeline, overrides the one in the parameters file",
+    )
+    args = parser.parse_args(args)
+
+    video_paths = expand_paths(args.videos)
+    if len(video_paths) == 0:
+        parser.error("No videos found")
+    track_videos(
+        video_paths,
+        args.params,
+        fileformat=args.format,
+        n_workers=args.n_workers,
+        output_dir=args.output_dir,
+        pipeline_type=args.method,
+        segment_frames=args.segment_frames,
+        warmup_frames=args.warmup_frames,
+    )
+
+
+if __name__ == "__main__":
+    main()
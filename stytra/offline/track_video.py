@@ -16,9 +16,8 @@ import qdarkstyle
 from stytra.stimulation import Protocol
 from stytra.stimulation.stimuli import Stimulus
 from stytra.experiments.fish_pipelines import pipeline_dict
-from stytra.utilities import save_df
+from stytra.offline.batch_tracking import track_frames, save_outputs
 import imageio
-import pandas as pd
 import json
 
 
@@ -66,7 +65,6 @@ class OfflineToolbar(QToolBar):
 
         self.exp.camera.kill_event.set()
         reader = imageio.get_reader(str(self.input_path), "ffmpeg")
-        data = []
         self.exp.window_main.stream_plot.toggle_freeze()
 
         output_name = str(self.output_path) + "." + fileformat
@@ -78,15 +76,20 @@ class OfflineToolbar(QToolBar):
         self.diag_track.prog_track.setMaximum(l)
         self.diag_track.lbl_status.setText("Tracking to " + output_name)
 
-        for i, frame in enumerate(reader):
-            data.append(self.exp.pipeline.run(frame[:, :, 0]).data)
-            self.diag_track.prog_track.setValue(i)
-            if i % 100 == 0:
-                self.app.processEvents()
+        def progress(n_new):
+            # the value of the progress bar is -1 before the first frame
+            n_done = max(self.diag_track.prog_track.value(), 0) + n_new
+            self.diag_track.prog_track.setValue(n_done)
+            self.app.processEvents()
+
+        df, records = track_frames(
+            self.exp.pipeline,
+            (frame[:, :, 0] for frame in reader),
+            progress=progress,
+        )
 
         self.diag_track.lbl_status.setText("Saving " + output_name)
-        df = pd.DataFrame.from_records(data, columns=data[0]._fields)
-        save_df(df, self.output_path, fileformat)
+        save_outputs(df, records, self.output_path, fileformat)
         self.diag_track.lbl_status.setText("Completed " + output_name)
         self.exp.wrap_up()
 
@@ -201,6 +201,8 @@ class ProtocolRunner(QObject):
                     self.current_stimulus.start()
 
             self.current_stimulus.update()  # use stimulus update function
+            if self.experiment.latency_trace is not None:
+                self.experiment.latency_trace.advance("protocol")
             self.sig_timestep.emit(self.i_current_stimulus)
 
             # If stimulus is a constantly changing stimulus:
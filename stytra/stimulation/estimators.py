@@ -21,6 +21,12 @@ class Estimator:
     def reset(self):
         self.log.reset()
 
+    def trace_latency(self):
+        """Marks the reading of the newest tracking data in the latency
+        trace of the experiment, if there is one"""
+        if self.exp.latency_trace is not None:
+            self.exp.latency_trace.advance("estimated")
+
 
 class VigorMotionEstimator(Estimator):
     """
@@ -52,15 +58,17 @@ class VigorMotionEstimator(Estimator):
         n_samples_lag = max(int(round(lag / self.last_dt)), 0)
         if not self.acc_tracking.stored_data:
             return 0
-        past_tail_motion = self.acc_tracking.get_last_n(
-            vigor_n_samples + n_samples_lag
-        )[0:vigor_n_samples]
-        end_t = past_tail_motion.t.iloc[-1]
-        start_t = past_tail_motion.t.iloc[0]
+        self.trace_latency()
+        past_t, past_values = self.acc_tracking.get_last_n_arrays(
+            vigor_n_samples + n_samples_lag, ["tail_sum"]
+        )
+        past_t = past_t[0:vigor_n_samples]
+        end_t = past_t[-1]
+        start_t = past_t[0]
         new_dt = (end_t - start_t) / vigor_n_samples
         if new_dt > 0:
             self.last_dt = new_dt
-        vigor = np.nanstd(np.array(past_tail_motion.tail_sum))
+        vigor = np.nanstd(past_values["tail_sum"][0:vigor_n_samples])
         if np.isnan(vigor):
             vigor = 0
 
@@ -145,20 +153,22 @@ class TailSumEstimator(Estimator):
         -------
 
         """
+        self.trace_latency()
         # Vigor (copypasted from VigorEstimator method for simplicity)
         vigor_n_samples = max(int(round(self.vigor_window / self.last_dt)), 2)
         n_samples_lag = max(int(round(lag / self.last_dt)), 0)
         if not self.acc_tracking.stored_data:
             return 0, 0, 0
-        past_tail_motion = self.acc_tracking.get_last_n(
-            vigor_n_samples + n_samples_lag
-        )[0:vigor_n_samples]
-        end_t = past_tail_motion.t.iloc[-1]
-        start_t = past_tail_motion.t.iloc[0]
+        past_t, past_values = self.acc_tracking.get_last_n_arrays(
+            vigor_n_samples + n_samples_lag, ["tail_sum"]
+        )
+        past_t = past_t[0:vigor_n_samples]
+        end_t = past_t[-1]
+        start_t = past_t[0]
         new_dt = (end_t - start_t) / vigor_n_samples
         if new_dt > 0:
             self.last_dt = new_dt
-        vigor = np.nanstd(np.array(past_tail_motion.tail_sum))
+        vigor = np.nanstd(past_values["tail_sum"][0:vigor_n_samples])
 
         if vigor is not None:
             self.bout_on = int(vigor > self.bout_threshold)
@@ -181,12 +191,11 @@ class TailSumEstimator(Estimator):
             th_n_samples = max(int(round(self.theta_window / self.last_dt)), 2)
             n_samples_lag = max(int(round(lag / self.last_dt)), 0)
 
-            past_tail_motion = self.acc_tracking.get_last_n(
-                th_n_samples + n_samples_lag
-            )[0:th_n_samples]
-            self.tail_th = np.nanmean(
-                np.array(past_tail_motion.tail_sum) - past_tail_motion.tail_sum.iloc[0]
+            _, past_values = self.acc_tracking.get_last_n_arrays(
+                th_n_samples + n_samples_lag, ["tail_sum"]
             )
+            past_tail_sum = past_values["tail_sum"][0:th_n_samples]
+            self.tail_th = np.nanmean(past_tail_sum - past_tail_sum[0])
             self.theta_provided = True
         else:
             self.tail_th = self.tail_th * (3 / 4)
@@ -215,6 +224,9 @@ class PositionEstimator(Estimator):
         position after there is a big enough change (which prevents small
         oscillations due to tracking)
 
+        With the sparse output of the fish tracking, the position of the fish
+        in the first slot is read from the records of the tracked fish.
+
         :param args:
         :param calibrator:
         :param change_thresholds: a 3-tuple of thresholds, in px and radians
@@ -232,26 +244,48 @@ class PositionEstimator(Estimator):
 
         self._output_type = namedtuple("f", ["x", "y", "theta"])
 
-    def get_camera_position(self):
-        past_coords = {
-            name: value
-            for name, value in zip(
-                self.acc_tracking.columns, self.acc_tracking.get_last_n(1)[0, :]
+    def get_fish_arrays(self, n, names):
+        """Times of the last n tracked frames, and arrays of the state
+        variables of the fish in the first slot, from the f0_ columns of the
+        tracking data, or from the records of the tracked fish if the
+        tracking has the sparse output
+
+        Parameters
+        ----------
+        n : int
+            number of frames
+        names : list of str
+            state variables, e.g. x or theta
+
+        Returns
+        -------
+        tuple(np.array, list)
+            the times and the arrays of each state variable, NaN in the
+            frames without a fish in the first slot
+
+        """
+        if "f0_" + names[0] in self.acc_tracking.columns:
+            t, arrays = self.acc_tracking.get_last_n_arrays(
+                n, ["f0_" + name for name in names]
             )
-        }
-        return past_coords["f0_x"], past_coords["f0_y"], past_coords["f0_theta"]
+            return t, [arrays["f0_" + name] for name in names]
+        t, _ = self.acc_tracking.get_last_n_arrays(n, [])
+        slot_arrays = self.exp.acc_tracking_records.get_slot_arrays(t, names, 1)
+        return t, [slot_arrays[name][:, 0] for name in names]
+
+    def get_camera_position(self):
+        self.trace_latency()
+        _, past_coords = self.get_fish_arrays(1, ["x", "y", "theta"])
+        return tuple(coord[-1] for coord in past_coords)
 
     def get_velocity(self):
-        vel = np.diff(
-            self.acc_tracking.get_last_n(self.velocity_window)[["f0_x", "f0_y"]].values,
-            0,
-        )
+        _, past_coords = self.get_fish_arrays(self.velocity_window, ["x", "y"])
+        vel = np.diff(np.stack(past_coords, 1), 0)
         return np.sqrt(np.sum(vel**2))
 
     def get_istantaneous_velocity(self):
-        vel_xy = self.acc_tracking.get_last_n(self.velocity_window)[
-            ["f0_vx", "f0_vy"]
-        ].values
+        _, past_coords = self.get_fish_arrays(self.velocity_window, ["vx", "vy"])
+        vel_xy = np.stack(past_coords, 1)
         return np.sqrt(np.sum(vel_xy**2))
 
     def reset(self):
@@ -259,32 +293,27 @@ class PositionEstimator(Estimator):
         self.past_values = None
 
     def get_position(self):
-        if len(self.acc_tracking.stored_data) == 0 or not np.isfinite(
-            self.acc_tracking.stored_data[-1].f0_x
-        ):
-            o = self._output_type(np.nan, np.nan, np.nan)
-            return o
+        if len(self.acc_tracking.stored_data) == 0:
+            return self._output_type(np.nan, np.nan, np.nan)
+        t, (f0_x, f0_y, f0_theta) = self.get_fish_arrays(1, ["x", "y", "theta"])
+        if not np.isfinite(f0_x[-1]):
+            return self._output_type(np.nan, np.nan, np.nan)
 
-        past_coords = self.acc_tracking.stored_data[-1]
-        t = self.acc_tracking.times[-1]
+        self.trace_latency()
+        t, f0_x, f0_y, f0_theta = t[-1], f0_x[-1], f0_y[-1], f0_theta[-1]
 
         if not self.calibrator.cam_to_proj is None:
             projmat = np.array(self.calibrator.cam_to_proj)
             if projmat.shape != (2, 3):
                 projmat = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
 
-            x, y = projmat @ np.array([past_coords.f0_x, past_coords.f0_y, 1.0])
+            x, y = projmat @ np.array([f0_x, f0_y, 1.0])
 
             theta = np.arctan2(
-                *(
-                    projmat[:, :2]
-                    @ np.array(
-                        [np.cos(past_coords.f0_theta), np.sin(past_coords.f0_theta)]
-                    )[::-1]
-                )
+                *(projmat[:, :2] @ np.array([np.cos(f0_theta), np.sin(f0_theta)])[::-1])
             )
         else:
-            x, y, theta = past_coords.f0_x, past_coords.f0_y, past_coords.f0_theta
+            x, y, theta = f0_x, f0_y, f0_theta
 
         c_values = np.array((y, x, theta))
 
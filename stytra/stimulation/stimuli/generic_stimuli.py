@@ -252,6 +252,31 @@ class TriggerStimulus(DynamicStimulus):
             self.duration = self._elapsed
 
 
+class SaveCameraBufferStimulus(Stimulus):
+    """A stimulus that saves the frames in the camera replay buffer when it
+    starts, e.g. to keep the frames preceding a stimulus without recording
+    the whole experiment. The saving happens in the background. In
+    experiments without a camera, nothing is saved and a warning is logged.
+
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.name = "save_camera_buffer"
+        self.duration = 0
+        self.filename = None
+
+    def start(self):
+        super().start()
+        save_camera_buffer = getattr(self._experiment, "save_camera_buffer", None)
+        if save_camera_buffer is None:
+            self._experiment.logger.warning(
+                "The camera buffer cannot be saved in an experiment without a camera"
+            )
+            return
+        self.filename = save_camera_buffer()
+
+
 class CombinerStimulus(DynamicStimulus):
     """
     Class to have two stimuli happening pseudo-simultaneously (one update would
@@ -224,6 +224,17 @@ class StimDisplayWidget:
                 self.calibrator.paint_calibration_pattern(p, h, w)
 
         p.end()
+        self.trace_latency()
+
+    def trace_latency(self):
+        """Marks the painting of the stimulus in the latency trace of the
+        experiment, if there is one"""
+        if (
+            self.protocol_runner is not None
+            and self.protocol_runner.running
+            and self.protocol_runner.experiment.latency_trace is not None
+        ):
+            self.protocol_runner.experiment.latency_trace.advance("painted")
 
     def display_stimulus(self):
         """Function called by the protocol_runner timestep timer that update
@@ -353,3 +364,4 @@ class StimDisplayWidgetConditional(StimDisplayWidget):
                     self.calibrator.paint_calibration_pattern(p, h, w)
 
         p.end()
+        self.trace_latency()
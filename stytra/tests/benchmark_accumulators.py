@@ -0,0 +1,54 @@
+"""Micro-benchmark of reading the recent history of a tracking accumulator,
+as done by the estimators and the stream plots at every GUI update.
+
+Run with python -m stytra.tests.benchmark_accumulators
+"""
+import datetime
+from collections import namedtuple
+from timeit import repeat
+from types import SimpleNamespace
+
+import numpy as np
+
+from stytra.collectors import EstimatorLog
+
+
+def make_accumulator(columnar, n_samples=20000, n_segments=10):
+    exp = SimpleNamespace(
+        t0=datetime.datetime.now(), protocol_runner=SimpleNamespace(running=True)
+    )
+    acc = EstimatorLog(experiment=exp, columnar=columnar)
+    tt = namedtuple(
+        "t", ["tail_sum"] + ["theta_{:02d}".format(i) for i in range(n_segments)]
+    )
+    values = np.random.randn(n_samples, n_segments + 1)
+    for i in range(n_samples):
+        acc.update_list(i / 500, tt(*values[i]))
+    return acc
+
+
+def time_call(fun, n_calls=200):
+    return min(repeat(fun, number=n_calls, repeat=3)) / n_calls
+
+
+def run(n_last=(25, 2500)):
+    accs = dict(list=make_accumulator(False), columnar=make_accumulator(True))
+    print("{:>30} {:>10} {:>12}".format("method", "n", "us/call"))
+    for n in n_last:
+        for name, acc in accs.items():
+            results = [
+                (
+                    "get_last_n ({})".format(name),
+                    time_call(lambda: acc.get_last_n(n).tail_sum.values),
+                ),
+                (
+                    "get_last_n_arrays ({})".format(name),
+                    time_call(lambda: acc.get_last_n_arrays(n, ["tail_sum"])),
+                ),
+            ]
+            for label, t_call in results:
+                print("{:>30} {:>10} {:>12.1f}".format(label, n, t_call * 1e6))
+
+
+if __name__ == "__main__":
+    run()
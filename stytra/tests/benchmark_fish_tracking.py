@@ -0,0 +1,72 @@
+"""Benchmark of the per-frame time of the freely-swimming fish tracking on
+large arenas, scanning the full frame at every frame or searching the fish
+only around their predicted positions.
+
+Run with python -m stytra.tests.benchmark_fish_tracking
+"""
+from time import perf_counter
+
+import numpy as np
+
+from stytra.experiments.fish_pipelines import FishTrackingPipeline
+from stytra.hardware.video.cameras.synthetic import SyntheticCamera
+
+
+def make_frames(size, n_frames):
+    cam = SyntheticCamera(width=size, height=size, framerate=300)
+    cam.open_camera()
+    frames = []
+    for i_frame in range(n_frames):
+        frame = cam.backgrounds[i_frame % cam.n_backgrounds].copy()
+        cam._draw(frame, cam.pose(i_frame))
+        frames.append(frame)
+    return cam.backgrounds[0], frames
+
+
+def time_tracking(background, frames, **params):
+    pipeline = FishTrackingPipeline()
+    pipeline.setup()
+    pipeline.deserialize_params({"/source/bgsub/fish_tracking": params})
+    pipeline.warm_up()
+    pipeline.run(background)
+    pipeline.set_node_timing(True, len(frames))
+
+    t_start = perf_counter()
+    for frame in frames:
+        pipeline.run(frame)
+    timings = pipeline.node_timings()
+    return (
+        (perf_counter() - t_start) / len(frames),
+        timings["/source/bgsub/fish_tracking"].mean,
+        pipeline.fishtrack.scan_counts,
+    )
+
+
+def run(sizes=(480, 1024, 2048), n_frames=300):
+    print(
+        "{:>6} {:>10} {:>18} {:>18} {:>30}".format(
+            "arena", "search", "pipeline ms/frame", "tracking ms/frame", "scans"
+        )
+    )
+    for size in sizes:
+        background, frames = make_frames(size, n_frames)
+        for label, params in [
+            ("full", dict(roi_search=False)),
+            ("roi", dict(roi_search=True, roi_size=160, rescan_every=50)),
+        ]:
+            t_pipeline, t_tracking, scan_counts = time_tracking(
+                background, frames, **params
+            )
+            print(
+                "{:>6} {:>10} {:>18.3f} {:>18.3f} {:>30}".format(
+                    size,
+                    label,
+                    t_pipeline * 1e3,
+                    t_tracking,
+                    " ".join("{}={}".format(k, v) for k, v in scan_counts.items()),
+                )
+            )
+
+
+if __name__ == "__main__":
+    run()
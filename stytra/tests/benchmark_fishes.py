@@ -0,0 +1,209 @@
+"""Benchmark of the tracking of several simulated fish with the Kalman
+filters of Fishes, predicted and updated for all the fish at once with an
+optimal assignment of the detections, compared with the previous
+implementation, which predicted the fish one by one and assigned each
+detection to the first fish close enough.
+
+For 1, 10 and 50 fish swimming in an arena, the time per frame and the
+number of identity swaps, when a fish takes the detections of another one,
+are given.
+
+Run with python -m stytra.tests.benchmark_fishes
+"""
+from time import perf_counter
+
+import numpy as np
+from numba import int64, float64
+
+try:
+    from numba.experimental import jitclass
+except ModuleNotFoundError:
+    from numba import jitclass
+
+from stytra.tracking.fish import Fishes, _minimal_angle_dif
+from stytra.tracking.simple_kalman import predict_inplace, update_inplace
+
+
+spec = [
+    ("n_fish", int64),
+    ("coords", float64[:, :]),
+    ("i_not_updated", int64[:]),
+    ("F", float64[:, :]),
+    ("uncertainties", float64[:]),
+    ("Q", float64[:, :]),
+    ("Ps", float64[:, :, :, :]),
+    ("def_P", float64[:, :, :]),
+    ("persist_fish_for", int64),
+]
+
+
+@jitclass(spec)
+class GreedyFishes(object):
+    def __init__(
+        self, n_fish_max, pos_std, angle_std, n_segments, pred_coef, persist_fish_for
+    ):
+        self.n_fish = n_fish_max
+        self.coords = np.full((n_fish_max, 6 + n_segments), np.nan)
+        self.uncertainties = np.array((pos_std, angle_std, angle_std))
+        self.def_P = np.zeros((3, 2, 2))
+        for i, uc in enumerate(self.uncertainties):
+            self.def_P[i, 0, 0] = uc
+            self.def_P[i, 1, 1] = uc
+        self.i_not_updated = np.zeros(n_fish_max, dtype=np.int64)
+        self.Ps = np.zeros((n_fish_max, 3, 2, 2))
+        self.F = np.array([[1.0, 1.0], [0.0, 1.0]])
+        dt = 0.02
+        self.Q = (
+            np.array([[0.25 * dt**4, 0.5 * dt**3], [0.5 * dt**3, dt**2]])
+            * pred_coef
+        )
+        self.persist_fish_for = persist_fish_for
+
+    def predict(self):
+        for i_fish in range(self.n_fish):
+            if not np.isnan(self.coords[i_fish, 0]):
+                for i_coord in range(0, 6, 2):
+                    predict_inplace(
+                        self.coords[i_fish, i_coord : i_coord + 2],
+                        self.Ps[i_fish, i_coord // 2],
+                        self.F,
+                        self.Q,
+                    )
+                self.i_not_updated[i_fish] += 1
+                if self.i_not_updated[i_fish] > self.persist_fish_for:
+                    self.coords[i_fish, :] = np.nan
+
+    def update(self, new_fish):
+        for i_fish in range(self.n_fish):
+            if not np.isnan(self.coords[i_fish, 0]):
+                if self.is_close(new_fish, i_fish) and self.i_not_updated[i_fish] != 0:
+                    for i_coord in range(0, 3):
+                        nc = new_fish[i_coord]
+                        if i_coord == 2:
+                            nc = _minimal_angle_dif(self.coords[i_fish, 4], nc)
+                        update_inplace(
+                            nc,
+                            self.coords[i_fish, i_coord * 2 : i_coord * 2 + 2],
+                            self.Ps[i_fish, i_coord],
+                            self.uncertainties[i_coord],
+                        )
+                    self.coords[i_fish, 6:] = new_fish[3:]
+                    self.i_not_updated[i_fish] = 0
+                    return i_fish
+        return -1
+
+    def add_fish(self, new_fish):
+        for i_fish in range(self.n_fish):
+            if np.isnan(self.coords[i_fish, 0]):
+                self.coords[i_fish, 0:6:2] = new_fish[:3]
+                self.coords[i_fish, 1:6:2] = 0.0
+                self.coords[i_fish, 6:] = new_fish[3:]
+                self.Ps[i_fish] = self.def_P
+                self.i_not_updated[i_fish] = 0
+                return True
+        return False
+
+    def is_close(self, new_fish, i_fish):
+        n_px = 15
+        d_theta = np.pi / 2
+        dists = new_fish[:2] - self.coords[i_fish, 0:4:2]
+        dtheta = np.abs(
+            np.mod(new_fish[2] - self.coords[i_fish, 4] + np.pi, np.pi * 2) - np.pi
+        )
+        return np.sum(dists**2) < n_px**2 and dtheta < d_theta
+
+
+def simulate_detections(n_fish, n_frames, n_segments=9, speed=3.0, seed=0):
+    """Detections of fish swimming at constant speed with a random
+    heading drift in a square arena, in random order in each frame
+
+    Returns
+    -------
+    list of tuple
+        detections of each frame, and the fish to which they belong
+
+    """
+    rng = np.random.default_rng(seed)
+    side = 60 * np.sqrt(n_fish) + 100
+    pos = rng.uniform(50, side - 50, (n_fish, 2))
+    theta = rng.uniform(-np.pi, np.pi, n_fish)
+    frames = []
+    for _ in range(n_frames):
+        theta += rng.normal(0, 0.1, n_fish)
+        pos += speed * np.stack([np.cos(theta), np.sin(theta)], 1)
+        # the fish turn back at the walls
+        out = (pos < 0) | (pos > side)
+        pos = np.clip(pos, 0, side)
+        theta[out[:, 0]] = np.pi - theta[out[:, 0]]
+        theta[out[:, 1]] = -theta[out[:, 1]]
+
+        detections = np.concatenate(
+            [
+                pos + rng.normal(0, 1.0, pos.shape),
+                (theta + rng.normal(0, 0.1, n_fish))[:, None],
+                rng.normal(0, 0.2, (n_fish, n_segments)),
+            ],
+            1,
+        )
+        order = rng.permutation(n_fish)
+        frames.append((detections[order], order))
+    return frames
+
+
+def track(fishes, frames, batched):
+    """Tracks the detected fish, returning the time per frame and the
+    number of identity swaps"""
+    identities = np.full(fishes.n_fish, -1)
+    n_swaps = 0
+    t_start = perf_counter()
+    for detections, fish_ids in frames:
+        fishes.predict()
+        if batched:
+            i_assigned = fishes.update(detections)
+        else:
+            i_assigned = np.array([fishes.update(d) for d in detections])
+        for detection in detections[i_assigned < 0]:
+            fishes.add_fish(detection)
+
+        updated = i_assigned >= 0
+        n_swaps += np.sum(
+            (identities[i_assigned[updated]] >= 0)
+            & (identities[i_assigned[updated]] != fish_ids[updated])
+        )
+        identities[i_assigned[updated]] = fish_ids[updated]
+    return (perf_counter() - t_start) / len(frames), n_swaps
+
+
+def run(n_fishes=(1, 10, 50), n_frames=2000):
+    params = dict(pos_std=1.0, angle_std=np.pi / 10, n_segments=9, pred_coef=0.1)
+    # compile the kernels
+    for fishes_class, batched in [(Fishes, True), (GreedyFishes, False)]:
+        track(
+            fishes_class(2, persist_fish_for=2, **params),
+            simulate_detections(2, 5),
+            batched,
+        )
+
+    print(
+        "{:>6} {:>14} {:>12} {:>14}".format(
+            "n fish", "assignment", "us/frame", "identity swaps"
+        )
+    )
+    for n_fish in n_fishes:
+        frames = simulate_detections(n_fish, n_frames)
+        for label, fishes_class, batched in [
+            ("greedy", GreedyFishes, False),
+            ("hungarian", Fishes, True),
+        ]:
+            t_frame, n_swaps = track(
+                fishes_class(n_fish, persist_fish_for=2, **params), frames, batched
+            )
+            print(
+                "{:>6} {:>14} {:>12.1f} {:>14}".format(
+                    n_fish, label, t_frame * 1e6, n_swaps
+                )
+            )
+
+
+if __name__ == "__main__":
+    run()
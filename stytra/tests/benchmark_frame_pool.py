@@ -0,0 +1,62 @@
+"""Benchmark of the time taken to pass 4 megapixel frames from the camera to
+3 consumers (tracking, recording and display), either writing each frame
+once in a FramePool and sharing its slot, or copying it for each consumer
+as done with separate queues. Everything runs in one process, so that only
+the cost of moving the frames is measured.
+
+Run with python -m stytra.tests.benchmark_frame_pool
+"""
+import time
+
+import numpy as np
+
+from stytra.hardware.video.frame_pool import FramePool
+
+
+def fan_out_pool(frames, n_consumers):
+    pool = FramePool(max_mbytes=200)
+    source = pool.channel(indexed=True)
+    consumers = [pool.channel() for _ in range(n_consumers)]
+    t_start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        pool.put(frame, index=i, channels=[source])
+        _, _, received = source.get(timeout=1)
+        for consumer in consumers:
+            source.share(received, consumer)
+        for consumer in consumers:
+            _, out = consumer.get(timeout=1)
+    return time.perf_counter() - t_start
+
+
+def fan_out_copies(frames, n_consumers, max_mbytes=200):
+    # each queue has its own buffer in which the frames are written in turn,
+    # as with the queues of the arrayqueues package
+    n_buffered = max(int(max_mbytes * 1000000 // frames[0].nbytes), 1)
+    queues = [
+        np.empty((n_buffered,) + frames[0].shape, frames[0].dtype)
+        for _ in range(n_consumers + 1)
+    ]
+    t_start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        # one copy into the camera queue, and one for each consumer
+        queues[0][i % n_buffered] = frame
+        for queue in queues[1:]:
+            queue[i % n_buffered] = queues[0][i % n_buffered]
+    return time.perf_counter() - t_start
+
+
+def run(n_frames=300, shape=(2048, 2048), n_consumers=3):
+    frames = np.random.randint(0, 255, (4,) + shape).astype(np.uint8)
+    frames = [frames[i % len(frames)] for i in range(n_frames)]
+    mb = n_frames * frames[0].nbytes / 2**20
+    for label, fan_out in [("frame pool", fan_out_pool), ("copies", fan_out_copies)]:
+        duration = fan_out(frames, n_consumers)
+        print(
+            "{:>12} {:>8.2f} ms/frame {:>10.1f} MB/s from the camera".format(
+                label, duration / n_frames * 1000, mb / duration
+            )
+        )
+
+
+if __name__ == "__main__":
+    run()
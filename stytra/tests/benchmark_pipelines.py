@@ -0,0 +1,60 @@
+"""Micro-benchmark of the per-frame overhead of running the tracking
+pipelines, comparing the compiled execution plan of Pipeline.run with
+the recursive traversal of the node tree.
+
+To measure only the cost of running the pipeline and assembling its output,
+the processing functions of the nodes are replaced by functions returning
+the output of a first, real, run.
+
+Run with python -m stytra.tests.benchmark_pipelines
+"""
+from timeit import repeat
+
+import numpy as np
+
+from stytra.experiments.fish_pipelines import (
+    TailTrackingPipeline,
+    FishTrackingPipeline,
+    EyeTailTrackingPipeline,
+)
+
+
+def make_pipeline(pipeline_class, frame):
+    pipeline = pipeline_class()
+    pipeline.setup()
+    pipeline.run(frame)
+    for node in pipeline.node_dict.values():
+        inputs = [frame]
+        for ancestor in node.path:
+            output = ancestor.process(*inputs)
+            inputs = [output.data]
+        node.process = lambda *inputs, output=output: output
+    return pipeline
+
+
+def time_call(fun, n_calls=2000):
+    return min(repeat(fun, number=n_calls, repeat=5)) / n_calls
+
+
+def run(frame_shape=(480, 640)):
+    frame = np.random.randint(0, 255, frame_shape, dtype=np.uint8)
+    print("{:>25} {:>15} {:>12}".format("pipeline", "method", "us/frame"))
+    for pipeline_class in [
+        TailTrackingPipeline,
+        FishTrackingPipeline,
+        EyeTailTrackingPipeline,
+    ]:
+        pipeline = make_pipeline(pipeline_class, frame)
+        for label, fun in [
+            ("recursive_run", lambda: pipeline.recursive_run(pipeline.root, frame)),
+            ("run", lambda: pipeline.run(frame)),
+        ]:
+            print(
+                "{:>25} {:>15} {:>12.2f}".format(
+                    pipeline_class.__name__, label, time_call(fun) * 1e6
+                )
+            )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,87 @@
+"""Benchmark of the per-frame time of the preprocessing nodes, writing into
+buffers reused at every frame, compared with allocating a new image at each
+step as they used to.
+
+Run with python -m stytra.tests.benchmark_preprocessing
+"""
+from timeit import repeat
+
+import cv2
+import numpy as np
+
+from stytra.tracking.preprocessing import (
+    Prefilter,
+    BackgroundSubtractor,
+    negdif,
+)
+
+
+def prefilter_allocating(im, image_scale, filter_size, color_invert, clip):
+    if image_scale != 1:
+        im = cv2.resize(
+            im, None, fx=image_scale, fy=image_scale, interpolation=cv2.INTER_AREA
+        )
+    if filter_size > 0:
+        im = cv2.boxFilter(im, -1, (filter_size, filter_size))
+    if color_invert:
+        im = 255 - im
+    if clip > 0:
+        im = cv2.threshold(src=im, thresh=clip, maxval=255, type=cv2.THRESH_TOZERO)[1]
+    return im
+
+
+def bgsub_allocating(background, im, learning_rate):
+    background[:, :] = im.astype(np.float32) * np.float32(
+        learning_rate
+    ) + background * np.float32(1 - learning_rate)
+    return negdif(background, im)
+
+
+def time_call(fun, n_calls=100):
+    return min(repeat(fun, number=n_calls, repeat=5)) / n_calls
+
+
+def run(frame_shapes=((1024, 1024), (2048, 2048))):
+    prefilter_params = (0.5, 2, True, 140)
+    prefilter = Prefilter()
+    prefilter.setup()
+    bgsub = BackgroundSubtractor()
+    bgsub.setup()
+
+    print("{:>12} {:>22} {:>14} {:>12}".format("frame", "node", "method", "ms/frame"))
+    for frame_shape in frame_shapes:
+        frame = np.random.randint(0, 255, frame_shape, dtype=np.uint8)
+        background = frame.astype(np.float32)
+        bgsub.reset()
+        bgsub._process(frame, 0.04, 1, True)
+        for node, label, fun in [
+            (
+                "Prefilter",
+                "allocating",
+                lambda: prefilter_allocating(frame, *prefilter_params),
+            ),
+            (
+                "Prefilter",
+                "buffers",
+                lambda: prefilter._process(frame, *prefilter_params),
+            ),
+            (
+                "BackgroundSubtractor",
+                "allocating",
+                lambda: bgsub_allocating(background, frame, 0.04),
+            ),
+            (
+                "BackgroundSubtractor",
+                "buffers",
+                lambda: bgsub._process(frame, 0.04, 1, True),
+            ),
+        ]:
+            print(
+                "{:>12} {:>22} {:>14} {:>12.3f}".format(
+                    "{}x{}".format(*frame_shape), node, label, time_call(fun) * 1e3
+                )
+            )
+
+
+if __name__ == "__main__":
+    run()
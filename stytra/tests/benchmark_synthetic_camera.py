@@ -0,0 +1,34 @@
+"""Benchmark of the framerate the synthetic camera can sustain at different
+resolutions, when asked for more frames than it can generate. The frames
+which are generated too late are skipped, as with a real camera.
+
+Run with python -m stytra.tests.benchmark_synthetic_camera
+"""
+import time
+
+from stytra.hardware.video.cameras.synthetic import (
+    SyntheticCamera,
+    decode_frame_index,
+)
+
+
+def run(framerate=2000, duration=2.0):
+    for size in [256, 512, 1024, 2048]:
+        cam = SyntheticCamera(width=size, height=size, framerate=framerate)
+        cam.open_camera()
+        frame = None
+        indexes = []
+        t_start = time.perf_counter()
+        while time.perf_counter() - t_start < duration:
+            frame = cam.read_into(frame)
+            indexes.append(decode_frame_index(frame))
+        n_skipped = indexes[-1] + 1 - len(indexes)
+        print(
+            "{0:>5}x{0:<5} {1:>8.1f} fps, {2:>6} frames skipped".format(
+                size, len(indexes) / duration, n_skipped
+            )
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,259 @@
+"""Benchmark of the tracing of the tail of a head-restrained larva by the
+centers of mass of consecutive windows, comparing the kernel tracing all
+the segments at once on a precomputed circular window with bilinear
+sampling, with the previous implementation, which looped over the pixels
+of a square window for each segment with the circle off-center, and with
+the same loop with the circle centered.
+
+On frames of the synthetic camera, the time to trace the tail, the
+number of segments found before losing the thin tip of the tail, and, on
+the first two thirds of the tail, the distance of the traced points to the
+ground-truth midline of the larva and the error of the direction of the
+traced tail are given for several window sizes.
+
+Run with python -m stytra.tests.benchmark_tail_tracking
+"""
+from time import perf_counter
+
+import numpy as np
+from numba import jit
+
+from stytra.hardware.video.cameras.synthetic import SyntheticCamera
+from stytra.tracking.preprocessing import Prefilter
+from stytra.tracking.tail import _trace_tail_centroids, window_offsets
+
+
+@jit(nopython=True, cache=True)
+def _next_segment_off_center(fc, xm, ym, dx, dy, halfwin, next_point_dist):
+    halfwin2 = halfwin**2
+    y_max, x_max = fc.shape
+    xs = min(max(int(round(xm + dx - halfwin)), 0), x_max)
+    xe = min(max(int(round(xm + dx + halfwin)), 0), x_max)
+    ys = min(max(int(round(ym + dy - halfwin)), 0), y_max)
+    ye = min(max(int(round(ym + dy + halfwin)), 0), y_max)
+
+    if xs == xe and ys == ye:
+        return -1, -1, 0, 0, 0
+
+    acc = 0.0
+    acc_x = 0.0
+    acc_y = 0.0
+    for x in range(xs, xe):
+        for y in range(ys, ye):
+            lx = (xs + halfwin - x) ** 2
+            ly = (ys + halfwin - y) ** 2
+            if lx + ly <= halfwin2:
+                acc_x += x * fc[y, x]
+                acc_y += y * fc[y, x]
+                acc += fc[y, x]
+
+    if acc == 0:
+        return -1, -1, 0, 0, 0
+
+    mn_y = acc_y / acc - ym
+    mn_x = acc_x / acc - xm
+    a = np.sqrt(mn_y**2 + mn_x**2) / next_point_dist
+    if a == 0:
+        return -1, -1, 0, 0, 0
+    dx = mn_x / a
+    dy = mn_y / a
+    return xm + dx, ym + dy, dx, dy, acc
+
+
+@jit(nopython=True, cache=True)
+def _next_segment_centered(fc, xm, ym, dx, dy, halfwin, next_point_dist):
+    halfwin2 = halfwin**2
+    y_max, x_max = fc.shape
+    cx = xm + dx
+    cy = ym + dy
+    xs = min(max(int(np.floor(cx - halfwin)), 0), x_max)
+    xe = min(max(int(np.floor(cx + halfwin)) + 1, 0), x_max)
+    ys = min(max(int(np.floor(cy - halfwin)), 0), y_max)
+    ye = min(max(int(np.floor(cy + halfwin)) + 1, 0), y_max)
+
+    if xs == xe and ys == ye:
+        return -1, -1, 0, 0, 0
+
+    acc = 0.0
+    acc_x = 0.0
+    acc_y = 0.0
+    for x in range(xs, xe):
+        for y in range(ys, ye):
+            lx = (x - cx) ** 2
+            ly = (y - cy) ** 2
+            if lx + ly <= halfwin2:
+                acc_x += x * fc[y, x]
+                acc_y += y * fc[y, x]
+                acc += fc[y, x]
+
+    if acc == 0:
+        return -1, -1, 0, 0, 0
+
+    mn_y = acc_y / acc - ym
+    mn_x = acc_x / acc - xm
+    a = np.sqrt(mn_y**2 + mn_x**2) / next_point_dist
+    if a == 0:
+        return -1, -1, 0, 0, 0
+    dx = mn_x / a
+    dy = mn_y / a
+    return xm + dx, ym + dy, dx, dy, acc
+
+
+def trace_segment_loop(next_segment):
+    """Tracing of the tail calling the next_segment kernel for each
+    segment, as the CentroidTrackingMethod used to"""
+
+    def trace(im, start_x, start_y, disp_x, disp_y, seg_length, n_segments, size):
+        points = np.full((n_segments + 1, 2), np.nan)
+        points[0] = start_x, start_y
+        for i in range(n_segments):
+            start_x, start_y, disp_x, disp_y, _ = next_segment(
+                im, start_x, start_y, disp_x, disp_y, size / 2, seg_length
+            )
+            if start_x < 0:
+                break
+            points[i + 1] = start_x, start_y
+        return points
+
+    return trace
+
+
+def trace_kernel(im, start_x, start_y, disp_x, disp_y, seg_length, n_segments, size):
+    return _trace_tail_centroids(
+        im, start_x, start_y, disp_x, disp_y, seg_length, n_segments, size
+    )[0]
+
+
+def make_frames(n_frames):
+    """Frames of a head-restrained larva, prefiltered with the default
+    parameters of the Prefilter, with the ground-truth midline, in the
+    coordinates of the camera frames"""
+    cam = SyntheticCamera(framerate=300, head_restrained=True)
+    cam.open_camera()
+    prefilter = Prefilter()
+    prefilter.setup()
+    segment_length = cam.fish_length * 0.8 / cam.n_segments
+    frames = []
+    for i_frame in range(n_frames):
+        frame = cam.backgrounds[i_frame % cam.n_backgrounds].copy()
+        pose = cam.pose(i_frame)
+        cam._draw(frame, pose)
+        im = prefilter._process(frame, 0.5, 2, True, 140).data
+        midline = np.stack(
+            [
+                pose.x
+                + np.concatenate(
+                    [[0.0], np.cumsum(segment_length * np.cos(pose.tail_angles))]
+                ),
+                pose.y
+                + np.concatenate(
+                    [[0.0], np.cumsum(segment_length * np.sin(pose.tail_angles))]
+                ),
+            ],
+            1,
+        )
+        frames.append((im.copy(), midline))
+    return frames, cam.fish_length * 0.8
+
+
+def distances_to_midline(points, midline):
+    starts, ends = midline[:-1], midline[1:]
+    along = np.clip(
+        np.sum((points[:, None] - starts) * (ends - starts), 2)
+        / np.sum((ends - starts) ** 2, 1),
+        0,
+        1,
+    )
+    closest = starts + along[..., None] * (ends - starts)
+    return np.min(np.linalg.norm(points[:, None] - closest, axis=2), 1)
+
+
+def direction_error(points, midline, tail_length, n_segments):
+    """Error of the direction from the start of the tail to the last of
+    the points, relative to the point of the midline at the same distance
+    along the tail"""
+    arc = tail_length * (len(points) - 1) / n_segments
+    lengths = np.concatenate(
+        [[0.0], np.cumsum(np.linalg.norm(np.diff(midline, axis=0), axis=1))]
+    )
+    true_end = np.array(
+        [np.interp(arc, lengths, midline[:, 0]), np.interp(arc, lengths, midline[:, 1])]
+    )
+    traced = points[-1] - points[0]
+    true = true_end - midline[0]
+    return np.abs(
+        np.angle(np.exp(1j * (np.arctan2(*traced[::-1]) - np.arctan2(*true[::-1]))))
+    )
+
+
+def evaluate(trace, frames, tail_length, window_size, n_segments=12, scale=0.5):
+    """Time per frame, mean number of segments found, and on the first two
+    thirds of the tail, mean distance to the midline (px) and mean error of
+    the direction of the tail (rad)"""
+
+    # the pixel centers are shifted by the resizing, and by half a pixel
+    # of the prefiltered image by the box filter of even size
+    def to_image(xy):
+        return (xy - 0.5) * scale + 0.5
+
+    def to_frame(xy):
+        return (xy - 0.5) / scale + 0.5
+
+    seg_length = tail_length * scale / n_segments
+    n_compared = n_segments * 2 // 3
+    size = window_offsets(window_size) if trace is trace_kernel else window_size
+    times, n_found, distances, direction_errors = [], [], [], []
+    for im, midline in frames:
+        start_x, start_y = to_image(midline[0])
+        t_start = perf_counter()
+        points = trace(
+            im, start_x, start_y, -seg_length, 0.0, seg_length, n_segments, size
+        )
+        times.append(perf_counter() - t_start)
+
+        points = to_frame(points)
+        n_found.append(np.sum(~np.isnan(points[1:, 0])))
+        if n_found[-1] >= n_compared:
+            compared = points[: n_compared + 1]
+            distances.append(np.mean(distances_to_midline(compared[1:], midline)))
+            direction_errors.append(
+                direction_error(compared, midline, tail_length, n_segments)
+            )
+    return (
+        np.mean(times),
+        np.mean(n_found),
+        np.mean(distances),
+        np.mean(direction_errors),
+    )
+
+
+def run(window_sizes=(5, 7, 9), n_frames=300):
+    frames, tail_length = make_frames(n_frames)
+    methods = [
+        ("off-center loop", trace_segment_loop(_next_segment_off_center)),
+        ("centered loop", trace_segment_loop(_next_segment_centered)),
+        ("bilinear kernel", trace_kernel),
+    ]
+    # compile the kernels
+    for _, trace in methods:
+        evaluate(trace, frames[:2], tail_length, 7)
+
+    print(
+        "{:>7} {:>16} {:>10} {:>9} {:>11} {:>14}".format(
+            "window", "method", "us/frame", "segments", "midline px", "direction rad"
+        )
+    )
+    for window_size in window_sizes:
+        for label, trace in methods:
+            t_frame, n_found, distance, angle_error = evaluate(
+                trace, frames, tail_length, window_size
+            )
+            print(
+                "{:>7} {:>16} {:>10.1f} {:>9.2f} {:>11.3f} {:>14.4f}".format(
+                    window_size, label, t_frame * 1e6, n_found, distance, angle_error
+                )
+            )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,82 @@
+"""Benchmark of the sustainable replay framerate of a 1 megapixel video,
+comparing decoding to RGB in the loop which publishes the frames (as
+VideoFileSource did) with the prefetching grayscale AvVideoReader, keeping
+the red channel as by default, or taking the luma plane directly.
+The publishing of frames is emulated by copying them to a buffer.
+
+Run with python -m stytra.tests.benchmark_video_read
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import av
+import numpy as np
+
+from stytra.hardware.video.read import AvVideoReader
+
+
+def make_video(path, n_frames=300, size=1024):
+    container = av.open(str(path), "w")
+    stream = container.add_stream("mpeg4", rate=100)
+    stream.width = size
+    stream.height = size
+    stream.pix_fmt = "yuv420p"
+    yy, xx = np.mgrid[0:size, 0:size]
+    for i in range(n_frames):
+        # a moving blob on a noisy background
+        im = np.random.randint(0, 40, (size, size)).astype(np.uint8)
+        im[(yy - size // 2) ** 2 + (xx - 4 * i % size) ** 2 < 80**2] = 200
+        frame = av.VideoFrame.from_ndarray(im, format="gray")
+        for packet in stream.encode(frame):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+
+def replay_rgb(path, buffer):
+    container = av.open(str(path))
+    container.streams.video[0].thread_type = "AUTO"
+    container.streams.video[0].thread_count = 1
+    n = 0
+    t_start = time.perf_counter()
+    for framedata in container.decode(video=0):
+        frame = framedata.to_ndarray(format="rgb24")
+        buffer[:] = frame[:, :, 0]
+        n += 1
+    container.close()
+    return n / (time.perf_counter() - t_start)
+
+
+def replay_prefetch(path, buffer, channel=0):
+    reader = AvVideoReader(path, loop=False, channel=channel)
+    t_start = time.perf_counter()
+    reader.start()
+    n = 0
+    while True:
+        frame = reader.get()
+        if frame is None:
+            break
+        buffer[:] = frame
+        n += 1
+    reader.stop()
+    return n / (time.perf_counter() - t_start)
+
+
+def run(n_repeats=3):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "video.mp4"
+        make_video(path)
+        buffer = np.empty((1024, 1024), np.uint8)
+        for label, fun in [
+            ("rgb decode in loop", replay_rgb),
+            ("prefetched red channel", replay_prefetch),
+            ("prefetched luma", lambda *args: replay_prefetch(*args, channel=None)),
+        ]:
+            fps = max(fun(path, buffer) for _ in range(n_repeats))
+            print("{:>25} {:>10.1f} fps".format(label, fps))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,74 @@
+"""Benchmark of the throughput of the lossless FFV1 recording of 1 megapixel
+frames depending on the number of compression threads, compared to the
+lossy mpeg4 encoding of StreamingVideoWriter. The frames are given to the
+writers directly, as the recording loop would.
+
+Run with python -m stytra.tests.benchmark_video_write
+"""
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Event
+from pathlib import Path
+from queue import Queue
+
+import numpy as np
+
+from stytra.hardware.video.write import LosslessVideoWriter, StreamingVideoWriter
+
+
+def make_frames(n_frames=200, size=1024):
+    yy, xx = np.mgrid[0:size, 0:size]
+    frames = np.random.randint(0, 40, (n_frames, size, size)).astype(np.uint8)
+    for i, frame in enumerate(frames):
+        # a moving blob on a noisy background
+        frame[(yy - size // 2) ** 2 + (xx - 4 * i % size) ** 2 < 80**2] = 200
+    return frames
+
+
+def record(writer, frames, filename_base):
+    writer.filename_queue.put(filename_base)
+    writer._configure(frames.shape[1:])
+    t_start = time.perf_counter()
+    for frame in frames:
+        writer._ingest_frame(frame)
+        writer._ingest_time(datetime.now())
+    writer._complete(filename_base)
+    fps = len(frames) / (time.perf_counter() - t_start)
+    writer._reset()
+    return fps
+
+
+def run():
+    frames = make_frames()
+    writers = [("mpeg4", lambda: StreamingVideoWriter(*queues(), log_format="csv"))]
+    for n_threads in [1, 2, 4, 8]:
+        writers.append(
+            (
+                "ffv1, {} threads".format(n_threads),
+                lambda n=n_threads: LosslessVideoWriter(
+                    *queues(),
+                    log_format="csv",
+                    n_threads=n,
+                    max_pending_frames=len(frames)
+                ),
+            )
+        )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i, (label, make_writer) in enumerate(writers):
+            writer = make_writer()
+            fps = record(writer, frames, str(Path(tmpdir) / "rec{}_".format(i)))
+            ratio = getattr(writer, "compression_ratio", np.nan)
+            print(
+                "{:>20} {:>10.1f} fps {:>8.1f} MB/s  compression ratio {:.2f}".format(
+                    label, fps, fps * frames[0].nbytes / 2**20, ratio
+                )
+            )
+
+
+def queues():
+    return Queue(), Event(), Event(), Event()
+
+
+if __name__ == "__main__":
+    run()
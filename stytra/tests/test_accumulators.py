@@ -0,0 +1,200 @@
+import datetime
+from queue import Queue
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from stytra.collectors import (
+    EstimatorLog,
+    QueueDataAccumulator,
+    RecordQueueAccumulator,
+)
+from stytra.collectors.namedtuplering import NamedTupleRing
+
+
+def make_experiment():
+    return SimpleNamespace(
+        t0=datetime.datetime.now(), protocol_runner=SimpleNamespace(running=True)
+    )
+
+
+def fill(acc, n=300):
+    tt = namedtuple("t", "tail_sum theta_00 label")
+    for i in range(n):
+        acc.update_list(i * 0.002, tt(np.sin(i / 10), float(i), "a"))
+
+
+def test_columnar_matches_list():
+    exp = make_experiment()
+    acc_list = EstimatorLog(experiment=exp)
+    acc_col = EstimatorLog(experiment=exp, columnar=True, chunk_size=64)
+    fill(acc_list)
+    fill(acc_col)
+
+    assert acc_col.columns == acc_list.columns
+    assert len(acc_col.stored_data) == len(acc_list.stored_data)
+    assert acc_col.stored_data[-1] == acc_list.stored_data[-1]
+    assert acc_col.times[-1] == acc_list.times[-1]
+
+    for n in [1, 10, 1000]:
+        df_col = acc_col.get_last_n(n)
+        df_list = acc_list.get_last_n(n)
+        assert list(df_col.columns) == list(df_list.columns)
+        assert np.allclose(df_col.tail_sum.values, df_list.tail_sum.values)
+        assert np.allclose(df_col.t.values, df_list.t.values)
+        assert (df_col.label.values == df_list.label.values).all()
+
+    assert np.allclose(acc_col.get_last_t(0.1).t, acc_list.get_last_t(0.1).t)
+
+    t_search = exp.t0 + datetime.timedelta(seconds=0.1011)
+    assert acc_col.values_at_abs_time(t_search) == acc_list.values_at_abs_time(t_search)
+
+
+def test_columnar_dtypes_match_list():
+    exp = make_experiment()
+    tt = namedtuple("t", "x n flag label n_missing")
+    dfs = []
+    for columnar in [False, True]:
+        acc = EstimatorLog(experiment=exp, columnar=columnar)
+        for i in range(10):
+            acc.update_list(
+                i * 0.01, tt(i / 2, i, i % 2 == 0, "a", np.nan if i == 5 else i)
+            )
+        dfs.append(acc.get_dataframe())
+        assert acc.stored_data[-1] == tt(4.5, 9, False, "a", 9)
+        assert type(acc.stored_data[-1].n) is int
+        assert type(acc.stored_data[-1].flag) is bool
+
+    # integer columns with missing values are float in both backends
+    pd.testing.assert_frame_equal(dfs[0], dfs[1])
+    assert list(dfs[1].dtypes[["x", "n", "flag", "n_missing", "t"]]) == [
+        np.float64,
+        np.int64,
+        bool,
+        np.float64,
+        np.float64,
+    ]
+
+
+def test_columnar_trimming():
+    exp = make_experiment()
+    exp.protocol_runner.running = False
+    acc = EstimatorLog(
+        experiment=exp, columnar=True, chunk_size=16, max_history_if_not_running=100
+    )
+    fill(acc, 1000)
+    assert len(acc.stored_data) <= 150
+    assert acc.stored_data[-1].theta_00 == 999
+    assert acc.get_dataframe().theta_00.values[0] == 1000 - len(acc.stored_data)
+
+
+def test_last_n_arrays():
+    exp = make_experiment()
+    for columnar in [False, True]:
+        acc = EstimatorLog(experiment=exp, columnar=columnar)
+        assert acc.get_last_n_arrays(10, ["tail_sum"]) is None
+        fill(acc)
+        t, arrays = acc.get_last_n_arrays(10, ["tail_sum", "theta_00"])
+        df = acc.get_last_n(10)
+        assert np.allclose(t, df.t.values)
+        assert np.allclose(arrays["tail_sum"], df.tail_sum.values)
+        assert np.allclose(arrays["theta_00"], df.theta_00.values)
+        assert not arrays["tail_sum"].flags.writeable
+
+
+def test_streaming(tmp_path):
+    exp = make_experiment()
+    for columnar in [False, True]:
+        acc = EstimatorLog(
+            experiment=exp,
+            columnar=columnar,
+            stream_chunk_size=50,
+            max_history_if_streaming=100,
+        )
+        acc.start_streaming(tmp_path / "stream")
+        fill(acc, 1000)
+        assert len(acc.stored_data) <= 150
+
+        filename = acc.save(tmp_path / "log_{}".format(columnar), "csv")
+        assert not acc.streaming
+        assert filename == "log_{}.hdf5".format(columnar)
+        df = pd.read_hdf(tmp_path / filename, "/data")
+        assert len(df) == 1000
+        assert np.allclose(df.theta_00.values, np.arange(1000))
+        assert np.allclose(df.t.values, np.arange(1000) * 0.002)
+
+
+def test_ring_accumulator():
+    exp = make_experiment()
+    tt = namedtuple("t", "tail_sum theta_00")
+    for columnar in [False, True]:
+        ring = NamedTupleRing()
+        acc = QueueDataAccumulator(experiment=exp, data_queue=ring, columnar=columnar)
+        for i in range(100):
+            ring.put(exp.t0 + datetime.timedelta(seconds=i / 100), tt(i, -i))
+        acc.update_list()
+        assert len(acc.stored_data) == 100
+        assert acc.stored_data[-1] == tt(99, -99)
+        # the times are taken relative to t0 from epoch timestamps,
+        # precise only to a fraction of a microsecond
+        assert np.allclose(
+            acc.get_dataframe().t.values, np.arange(100) / 100, atol=1e-6
+        )
+
+
+def test_record_accumulator():
+    exp = make_experiment()
+    columns = ("track_id", "x", "y")
+    for columnar in [False, True]:
+        queue = Queue()
+        acc = RecordQueueAccumulator(
+            experiment=exp, data_queue=queue, columnar=columnar
+        )
+        for i in range(10):
+            values = np.array([[j, i, -i] for j in range(i % 3)], dtype=np.float64)
+            if len(values) > 0:
+                t = exp.t0 + datetime.timedelta(seconds=i / 100)
+                queue.put((t, columns if i == 1 else None, values))
+        acc.update_list()
+        df = acc.get_dataframe()
+        assert len(df) == sum(i % 3 for i in range(10))
+        assert list(df.columns) == list(columns) + ["t"]
+        np.testing.assert_allclose(df.t.values, df.x.values / 100)
+
+        # the records of the last time point before the requested one
+        records = acc.records_at_abs_time(exp.t0 + datetime.timedelta(seconds=0.085))
+        np.testing.assert_array_equal(records, [[0, 8, -8], [1, 8, -8]])
+
+        # the column names are kept when the accumulator is reset
+        acc.reset()
+        queue.put((exp.t0, None, np.zeros((1, 3))))
+        acc.update_list()
+        assert acc.columns == ("t",) + columns
+
+
+def test_record_slot_arrays():
+    exp = make_experiment()
+    columns = ("track_id", "i_fish", "x")
+    for columnar in [False, True]:
+        queue = Queue()
+        acc = RecordQueueAccumulator(
+            experiment=exp, data_queue=queue, columnar=columnar
+        )
+        # the fish in slot 1 is tracked in the odd frames
+        for i in range(10):
+            values = np.array([[7, 0, i]] + ([[9, 1, -i]] if i % 2 else []))
+            t = exp.t0 + datetime.timedelta(seconds=i / 100)
+            queue.put((t, columns if i == 0 else None, values.astype(np.float64)))
+        acc.update_list()
+
+        # the time points can be those of the tracking data, a bit different
+        t = np.arange(4, 12) / 100 + 1e-7
+        x = acc.get_slot_arrays(t, ["x"])["x"]
+        assert x.shape == (8, 2)
+        np.testing.assert_array_equal(x[:6, 0], np.arange(4, 10))
+        np.testing.assert_array_equal(x[:6:2, 1], np.full(3, np.nan))
+        np.testing.assert_array_equal(x[1:6:2, 1], [-5, -7, -9])
+        assert np.all(np.isnan(x[6:]))
+        assert acc.get_slot_arrays(t[:1], ["x"], n_slots=3)["x"].shape == (1, 3)
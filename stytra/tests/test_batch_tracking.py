@@ -0,0 +1,193 @@
+from stytra.offline.batch_tracking import (
+    track_videos,
+    track_frames,
+    make_pipeline,
+    read_frames,
+    expand_paths,
+    track_segment,
+    split_segments,
+    stitch_segments,
+)
+from stytra.experiments.fish_pipelines import pipeline_dict
+from stytra.tracking.fish import records_to_wide
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import shutil
+import json
+import pytest
+
+VIDEO_PATH = Path(__file__).parents[1] / "examples" / "assets" / "fish_compressed.h5"
+FREE_VIDEO_PATH = VIDEO_PATH.parent / "fish_free_compressed.h5"
+
+
+def test_batch_tracking(tmp_path):
+    videos = [tmp_path / "fish{}.h5".format(i) for i in range(2)]
+    for video in videos:
+        shutil.copy(str(VIDEO_PATH), str(video))
+    pipeline = pipeline_dict["tail"]()
+    pipeline.setup()
+    params_path = tmp_path / "fish0_trackingparams.json"
+    json.dump(
+        dict(pipeline_type="tail", pipeline_params=pipeline.serialize_params()),
+        open(str(params_path), "w"),
+    )
+
+    saved = track_videos(
+        expand_paths([str(tmp_path / "*.h5")]),
+        params_path,
+        fileformat="csv",
+        n_workers=2,
+        verbose=False,
+    )
+    assert saved == ["fish0.csv", "fish1.csv"]
+
+    for video in videos:
+        df = pd.read_csv(str(video.with_suffix(".csv")), sep=";", index_col=0)
+        expected, records = track_frames(
+            make_pipeline("tail", pipeline.serialize_params()), read_frames(video)
+        )
+        assert records is None
+        assert len(df) == len(expected) > 0
+        np.testing.assert_allclose(df.values, expected.values)
+
+
+def test_segmented_tracking(tmp_path):
+    video = tmp_path / "fish.h5"
+    shutil.copy(str(VIDEO_PATH), str(video))
+    pipeline = pipeline_dict["tail"]()
+    pipeline.setup()
+    params = pipeline.serialize_params()
+    # the temporal filter makes the output depend on the previous frames
+    params["/source/filtering/tail_tracking"]["time_filter_weight"] = 0.5
+    params_path = tmp_path / "fish_trackingparams.json"
+    json.dump(
+        dict(pipeline_type="tail", pipeline_params=params), open(str(params_path), "w")
+    )
+
+    sequential, _ = track_frames(make_pipeline("tail", params), read_frames(video))
+
+    without_warmup = stitch_segments(
+        [
+            track_segment(video, "tail", params, start, stop)[0]
+            for start, stop in split_segments(len(sequential), 50)
+        ]
+    )
+    assert np.nanmax(np.abs(without_warmup.values - sequential.values)) > 1e-2
+
+    track_videos(
+        [video],
+        params_path,
+        fileformat="csv",
+        n_workers=2,
+        segment_frames=50,
+        warmup_frames=20,
+        verbose=False,
+    )
+    stitched = pd.read_csv(str(video.with_suffix(".csv")), sep=";", index_col=0)
+    assert list(stitched.index) == list(range(len(sequential)))
+    assert list(stitched.columns) == list(sequential.columns)
+    np.testing.assert_allclose(stitched.values, sequential.values, atol=1e-4)
+
+
+def test_segmented_fish_tracking(tmp_path):
+    video = tmp_path / "fish.h5"
+    shutil.copy(str(FREE_VIDEO_PATH), str(video))
+    pipeline = pipeline_dict["fish"]()
+    pipeline.setup()
+    params = pipeline.serialize_params()
+    params_path = tmp_path / "fish_trackingparams.json"
+    json.dump(
+        dict(pipeline_type="fish", pipeline_params=params), open(str(params_path), "w")
+    )
+    sequential, _ = track_frames(make_pipeline("fish", params), read_frames(video))
+    segments = split_segments(len(sequential), 100)
+
+    def stitched(warmup_frames):
+        return stitch_segments(
+            [
+                track_segment(video, "fish", params, start, stop, warmup_frames)[0]
+                for start, stop in segments
+            ]
+        )
+
+    # the background and the Kalman filters of the fish are set from the
+    # first frames of the segments, without warm-up the fish are missed
+    with pytest.warns(UserWarning, match="warm-up"):
+        track_videos(
+            [video], params_path, fileformat="csv", segment_frames=100, verbose=False
+        )
+    without_warmup = pd.read_csv(str(video.with_suffix(".csv")), sep=";", index_col=0)
+    assert np.any(np.isnan(without_warmup.values) != np.isnan(sequential.values))
+
+    # with a long enough warm-up, the same fish are tracked, at close positions
+    positions = ["f0_x", "f0_y"]
+    warmed_up = stitched(200)
+    np.testing.assert_array_equal(
+        np.isnan(warmed_up.values), np.isnan(sequential.values)
+    )
+    np.testing.assert_allclose(
+        warmed_up[positions].values, sequential[positions].values, atol=0.1
+    )
+
+    # and if the segments are tracked from the first frame, the same output
+    pd.testing.assert_frame_equal(stitched(segments[-1][0]), sequential)
+
+
+def test_sparse_records(tmp_path):
+    video = tmp_path / "fish.h5"
+    shutil.copy(str(FREE_VIDEO_PATH), str(video))
+    pipeline = pipeline_dict["fish"]()
+    pipeline.setup()
+    params = pipeline.serialize_params()
+    wide, _ = track_frames(make_pipeline("fish", params), read_frames(video))
+
+    # with the sparse output, the fish are saved as records, in a second file
+    params["/source/bgsub/fish_tracking"]["sparse_output"] = True
+    params_path = tmp_path / "fish_trackingparams.json"
+    json.dump(
+        dict(pipeline_type="fish", pipeline_params=params), open(str(params_path), "w")
+    )
+    for segment_frames in [None, 100]:
+        saved = track_videos(
+            [video],
+            params_path,
+            fileformat="csv",
+            segment_frames=segment_frames,
+            warmup_frames=len(wide),
+            verbose=False,
+        )
+        assert saved == ["fish.csv"]
+        df = pd.read_csv(str(video.with_suffix(".csv")), sep=";", index_col=0)
+        assert list(df.columns) == ["n_fish", "biggest_area"]
+        records = pd.read_csv(str(tmp_path / "fish_records.csv"), sep=";", index_col=0)
+        assert len(records) == df["n_fish"].sum() > 0
+
+        from_records = records_to_wide(records, 1, range(len(wide)), index="frame")
+        np.testing.assert_allclose(
+            from_records.drop(columns="frame").values,
+            wide.drop(columns="biggest_area").values,
+            atol=1e-6,
+        )
+
+
+def test_read_frames_segment_ffmpeg(tmp_path):
+    pytest.importorskip("imageio_ffmpeg")
+    av = pytest.importorskip("av")
+    path = tmp_path / "video.mp4"
+    container = av.open(str(path), "w")
+    stream = container.add_stream("mpeg4", rate=50)
+    stream.width, stream.height, stream.pix_fmt = 64, 48, "yuv420p"
+    for i in range(300):
+        im = np.full((48, 64), i % 200, dtype=np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(im, format="gray")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+    # the segments start where the video is read from its beginning
+    frames = list(read_frames(path))
+    for start, stop in [(0, 10), (250, 260), (290, None)]:
+        segment = list(read_frames(path, start, stop))
+        np.testing.assert_array_equal(np.stack(segment), np.stack(frames[start:stop]))
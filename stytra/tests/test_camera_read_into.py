@@ -0,0 +1,93 @@
+from stytra.hardware.video import CameraSource, CameraControlParameters
+from stytra.hardware.video.cameras import camera_class_dict
+from stytra.hardware.video.cameras.interface import Camera
+from threading import Thread
+from queue import Empty
+import tracemalloc
+import numpy as np
+import time
+
+
+class CountingCamera(Camera):
+    """Camera putting the frame number in each frame, which measures the
+    memory allocated in steady state, after n_warmup frames"""
+
+    shape = (256, 256)
+
+    def __init__(self, kill_event, n_warmup=20, n_frames=100, **kwargs):
+        super().__init__(**kwargs)
+        self.kill_event = kill_event
+        self.n_warmup = n_warmup
+        self.n_frames = n_frames
+        self.i_frame = 0
+        self.memory_start = None
+        self.memory_peak = None
+
+    def open_camera(self):
+        return []
+
+    def read(self):
+        return self.read_into(None)
+
+    def read_into(self, buffer):
+        if self.i_frame == self.n_warmup:
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        elif self.i_frame == self.n_warmup + self.n_frames:
+            self.memory_peak = tracemalloc.get_traced_memory()[1]
+            self.kill_event.set()
+
+        if buffer is None or buffer.shape != self.shape:
+            buffer = np.zeros(self.shape, np.uint16)
+        buffer.fill(self.i_frame)
+        self.i_frame += 1
+        time.sleep(0.002)
+        return buffer
+
+
+class AllocatingCamera(CountingCamera):
+    """Camera returning a new frame each time, as if it did not implement
+    read_into"""
+
+    def read_into(self, buffer):
+        return self.fill_buffer(super().read_into(None), buffer)
+
+
+def acquire(camera_class, monkeypatch):
+    monkeypatch.setitem(camera_class_dict, "counting", camera_class)
+    source = CameraSource("counting")
+    source.camera_params = dict(kill_event=source.kill_event)
+    source.state = CameraControlParameters()
+    source.state.params.values = dict(
+        replay=False, framerate=10.0, ring_buffer_length=1
+    )
+    tracemalloc.start()
+    thread = Thread(target=source.run)
+    thread.start()
+    indices = []
+    while thread.is_alive() or not source.frame_queue.empty():
+        try:
+            _, i, frame = source.frame_queue.get(timeout=0.01)
+            indices.append((i, frame[0, 0]))
+        except Empty:
+            pass
+    thread.join()
+    tracemalloc.stop()
+    source.frame_queue.release()
+    return source, indices
+
+
+def test_no_allocation_in_steady_state(monkeypatch):
+    source, indices = acquire(CountingCamera, monkeypatch)
+    cam = source.cam
+    frame_bytes = np.prod(cam.shape) * 2
+
+    # the frames arrive in order, and are read directly in the frame pool
+    assert len(indices) > cam.n_frames
+    assert all(i_next > i for (i, _), (i_next, _) in zip(indices, indices[1:]))
+    assert all(value > i_prev for (_, i_prev), (_, value) in zip(indices, indices[1:]))
+    assert source.frame_pool.n_used() == 0
+    assert cam.memory_peak - cam.memory_start < frame_bytes / 4
+
+    source, _ = acquire(AllocatingCamera, monkeypatch)
+    assert source.cam.memory_peak - source.cam.memory_start >= frame_bytes
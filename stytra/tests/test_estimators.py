@@ -0,0 +1,54 @@
+import datetime
+from collections import namedtuple
+from queue import Queue
+from types import SimpleNamespace
+
+import numpy as np
+from stytra.collectors import EstimatorLog, RecordQueueAccumulator
+from stytra.stimulation.estimators import PositionEstimator
+
+
+def make_experiment():
+    exp = SimpleNamespace(
+        t0=datetime.datetime.now(),
+        protocol_runner=SimpleNamespace(running=True),
+        calibrator=SimpleNamespace(cam_to_proj=None),
+        latency_trace=None,
+    )
+    exp.estimator_log = EstimatorLog(experiment=exp)
+    return exp
+
+
+def test_position_estimator_sparse():
+    records = ("track_id", "i_fish", "x", "vx", "y", "vy", "theta", "vtheta")
+    for sparse in [False, True]:
+        exp = make_experiment()
+        acc = EstimatorLog(experiment=exp)
+        record_queue = Queue()
+        exp.acc_tracking_records = RecordQueueAccumulator(
+            experiment=exp, data_queue=record_queue
+        )
+        estimator = PositionEstimator(acc, experiment=exp)
+
+        def add_frame(i, fish):
+            # with the sparse output, the fish are only in the records
+            if sparse:
+                acc.update_list(i * 0.01, namedtuple("t", "n_fish")(len(fish)))
+                if len(fish) > 0:
+                    t = exp.t0 + datetime.timedelta(seconds=i * 0.01)
+                    values = np.array([(4, 0) + fish], dtype=np.float64)
+                    record_queue.put((t, records if i == 0 else None, values))
+                exp.acc_tracking_records.update_list()
+            else:
+                tt = namedtuple("t", ["f0_" + c for c in records[2:]])
+                acc.update_list(i * 0.01, tt(*(fish or (np.nan,) * 6)))
+
+        for i in range(2):
+            add_frame(i, (10.0 + i, 1.0, 20.0, 0.0, 0.5, 0.0))
+        np.testing.assert_allclose(estimator.get_position(), [20, 11, 0.5])
+        np.testing.assert_allclose(estimator.get_camera_position(), [11, 20, 0.5])
+        assert estimator.get_istantaneous_velocity() == np.sqrt(2)
+
+        # the fish is lost
+        add_frame(2, ())
+        assert np.all(np.isnan(estimator.get_position()))
@@ -0,0 +1,111 @@
+from stytra.hardware.video.frame_pool import FramePool
+from stytra.hardware.video import CameraSource
+from multiprocessing import Process
+from queue import Full
+import numpy as np
+import pytest
+
+
+def test_frames_shared_between_consumers():
+    pool = FramePool(max_mbytes=0.001, max_slots=4)
+    first = pool.channel(indexed=True)
+    second = pool.channel()
+    frame = np.arange(200, dtype=np.uint8).reshape(10, 20)
+
+    pool.put(frame, timestamp=1.0, index=7, channels=[first, second])
+    t, i, received = first.get(timeout=1)
+    assert (t, i) == (1.0, 7)
+    np.testing.assert_array_equal(received, frame)
+
+    # forwarding the received frame does not copy it
+    forwarded = pool.channel()
+    first.share(received, forwarded)
+    _, other = second.get(timeout=1)
+    _, again = forwarded.get(timeout=1)
+    assert np.shares_memory(received, again)
+    assert np.shares_memory(received, other)
+
+    # the slot is freed once all the consumers are done with it
+    assert pool.n_used() == 1
+    for channel in [first, second, forwarded]:
+        channel.release()
+    assert pool.n_used() == 0
+
+
+def test_pool_full_and_resized():
+    # room for 5 frames of 200 bytes, as slots are aligned to 64 bytes
+    pool = FramePool(max_mbytes=0.00128, max_slots=8)
+    channel = pool.channel()
+    for i in range(5):
+        channel.put(np.full((10, 20), i, np.uint8))
+    assert pool.n_slots == 5
+    with pytest.raises(Full):
+        channel.put(np.zeros((10, 20), np.uint8))
+
+    # slots are reused in order as the frames are consumed
+    for i in range(5):
+        _, frame = channel.get(timeout=1)
+        assert frame[0, 0] == i
+    channel.release()
+
+    # larger frames take consecutive free slots, while the others are in use
+    for i in range(5):
+        channel.put(np.full((10, 20), i, np.uint8))
+    for i in range(3):
+        _, frame = channel.get(timeout=1)
+    channel.put(np.full((20, 20), 5, np.uint8))
+    assert pool.n_slots == 5
+    with pytest.raises(Full):
+        channel.put(np.zeros((20, 20), np.uint8))
+    for i in range(3, 6):
+        _, frame = channel.get(timeout=1)
+        assert frame[0, 0] == i
+    channel.release()
+
+    # or a new slot after the last one in use
+    pool = FramePool(max_mbytes=0.00128, max_slots=8)
+    channel = pool.channel()
+    channel.put(np.full((10, 20), 0, np.uint8))
+    channel.put(np.full((20, 20), 1, np.uint8))
+    assert pool.n_slots == 2
+    for i in range(2):
+        _, frame = channel.get(timeout=1)
+        assert frame[0, 0] == i
+    channel.release()
+    with pytest.raises(ValueError):
+        channel.put(np.zeros((40, 40), np.uint8))
+
+    bounded = pool.channel(maxsize=1)
+    bounded.put(np.zeros((5, 5), np.uint8))
+    with pytest.raises(Full):
+        bounded.put(np.zeros((5, 5), np.uint8))
+
+
+def consume(channel, result_channel):
+    _, _, frame = channel.get(timeout=5)
+    # modify the frame in shared memory and send it back
+    frame += 1
+    channel.share(frame, result_channel)
+
+
+def test_frames_across_processes():
+    # the former argument is accepted, the consumers are added to the source
+    source = CameraSource("mock", n_consumers=2)
+    assert source.n_consumers == 1
+    extra = source.add_consumer()
+    result = source.frame_pool.channel()
+    assert source.n_consumers == 2
+    process = Process(target=consume, args=(source.frame_queue, result))
+    process.start()
+
+    messages = []
+    source.put_frame(np.zeros((32, 32), np.uint16), messages)
+    _, received = result.get(timeout=30)
+    process.join()
+    assert messages == []
+    assert received.dtype == np.uint16
+    assert np.all(received == 1)
+
+    _, i_frame, frame = extra.get(timeout=1)
+    assert i_frame == 0
+    assert np.shares_memory(frame, received)
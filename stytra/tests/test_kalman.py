@@ -30,3 +30,31 @@ def test_fish():
             ]
         ),
     )
+
+
+def test_fish_assignment():
+    """Test that detections are matched to the closest predicted fish
+    overall, and not to the first one within the gates"""
+    fshs = Fishes(3, 1.0, 1.0, 1, 1.0, 1)
+    fshs.add_fish(np.array([0.0, 0.0, 0.0, 0.0]))
+    fshs.add_fish(np.array([10.0, 0.0, 0.0, 0.0]))
+    fshs.predict()
+    i_assigned = fshs.update(
+        np.array(
+            [
+                [9.0, 0.0, 0.1, 1.0],
+                [1.0, 0.0, 0.1, 2.0],
+                [100.0, 0.0, 0.0, 3.0],
+            ]
+        )
+    )
+    np.testing.assert_array_equal(i_assigned, [1, 0, -1])
+    np.testing.assert_array_equal(fshs.coords[:2, 6], [2.0, 1.0])
+    assert fshs.coords[0, 0] < 1.0 < 9.0 < fshs.coords[1, 0]
+
+    # fish which were already updated are not updated again,
+    # and the gates can be set
+    fshs.predict()
+    assert np.all(fshs.update(np.array([[100.0, 0.0, 0.0, 3.0]])) == -1)
+    assert np.all(fshs.update(np.array([[1.0, 0.0, 0.0, 3.0]])) == 0)
+    assert np.all(fshs.update(np.array([[30.0, 0.0, 0.0, 3.0]]), 30.0) == 1)
@@ -0,0 +1,122 @@
+from stytra.collectors import QueueDataAccumulator
+from stytra.collectors.latency import LatencyTrace, LatencyHistograms
+from stytra.collectors.namedtuplequeue import NamedTupleQueue
+from stytra.hardware.video import VideoSource
+from stytra.tracking.tracking_process import TrackingProcess
+from stytra.tracking.pipelines import Pipeline, ImageToDataNode, NodeOutput
+from multiprocessing import Event, Queue
+from collections import namedtuple
+from types import SimpleNamespace
+import datetime
+import numpy as np
+import pandas as pd
+import time
+
+
+class MeanNode(ImageToDataNode):
+    def __init__(self, *args, **kwargs):
+        super().__init__("mean", *args, **kwargs)
+        self._output_type = namedtuple("t", "mean")
+
+    def _process(self, im):
+        return NodeOutput([], self._output_type(float(im.mean())))
+
+
+class MeanPipeline(Pipeline):
+    def __init__(self):
+        super().__init__()
+        self.mean = MeanNode(parent=self.root)
+
+
+def test_trace_camera_to_display(tmp_path):
+    n_frames = 30
+    trace = LatencyTrace(n_slots=64)
+    histograms = LatencyHistograms(trace, timeout=0)
+    source = VideoSource(max_mbytes_queue=1)
+    source.latency_trace = trace
+    finished = Event()
+    output_queue = NamedTupleQueue()
+    process = TrackingProcess(
+        source.frame_queue,
+        finished_signal=finished,
+        pipeline=MeanPipeline,
+        processing_parameter_queue=Queue(),
+        output_queue=output_queue,
+        latency_trace=trace,
+    )
+    process.start()
+    acc = QueueDataAccumulator(
+        data_queue=output_queue,
+        experiment=SimpleNamespace(
+            t0=datetime.datetime.now(), protocol_runner=SimpleNamespace(running=True)
+        ),
+        latency_trace=trace,
+    )
+
+    try:
+        # wait for the tracking to be running, not to drop the frames
+        source.put_frame(np.zeros((16, 16), dtype=np.uint8))
+        t_start = time.time()
+        while len(acc.stored_data) == 0 and time.time() - t_start < 30:
+            acc.update_list()
+        histograms.reset()
+
+        # the main process stages happen for the newest frame each time
+        for i in range(n_frames):
+            source.put_frame(np.full((16, 16), i, dtype=np.uint8))
+            time.sleep(0.01)
+            acc.update_list()
+            for stage in ["estimated", "protocol", "painted"]:
+                trace.advance(stage)
+
+        t_start = time.time()
+        while len(acc.stored_data) < n_frames + 1 and time.time() - t_start < 10:
+            acc.update_list()
+    finally:
+        finished.set()
+        process.join()
+
+    assert len(acc.stored_data) == n_frames + 1
+    histograms.update()
+    n_counted = histograms.n_frames()
+    assert n_counted["tracking_end"] == n_frames
+    assert 0 < n_counted["painted"] <= n_counted["accumulated"]
+
+    # the stages are reached in order
+    times = trace.times[trace.frame_ids >= 0]
+    complete = ~np.isnan(times).any(1)
+    assert complete.sum() == n_counted["painted"]
+    assert np.all(np.diff(times[complete], axis=1) >= 0)
+
+    # the frames which were counted are not counted again
+    histograms.update()
+    assert histograms.n_frames() == n_counted
+
+    saved = pd.read_csv(
+        tmp_path / histograms.save(str(tmp_path / "latency"), "csv"),
+        sep=";",
+        index_col=0,
+    )
+    assert list(saved.columns) == ["latency_ms"] + list(trace.stages[1:])
+    assert saved["tracking_end"].sum() == n_frames
+
+
+def test_trace_slots_reused():
+    trace = LatencyTrace(n_slots=4)
+    histograms = LatencyHistograms(trace, bin_ms=1, timeout=0)
+    timestamp = datetime.datetime.now()
+    trace.capture(1, timestamp, t=0.0)
+    trace.mark("tracking_start", 1, t=0.002)
+    assert trace.frame_at(timestamp) == 1
+
+    # once the slot is reused, the old frame is not marked anymore
+    trace.capture(5, timestamp + datetime.timedelta(seconds=1), t=1.0)
+    trace.mark("tracking_end", 1, t=1.5)
+    assert trace.frame_at(timestamp) is None
+    assert np.isnan(trace.times[1, 1:]).all()
+
+    # each stage is marked only the first time it is reached
+    trace.mark("tracking_start", 5, t=1.0015)
+    trace.mark("tracking_start", 5, t=1.5)
+    histograms.update()
+    assert histograms.percentile("tracking_start", 50) == 2
@@ -0,0 +1,46 @@
+from stytra.collectors.namedtuplering import NamedTupleRing
+from multiprocessing import Process
+from collections import namedtuple
+import numpy as np
+
+
+class RingProducer(Process):
+    def __init__(self, ring, n_items):
+        super().__init__()
+        self.ring = ring
+        self.n_items = n_items
+
+    def run(self):
+        t1 = namedtuple("t", "a b c")
+        t2 = namedtuple("t", "x y")
+        for i in range(self.n_items):
+            self.ring.put(float(i), t1(i, 2 * i, 3.5))
+        self.ring.put(float(self.n_items), t2(-1.0, -2.0))
+
+
+def test_ring():
+    ring = NamedTupleRing(n_slots=64, max_fields=8)
+    proc = RingProducer(ring, 20)
+    proc.start()
+    proc.join()
+
+    segments = ring.drain()
+    assert len(segments) == 2
+    tuple_type, ts, values = segments[0]
+    assert tuple_type._fields == ("a", "b", "c")
+    assert np.allclose(ts, np.arange(20))
+    assert np.allclose(values[:, 1], 2 * np.arange(20))
+    tuple_type, ts, values = segments[1]
+    assert tuple_type._fields == ("x", "y")
+    assert tuple_type._make(values[0]) == (-1.0, -2.0)
+    assert ring.drain() == []
+
+
+def test_ring_overflow():
+    ring = NamedTupleRing(n_slots=8, max_fields=4)
+    tt = namedtuple("t", "a")
+    for i in range(20):
+        ring.put(float(i), tt(i))
+    assert ring.n_dropped == 13
+    ((_, ts, values),) = ring.drain()
+    assert np.allclose(values[:, 0], np.arange(7))
@@ -1,5 +1,16 @@
+import datetime
+from collections import namedtuple
+from queue import Queue
+from types import SimpleNamespace
+
 import numpy as np
-from stytra.tracking.online_bouts import find_bouts_online, BoutState
+from stytra.collectors import EstimatorLog, RecordQueueAccumulator
+from stytra.tracking.online_bouts import (
+    find_bouts_online,
+    find_bout_edges_online,
+    BoutRecordingTrigger,
+    BoutState,
+)
 
 
 def test_online_bout_det():
@@ -17,3 +28,85 @@ def test_online_bout_det():
         pad_before=0,
     )
     assert len(k) == 11
+
+
+def test_bout_edges_in_chunks():
+    vel_profile = np.zeros(40)
+    vel_profile[[3, 4, 5, 20, 21]] = 2
+    edges = find_bout_edges_online(vel_profile, BoutState(0, 0.0, 0, 0, 0))
+    # the same edges are found if the velocities arrive in pieces
+    state = BoutState(0, 0.0, 0, 0, 0)
+    starts, ends = [], []
+    for i in range(0, 40, 7):
+        s, e, state = find_bout_edges_online(vel_profile[i : i + 7], state)
+        starts.extend(s + i)
+        ends.extend(e + i)
+    assert list(edges[0]) == starts == [3, 20]
+    assert list(edges[1]) == ends == [12, 28]
+
+
+def test_bout_recording_trigger():
+    exp = SimpleNamespace(
+        t0=datetime.datetime.now(), protocol_runner=SimpleNamespace(running=True)
+    )
+    acc = EstimatorLog(experiment=exp)
+    queue = Queue()
+    trigger = BoutRecordingTrigger(acc, queue)
+    trigger.detection_params.threshold = 1.0
+
+    tt = namedtuple("t", "f0_x f0_y f0_theta f1_x f1_y f1_theta")
+    x = np.zeros(200)
+    # the second fish swims between frames 50 and 60
+    x[50:60] = np.arange(1, 11) * 2
+    x[60:] = 20
+    for i in range(200):
+        acc.update_list(i * 0.01, tt(0.0, 0.0, 0.0, x[i], 5.0, 0.0))
+        if i % 25 == 0:
+            trigger.update()
+    trigger.update()
+
+    t0 = exp.t0.timestamp()
+    event, t = queue.get(timeout=1)
+    assert event == "start"
+    assert np.isclose(t - t0, 0.50)
+    event, t = queue.get(timeout=1)
+    assert event == "stop"
+    assert 0.6 < t - t0 < 0.7
+
+
+def test_bout_recording_trigger_sparse():
+    exp = SimpleNamespace(
+        t0=datetime.datetime.now(), protocol_runner=SimpleNamespace(running=True)
+    )
+    acc = EstimatorLog(experiment=exp)
+    record_queue = Queue()
+    acc_records = RecordQueueAccumulator(experiment=exp, data_queue=record_queue)
+    queue = Queue()
+    trigger = BoutRecordingTrigger(acc, queue, acc_records=acc_records)
+    trigger.detection_params.threshold = 1.0
+
+    # with the sparse output, the fish are only in the records, and the
+    # second fish swims between frames 50 and 60
+    tt = namedtuple("t", "n_fish biggest_area")
+    columns = ("track_id", "i_fish", "x", "vx", "y", "vy", "theta", "vtheta")
+    x = np.zeros(200)
+    x[50:60] = np.arange(1, 11) * 2
+    x[60:] = 20
+    for i in range(200):
+        acc.update_list(i * 0.01, tt(2.0, 300.0))
+        records = np.array([[0, 0, 0, 0, 0, 0, 0, 0], [1, 1, x[i], 0, 5, 0, 0, 0]])
+        t = exp.t0 + datetime.timedelta(seconds=i * 0.01)
+        record_queue.put((t, columns if i == 0 else None, records.astype(float)))
+        if i % 25 == 0:
+            acc_records.update_list()
+            trigger.update()
+    acc_records.update_list()
+    trigger.update()
+
+    t0 = exp.t0.timestamp()
+    event, t = queue.get(timeout=1)
+    assert event == "start"
+    assert np.isclose(t - t0, 0.50)
+    event, t = queue.get(timeout=1)
+    assert event == "stop"
+    assert 0.6 < t - t0 < 0.7
@@ -1,6 +1,13 @@
-from stytra.tracking.pipelines import Pipeline, ImageToDataNode, NodeOutput
+from stytra.tracking.pipelines import (
+    Pipeline,
+    ImageToDataNode,
+    ImageToImageNode,
+    NodeOutput,
+)
+from stytra.tracking.profiling import TimingSender
 from lightparam import Param
 from collections import namedtuple
+from queue import Queue
 
 
 class TestNode(ImageToDataNode):
@@ -38,3 +45,85 @@ def test_a_pipeline():
     p.deserialize_params(ser)
     assert p.run(None) == NodeOutput([], tt(None, 2))
     assert p.diagnostic_image == "img"
+
+
+class ScaleNode(ImageToImageNode):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, name="scale", **kwargs)
+
+    def _process(self, input, factor: Param(2)):
+        return NodeOutput(["I:scaled"], input * factor)
+
+
+class SumNode(ImageToDataNode):
+    def __init__(self, *args, n_outputs=2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_outputs = n_outputs
+
+    def reset(self):
+        self._output_type = namedtuple(
+            "o", ["{}_{}".format(self.name, i) for i in range(self.n_outputs)]
+        )
+        self._output_type_changed = True
+
+    def _process(self, input, offset: Param(0)):
+        if self._output_type is None:
+            self.reset()
+        return NodeOutput(
+            [self.name],
+            self._output_type(*(input + offset + i for i in range(self.n_outputs))),
+        )
+
+
+class BranchingPipeline(Pipeline):
+    def __init__(self):
+        super().__init__()
+        self.scale = ScaleNode(parent=self.root)
+        self.a = SumNode(name="a", parent=self.scale)
+        self.b = SumNode(name="b", parent=self.root, n_outputs=3)
+        self.c = SumNode(name="c", parent=self.scale, n_outputs=1)
+
+
+def test_compiled_plan_matches_recursive_run():
+    p = BranchingPipeline()
+    p.setup()
+    for i in range(3):
+        out = p.run(i)
+        assert out == p.recursive_run(p.root, i)
+        assert out.messages == ["I:scaled", "a", "c", "b"]
+        assert out.data._fields == ("a_0", "a_1", "c_0", "b_0", "b_1", "b_2")
+        assert tuple(out.data) == (2 * i, 2 * i + 1, 2 * i, i, i + 1, i + 2)
+
+    # changing the outputs of a node rebuilds the output layout
+    p.a.n_outputs = 1
+    p.a.reset()
+    out = p.run(1)
+    assert out.data._fields == ("a_0", "c_0", "b_0", "b_1", "b_2")
+    assert tuple(out.data) == (2, 2, 1, 2, 3)
+
+
+def test_node_timing():
+    p = BranchingPipeline()
+    p.setup()
+    p.run(1)
+    assert p.node_timings() == dict()
+
+    p.deserialize_params({"profiling": dict(time_nodes=True, n_samples=10)})
+    for i in range(15):
+        p.run(i)
+    timings = p.node_timings()
+    assert set(timings.keys()) == set(p.node_dict.keys())
+    for summary in timings.values():
+        assert summary.n == 10
+        assert 0 <= summary.mean <= summary.p95 <= summary.max
+
+    sent = Queue()
+    sender = TimingSender(sent, "tracking", interval=0)
+    sender.update(p)
+    _, source, summaries = sent.get(timeout=1)
+    assert source == "tracking" and summaries.keys() == timings.keys()
+
+    p.deserialize_params({"profiling": dict(time_nodes=False)})
+    assert p.node_timings() == dict()
+    sender.update(p)
+    assert sent.empty()
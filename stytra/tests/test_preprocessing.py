@@ -0,0 +1,57 @@
+from stytra.tracking.preprocessing import Prefilter, BackgroundSubtractor, negdif
+import numpy as np
+import cv2
+
+
+def test_prefilter_buffers():
+    prefilter = Prefilter()
+    prefilter.setup()
+    params = dict(image_scale=0.5, filter_size=2, color_invert=True, clip=140)
+    for shape in [(120, 160), (120, 160), (75, 93)]:
+        frame = np.random.randint(0, 255, shape, dtype=np.uint8)
+        input_frame = frame.copy()
+        out = prefilter._process(frame, **params).data
+
+        expected = cv2.resize(frame, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+        expected = 255 - cv2.boxFilter(expected, -1, (2, 2))
+        expected = cv2.threshold(expected, 140, 255, cv2.THRESH_TOZERO)[1]
+        np.testing.assert_array_equal(out, expected)
+        np.testing.assert_array_equal(frame, input_frame)
+
+        # the output is written in one of the buffers of the node,
+        # reallocated when the frame shape changes
+        assert any(out is buffer for buffer in prefilter._buffers.values())
+        assert len(prefilter._buffers) == 2
+
+    # without resizing or filtering, the input frame is not overwritten
+    out = prefilter._process(
+        frame, image_scale=1, filter_size=0, color_invert=True, clip=0
+    ).data
+    np.testing.assert_array_equal(out, 255 - input_frame)
+    np.testing.assert_array_equal(frame, input_frame)
+
+
+def test_background_subtractor_buffers():
+    bgsub = BackgroundSubtractor()
+    bgsub.setup()
+    frames = np.random.randint(0, 255, (5, 40, 50), dtype=np.uint8)
+    background = frames[0].astype(np.float32)
+    outputs = []
+    for i, frame in enumerate(frames):
+        if i > 0 and i % 2 == 0:
+            background = frame.astype(np.float32) * np.float32(
+                0.1
+            ) + background * np.float32(0.9)
+        out = bgsub._process(
+            frame, learning_rate=0.1, learn_every=2, only_darker=True
+        ).data
+        np.testing.assert_allclose(bgsub.background_image, background, atol=1e-3)
+        np.testing.assert_allclose(out, negdif(background, frame), atol=1)
+        outputs.append(out)
+    assert all(out is outputs[0] for out in outputs)
+
+    # a frame of a new shape starts a new background
+    frame = np.zeros((20, 30), dtype=np.uint8)
+    output = bgsub._process(frame, learning_rate=0.1, learn_every=2, only_darker=True)
+    assert output.messages == ["I:New backgorund image set"]
+    assert output.data.shape == frame.shape
@@ -0,0 +1,59 @@
+from stytra.hardware.video import CameraSource
+from stytra.hardware.video.ring_buffer import RingBuffer
+from stytra.stimulation.stimuli import SaveCameraBufferStimulus
+from types import SimpleNamespace
+import logging
+import flammkuchen as fl
+import numpy as np
+
+
+def test_detach_and_save(tmp_path):
+    source = CameraSource("mock")
+    source.ring_buffer = RingBuffer(10)
+    messages = []
+    source.save_buffer(str(tmp_path / "empty.h5"), messages)
+    assert messages == ["W:No frames in the buffer to save"]
+
+    # the buffer wraps around
+    for i in range(14):
+        source.ring_buffer.put(np.full((4, 6), i, np.uint8), t=100.0 + i)
+    source.save_buffer(str(tmp_path / "buffer.h5"), messages)
+    # the camera can continue putting frames while the buffer is saved
+    source.ring_buffer.put(np.full((4, 6), 14, np.uint8), t=114.0)
+    for thread in source.saving_threads:
+        thread.join()
+
+    saved = fl.load(str(tmp_path / "buffer.h5"))
+    np.testing.assert_array_equal(saved["video"][:, 0, 0], np.arange(4, 14))
+    np.testing.assert_array_equal(saved["times"], 100.0 + np.arange(4, 14))
+    assert source.message_queue.get(timeout=1).startswith("I:Saved the last 10")
+
+    # after saving, the buffer starts again from empty
+    source.save_buffer(str(tmp_path / "buffer_after.h5"), messages)
+    for thread in source.saving_threads:
+        thread.join()
+    saved = fl.load(str(tmp_path / "buffer_after.h5"))
+    np.testing.assert_array_equal(saved["video"][:, 0, 0], [14])
+
+
+def test_buffer_times_match_sent_frames():
+    source = CameraSource("mock")
+    source.ring_buffer = RingBuffer(10)
+    messages = []
+    for i in range(3):
+        source.buffer_and_send(np.full((4, 6), i, np.uint8), messages)
+
+    # the buffer is saved with the time stamps of the frames sent on
+    for i in range(3):
+        timestamp, i_frame, frame = source.frame_queue.get(timeout=1)
+        assert i_frame == i and frame[0, 0] == i
+        assert source.ring_buffer.times[i] == timestamp.timestamp()
+
+
+def test_save_buffer_stimulus_without_camera(caplog):
+    stimulus = SaveCameraBufferStimulus()
+    stimulus.initialise_external(SimpleNamespace(logger=logging.getLogger()))
+    with caplog.at_level(logging.WARNING):
+        stimulus.start()
+    assert stimulus.filename is None
+    assert "without a camera" in caplog.text
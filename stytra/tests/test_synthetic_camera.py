@@ -0,0 +1,156 @@
+from stytra.hardware.video.cameras import camera_class_dict
+from stytra.hardware.video.cameras.synthetic import (
+    SyntheticCamera,
+    decode_frame_index,
+)
+from stytra.experiments.fish_pipelines import FishTrackingPipeline
+from stytra.tracking.fish import records_to_wide
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import time
+
+
+def test_paced_frames_with_index():
+    cam = camera_class_dict["synthetic"](width=320, height=240, framerate=200)
+    cam.open_camera()
+    frame = None
+    indexes = []
+    t_start = time.perf_counter()
+    for _ in range(40):
+        frame = cam.read_into(frame)
+        indexes.append(decode_frame_index(frame))
+    duration = time.perf_counter() - t_start
+
+    # the frames are not produced faster than the framerate, and the
+    # index skips the ones which were late
+    assert indexes[0] == 0
+    assert np.all(np.diff(indexes) >= 1)
+    assert duration >= indexes[-1] / 200
+    assert frame.shape == (240, 320)
+
+    # the pose can be obtained from another camera with the same parameters
+    pose = SyntheticCamera(width=320, height=240, framerate=200).pose(indexes[-1])
+    assert pose.x == cam.last_pose.x
+    np.testing.assert_array_equal(pose.tail_angles, cam.last_pose.tail_angles)
+
+
+def test_replay_tiled():
+    video_file = str(
+        Path(__file__).parent.parent / "examples" / "assets" / "fish_compressed.h5"
+    )
+    cam = SyntheticCamera(video_file=video_file, width=300, framerate=1000)
+    cam.open_camera()
+    frames = [cam.read() for _ in range(3)]
+    assert frames[0].shape == (70, 300)
+    assert [decode_frame_index(f) for f in frames] == list(range(3))
+    assert cam.pose(0) is None
+    np.testing.assert_array_equal(frames[1][1:, :148], cam.video[1][1:])
+    np.testing.assert_array_equal(frames[1][1:, 148:296], cam.video[1][1:])
+
+
+def test_fish_tracking_accuracy():
+    cam = SyntheticCamera(framerate=300)
+    cam.open_camera()
+    pipeline = FishTrackingPipeline()
+    pipeline.setup()
+    errors = []
+    for i_frame in range(150):
+        frame = cam.backgrounds[i_frame % cam.n_backgrounds].copy()
+        pose = cam.pose(i_frame)
+        cam._draw(frame, pose)
+        _, output = pipeline.run(frame)
+        # the background has to be learned in the first frames
+        if i_frame >= 30:
+            errors.append(np.hypot(output.f0_x - pose.x, output.f0_y - pose.y))
+
+    errors = np.array(errors)
+    assert np.mean(np.isnan(errors)) < 0.2
+    assert np.nanmax(errors) < 0.15 * cam.fish_length
+
+
+def test_fish_tracking_roi_search():
+    cam = SyntheticCamera(width=1024, height=1024, framerate=300)
+    cam.open_camera()
+    outputs = dict()
+    for roi_search in [False, True]:
+        pipeline = FishTrackingPipeline()
+        pipeline.setup()
+        pipeline.deserialize_params(
+            {
+                "/source/bgsub/fish_tracking": dict(
+                    roi_search=roi_search, roi_size=160, rescan_every=20
+                )
+            }
+        )
+        # the background is learned without the fish
+        pipeline.run(cam.backgrounds[0].copy())
+        outputs[roi_search] = []
+        for i_frame in range(100):
+            frame = cam.backgrounds[i_frame % cam.n_backgrounds].copy()
+            cam._draw(frame, cam.pose(i_frame))
+            outputs[roi_search].append(pipeline.run(frame)[1])
+
+    # the fish are found in the same way, mostly without scanning the full frame
+    for output_full, output_roi in zip(outputs[False], outputs[True]):
+        np.testing.assert_array_equal(output_full, output_roi[:-1])
+    scan_counts = pipeline.fishtrack.scan_counts
+    assert scan_counts["periodic"] == 4
+    assert scan_counts["roi"] > 90
+    assert sum(o.full_scan for o in outputs[True]) == 100 - scan_counts["roi"]
+
+    # the shares of the frames searched in each way since the last report
+    # are sent as a message
+    fishtrack = pipeline.fishtrack
+    fishtrack.scan_report_interval = 0.0
+    frame = cam.backgrounds[100 % cam.n_backgrounds].copy()
+    cam._draw(frame, cam.pose(100))
+    messages, _ = pipeline.run(frame)
+    assert len([m for m in messages if m.startswith("I:Fish searched")]) == 1
+    fishtrack.scan_counts["roi"] += 3
+    fishtrack.scan_counts["fallback"] += 1
+    assert fishtrack.scan_report() == (
+        "I:Fish searched in windows in 75% of the frames, full frame scanned "
+        "in 0% periodically and in 25% after losing a fish"
+    )
+
+
+def test_fish_tracking_sparse_output():
+    cam = SyntheticCamera(width=480, height=480, framerate=300)
+    cam.open_camera()
+    outputs = dict()
+    records = []
+    for sparse_output in [False, True]:
+        pipeline = FishTrackingPipeline()
+        pipeline.setup()
+        pipeline.deserialize_params(
+            {
+                "/source/bgsub/fish_tracking": dict(
+                    n_fish_max=3, roi_search=False, sparse_output=sparse_output
+                )
+            }
+        )
+        pipeline.run(cam.backgrounds[0].copy())
+        outputs[sparse_output] = []
+        for i_frame in range(50):
+            frame = cam.backgrounds[i_frame % cam.n_backgrounds].copy()
+            cam._draw(frame, cam.pose(i_frame))
+            outputs[sparse_output].append(pipeline.run(frame)[1])
+            if sparse_output:
+                columns, values = pipeline.records()
+                records.append(pd.DataFrame(values, columns=columns).assign(t=i_frame))
+
+    # only the fish found are output, and they convert back to the
+    # columns of all the fish slots
+    assert outputs[True][0]._fields == ("n_fish", "biggest_area")
+    assert [o.n_fish for o in outputs[True]] == [
+        sum(not np.isnan(getattr(o, "f{}_x".format(i))) for i in range(3))
+        for o in outputs[False]
+    ]
+    records = pd.concat(records)
+    assert set(records.track_id) == {0}
+    wide = records_to_wide(records, n_fish_max=3, times=np.arange(50))
+    assert list(wide.columns) == ["t"] + list(outputs[False][0]._fields[:-1])
+    np.testing.assert_array_equal(
+        wide.values[:, 1:], np.array([o[:-1] for o in outputs[False]])
+    )
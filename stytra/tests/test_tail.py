@@ -0,0 +1,89 @@
+from stytra.experiments.fish_pipelines import TailTrackingPipeline
+from stytra.hardware.video.cameras.synthetic import SyntheticCamera
+from stytra.tracking.tail import (
+    _trace_tail_centroids,
+    window_offsets,
+    find_fish_midline,
+)
+import numpy as np
+
+
+def test_segment_window_centered():
+    # at the edge of the image, the window is still centered on the
+    # continuation of the previous segment, at x=1
+    for x_pixel, found in [(4, True), (5, False)]:
+        im = np.zeros((20, 20), dtype=np.uint8)
+        im[8, x_pixel] = 100
+
+        points, masses, n_found = _trace_tail_centroids(
+            im, 3.0, 8.0, -2.0, 0.0, 2.0, 1, window_offsets(7)
+        )
+        if found:
+            np.testing.assert_allclose(points, [[3.0, 8.0], [5.0, 8.0]])
+            assert masses[0] == 100
+            assert n_found == 1
+        else:
+            assert n_found == 0
+            assert np.isnan(points[1, 0])
+
+
+def test_fish_midline():
+    # a horizontal fish, traced to the left from x=30
+    im = np.zeros((20, 40), dtype=np.uint8)
+    im[9:12, 5:31] = 100
+    points = find_fish_midline(im, 30.0, 10.0, np.pi, 3, 2.0, 8)
+    assert len(points) == 8
+    np.testing.assert_allclose(
+        [p[:2] for p in points], [(30.0 - 2 * i, 10.0) for i in range(8)]
+    )
+    assert points[0][2] == 0 and all(p[2] > 0 for p in points[1:])
+
+    # the midline is invalid if it cannot be completely traced
+    im[:, :29] = 0
+    assert find_fish_midline(im, 24.0, 10.0, np.pi, 3, 2.0, 8) == [(-1.0, -1.0, 0.0)]
+
+
+def test_tail_tracking_accuracy():
+    cam = SyntheticCamera(framerate=300, head_restrained=True)
+    cam.open_camera()
+    pipeline = TailTrackingPipeline()
+    pipeline.setup()
+
+    # the start of the tail and three quarters of its length, in the frames
+    # resized by half by the Prefilter, relative to their height
+    height = cam.height / 2
+    tail_length = cam.fish_length * 0.8 * 0.75 / 2
+    pipeline.deserialize_params(
+        {
+            "/source/filtering/tail_tracking": dict(
+                tail_start=(
+                    ((cam.height / 2 - 0.5) / 2 + 0.5) / height,
+                    ((cam.width * 0.3 - 0.5) / 2 + 0.5) / height,
+                ),
+                tail_length=(0.0, -tail_length / height),
+                n_segments=8,
+                n_output_segments=9,
+                window_size=7,
+                tail_filter_width=0.0,
+                time_filter_weight=0.0,
+                reset_zero=False,
+            )
+        }
+    )
+
+    errors = []
+    for i_frame in range(120):
+        frame = cam.backgrounds[i_frame % cam.n_backgrounds].copy()
+        pose = cam.pose(i_frame)
+        cam._draw(frame, pose)
+        _, output = pipeline.run(frame)
+
+        # the angles of the tracked segments are measured from the y axis,
+        # and compared with the ground truth at the same place along the tail
+        along = (np.linspace(0, 7, 9) + 0.5) / 8 * 0.75
+        true_angles = np.pi / 2 - pose.tail_angles[(along * cam.n_segments).astype(int)]
+        errors.append(
+            np.abs(np.angle(np.exp(1j * (np.array(output[1:]) - true_angles))))
+        )
+
+    assert np.mean(errors) < 0.15
@@ -0,0 +1,94 @@
+from stytra.tracking.tracking_process import TrackingProcess
+from stytra.tracking.pipelines import Pipeline, ImageToDataNode, NodeOutput
+from stytra.collectors.namedtuplequeue import NamedTupleQueue
+from stytra.hardware.video.frame_pool import FramePool
+from multiprocessing import Event, Queue
+from collections import namedtuple
+from queue import Empty
+from lightparam import Param
+import numpy as np
+import time
+
+
+class SlowMeanNode(ImageToDataNode):
+    def __init__(self, *args, **kwargs):
+        super().__init__("slow_mean", *args, **kwargs)
+        self._output_type = namedtuple("t", "mean")
+
+    def _process(self, im, delay: Param(0.002, (0.0, 1.0))):
+        # variable processing time, so the workers finish out of order
+        time.sleep(np.random.uniform(0, delay))
+        return NodeOutput([], self._output_type(float(im.mean())))
+
+
+class SlowMeanPipeline(Pipeline):
+    def __init__(self):
+        super().__init__()
+        self.mean = SlowMeanNode(parent=self.root)
+
+
+class StatefulMeanNode(SlowMeanNode):
+    @property
+    def stateful(self):
+        return True
+
+
+class StatefulMeanPipeline(Pipeline):
+    def __init__(self):
+        super().__init__()
+        self.mean = StatefulMeanNode(parent=self.root)
+
+
+def check_parallel_tracking_order(frame_queue, pipeline=SlowMeanPipeline):
+    n_frames = 60
+    finished = Event()
+    output_queue = NamedTupleQueue()
+    process = TrackingProcess(
+        frame_queue,
+        finished_signal=finished,
+        pipeline=pipeline,
+        processing_parameter_queue=Queue(),
+        output_queue=output_queue,
+        n_workers=3,
+        max_mb_queue=10,
+    )
+    process.start()
+
+    for i in range(n_frames):
+        frame_queue.put(np.full((16, 16), i, dtype=np.uint8))
+        time.sleep(0.002)
+
+    outputs = []
+    t_start = time.time()
+    while len(outputs) < n_frames and time.time() - t_start < 30:
+        try:
+            outputs.append(output_queue.get(timeout=0.1)[1].mean)
+        except Empty:
+            pass
+
+    finished.set()
+    process.join()
+    assert outputs == list(range(n_frames))
+
+    messages = []
+    while True:
+        try:
+            messages.append(process.message_queue.get(timeout=0.1))
+        except Empty:
+            break
+    return messages
+
+
+def test_parallel_tracking_order():
+    messages = check_parallel_tracking_order(
+        FramePool(max_mbytes=1).channel(indexed=True)
+    )
+    assert not any(msg.startswith("W:Stateful") for msg in messages)
+
+
+def test_parallel_tracking_stateful():
+    # all the frames go to one worker, which is reported once
+    messages = check_parallel_tracking_order(
+        FramePool(max_mbytes=1).channel(indexed=True), StatefulMeanPipeline
+    )
+    assert len([msg for msg in messages if msg.startswith("W:Stateful")]) == 1
@@ -0,0 +1,105 @@
+from stytra.hardware.video.read import H5VideoReader, AvVideoReader
+from pathlib import Path
+import flammkuchen as fl
+import cv2
+import numpy as np
+import pytest
+
+VIDEO_PATH = Path(__file__).parents[1] / "examples" / "assets" / "fish_compressed.h5"
+
+
+def read_n(reader, n):
+    return [reader.get(timeout=5) for _ in range(n)]
+
+
+def test_h5_reader_looping():
+    frames = fl.load(str(VIDEO_PATH), "/video")
+    n_frames = frames.shape[0]
+    reader = H5VideoReader(VIDEO_PATH, start=50, n_prefetch=16)
+    reader.start()
+    read = read_n(reader, 2 * (n_frames - 50) + 10)
+    reader.stop()
+    expected = np.concatenate([frames[50:], frames[50:], frames[50:60]])
+    np.testing.assert_array_equal(np.stack(read), expected)
+
+
+def test_h5_reader_end():
+    frames = fl.load(str(VIDEO_PATH), "/video")
+    reader = H5VideoReader(VIDEO_PATH, start=200, loop=False)
+    reader.start()
+    read = read_n(reader, 21)
+    assert read[-1] is None
+    np.testing.assert_array_equal(np.stack(read[:-1]), frames[200:])
+    reader.stop()
+
+
+def test_av_reader(tmp_path):
+    av = pytest.importorskip("av")
+    path = tmp_path / "video.mp4"
+    container = av.open(str(path), "w")
+    stream = container.add_stream("mpeg4", rate=50)
+    stream.width, stream.height, stream.pix_fmt = 64, 48, "yuv420p"
+    for i in range(20):
+        im = np.full((48, 64), 10 * i, dtype=np.uint8)
+        im[10:20, 3 * i : 3 * i + 10] = 240
+        for packet in stream.encode(av.VideoFrame.from_ndarray(im, format="gray")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+    container = av.open(str(path))
+    expected = [
+        f.to_ndarray(format="rgb24")[:, :, 0] for f in container.decode(video=0)
+    ]
+    container.close()
+
+    reader = AvVideoReader(path, start=5)
+    reader.start()
+    read = read_n(reader, 2 * (len(expected) - 5))
+    reader.stop()
+    assert read[0].shape == (48, 64) and read[0].dtype == np.uint8
+    np.testing.assert_allclose(
+        np.stack(read), np.stack(expected[5:] * 2).astype(np.uint8), atol=4
+    )
+
+    # without looping, the reader stops at the end of the video
+    reader = AvVideoReader(path, loop=False)
+    reader.start()
+    read = read_n(reader, len(expected) + 1)
+    reader.stop()
+    assert read[-1] is None
+    np.testing.assert_array_equal(np.stack(read[:-1]), np.stack(expected))
+
+
+def test_av_reader_channels(tmp_path):
+    av = pytest.importorskip("av")
+    path = tmp_path / "video.mp4"
+    container = av.open(str(path), "w")
+    stream = container.add_stream("mpeg4", rate=50)
+    stream.width, stream.height, stream.pix_fmt = 64, 48, "yuv420p"
+    for i in range(10):
+        im = np.zeros((48, 64, 3), dtype=np.uint8)
+        im[:, :, 0] = 20 * i
+        im[10:20, 3 * i : 3 * i + 10, 2] = 240
+        for packet in stream.encode(av.VideoFrame.from_ndarray(im, format="rgb24")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+    container = av.open(str(path))
+    rgb = [f.to_ndarray(format="rgb24") for f in container.decode(video=0)]
+    container.close()
+
+    # the red channel of colour videos by default, or the luma
+    read = dict()
+    for channel in [0, None]:
+        reader = AvVideoReader(path, loop=False, channel=channel)
+        reader.start()
+        read[channel] = np.stack(read_n(reader, len(rgb))).astype(float)
+        reader.stop()
+    np.testing.assert_array_equal(read[0], np.stack([f[:, :, 0] for f in rgb]))
+    gray = np.stack([cv2.cvtColor(f, cv2.COLOR_RGB2GRAY) for f in rgb])
+    assert np.mean(np.abs(read[None] - gray)) < 1
+    assert np.mean(np.abs(read[0] - gray)) > 10
@@ -0,0 +1,204 @@
+from stytra.hardware.video.write import (
+    H5VideoWriter,
+    LosslessVideoWriter,
+    BoutTriggeredVideoWriter,
+)
+from stytra.hardware.video.read import H5VideoReader, AvVideoReader
+from multiprocessing import Event
+from queue import Queue
+from datetime import datetime, timedelta
+import flammkuchen as fl
+import numpy as np
+import pandas as pd
+import tables
+import threading
+import time
+import pytest
+
+
+def test_h5_writer_streams_frames(tmp_path):
+    writer = H5VideoWriter(
+        Queue(), Event(), Event(), Event(), log_format="csv", batch_frames=8
+    )
+    filename_base = str(tmp_path / "rec_")
+    writer.filename_queue.put(filename_base)
+
+    frames = np.random.randint(0, 255, (50, 30, 40), dtype=np.uint8)
+    t0 = datetime.now()
+    times = [t0 + timedelta(seconds=i / 100) for i in range(len(frames))]
+
+    writer._configure(frames.shape[1:])
+    for frame, t in zip(frames, times):
+        writer._ingest_frame(frame)
+        writer._ingest_time(t)
+        # only the current batch is kept in memory
+        assert writer._frame_batch.shape[0] == 8
+    # full batches are already in the file
+    assert writer._video.shape[0] == 48
+    writer._complete(filename_base)
+    writer._reset()
+
+    with tables.open_file(filename_base + "video.hdf5", "r") as f:
+        assert f.root.video.filters.complevel > 0
+        assert f.root.video.chunkshape[1:] == frames.shape[1:]
+    saved = fl.load(filename_base + "video.hdf5")
+    np.testing.assert_array_equal(saved["video"], frames)
+    np.testing.assert_allclose(saved["times"], [t.timestamp() for t in times])
+
+    reader = H5VideoReader(filename_base + "video.hdf5", loop=False)
+    reader.start()
+    read = [reader.get(timeout=5) for _ in range(len(frames) + 1)]
+    reader.stop()
+    assert read[-1] is None
+    np.testing.assert_array_equal(np.stack(read[:-1]), frames)
+
+    saved_times = pd.read_csv(filename_base + "video_times.csv", sep=";")
+    assert len(saved_times) == len(frames)
+
+
+def test_lossless_writer(tmp_path):
+    pytest.importorskip("av")
+    writer = LosslessVideoWriter(
+        Queue(), Event(), Event(), Event(), log_format="csv", n_threads=2
+    )
+    filename_base = str(tmp_path / "rec_")
+    writer.filename_queue.put(filename_base)
+
+    # smooth frames with some noise, which compress but not trivially
+    frames = (
+        np.random.randint(0, 20, (40, 48, 64)) + np.arange(64)[None, None, :] * 3
+    ).astype(np.uint8)
+    t0 = datetime.now()
+
+    writer._configure(frames.shape[1:])
+    for i, frame in enumerate(frames):
+        writer._ingest_frame(frame)
+        writer._ingest_time(t0 + timedelta(seconds=i / 100))
+    writer._complete(filename_base)
+    writer._reset()
+
+    assert writer._n_encoded == len(frames)
+    assert writer._n_dropped == 0
+    assert writer.compression_ratio > 1
+    assert writer.message_queue.get(timeout=1).startswith("I:Recorded 40 frames")
+
+    reader = AvVideoReader(filename_base + "video.mkv", loop=False)
+    reader.start()
+    read = [reader.get(timeout=5) for _ in range(len(frames) + 1)]
+    reader.stop()
+    assert read[-1] is None
+    np.testing.assert_array_equal(np.stack(read[:-1]), frames)
+
+
+def test_lossless_writer_drops_frames(tmp_path):
+    pytest.importorskip("av")
+    writer = LosslessVideoWriter(
+        Queue(), Event(), Event(), Event(), log_format="csv", max_pending_frames=4
+    )
+    filename_base = str(tmp_path / "rec_")
+    writer.filename_queue.put(filename_base)
+
+    # the encoder is blocked, so that the frames pile up
+    release = threading.Event()
+    encode = writer._encode_frames
+
+    def blocked_encode():
+        release.wait()
+        encode()
+
+    writer._encode_frames = blocked_encode
+    writer._configure((48, 64))
+    t0 = datetime.now()
+    for i in range(10):
+        writer._ingest_frame(np.full((48, 64), i, np.uint8))
+        writer._ingest_time(t0 + timedelta(seconds=i / 100))
+    writer._report_stats()
+    assert writer.message_queue.get(timeout=1) == "W:Dropped 6 frames from recording"
+
+    release.set()
+    writer._complete(filename_base)
+    writer._reset()
+    assert writer._n_encoded == 4
+    assert len(pd.read_csv(filename_base + "video_times.csv", sep=";")) == 4
+
+
+def record_bouts(writer, filename_base, t0, fps, bouts, delay):
+    writer.filename_queue.put(filename_base)
+    triggers = sorted(
+        [(start + delay, "start", start) for start, _ in bouts]
+        + [(end + delay, "stop", end) for _, end in bouts]
+    )
+
+    writer._configure((8, 8))
+    put_trigger(writer, ("t0", t0))
+    for i in range(10 * fps):
+        t = t0 + i / fps
+        while triggers and triggers[0][0] <= t - t0:
+            _, event, t_event = triggers.pop(0)
+            put_trigger(writer, (event, t0 + t_event))
+        frame = np.zeros((8, 8), np.uint8)
+        frame[0, :2] = i % 256, i // 256
+        writer._ingest_frame(frame)
+        writer._ingest_time(t)
+        # only the frames which might be recorded are kept
+        assert len(writer._buffer) <= (0.5 + 1.0) * fps + 1
+    writer._complete(filename_base)
+    writer._reset()
+
+
+def put_trigger(writer, trigger):
+    # wait until the trigger can be read from the process queue
+    writer.trigger_queue.put(trigger)
+    while writer.trigger_queue.empty():
+        time.sleep(0.001)
+
+
+def test_bout_triggered_writer(tmp_path):
+    writer = BoutTriggeredVideoWriter(
+        Queue(), Event(), Event(), Event(), log_format="csv", pad_before=0.5
+    )
+    filename_base = str(tmp_path / "rec_")
+    t0 = 1000.0
+    fps = 100
+    # the bouts are detected 0.2 s after they start and end
+    record_bouts(
+        writer, filename_base, t0, fps, [(2.005, 2.305), (6.005, 6.205)], delay=0.2
+    )
+
+    saved = fl.load(filename_base + "video.hdf5")
+    i_frames = saved["video"][:, 0, 0] + 256 * saved["video"][:, 0, 1].astype(int)
+    expected = np.concatenate([np.arange(151, 281), np.arange(551, 671)])
+    np.testing.assert_array_equal(i_frames, expected)
+    np.testing.assert_allclose(saved["times"], t0 + expected / fps)
+
+    segments = pd.read_csv(filename_base + "video_segments.csv", sep=";")
+    np.testing.assert_array_equal(segments.i_start, [0, 130])
+    np.testing.assert_array_equal(segments.i_end, [130, 250])
+    np.testing.assert_allclose(segments.t_protocol_start, [1.51, 5.51])
+    np.testing.assert_allclose(segments.t_protocol_end, [2.80, 6.70])
+
+
+def test_bout_triggered_writer_buffer_cap(tmp_path):
+    # the pre-buffer is too short for the delay of the bout detection
+    writer = BoutTriggeredVideoWriter(
+        Queue(),
+        Event(),
+        Event(),
+        Event(),
+        log_format="csv",
+        pad_before=0.5,
+        max_buffer_frames=50,
+    )
+    filename_base = str(tmp_path / "rec_")
+    record_bouts(writer, filename_base, 1000.0, 100, [(2.005, 2.305)], delay=0.8)
+    assert writer.message_queue.get(timeout=1) == (
+        "W:Bout pre-buffer of 50 frames shorter than 1.50 s"
+    )
+    assert writer.message_queue.get(timeout=1).startswith(
+        "W:Dropped 871 frames from the bout pre-buffer"
+    )
+
+    # the frames of the padding and the start of the bout were lost
+    saved = fl.load(filename_base + "video.hdf5")
+    i_frames = saved["video"][:, 0, 0] + 256 * saved["video"][:, 0, 1].astype(int)
+    assert i_frames[0] == 232
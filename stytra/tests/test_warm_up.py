@@ -0,0 +1,73 @@
+from stytra.experiments.fish_pipelines import TailTrackingPipeline, FishTrackingPipeline
+from stytra.hardware.video.cameras.synthetic import SyntheticCamera
+from stytra.tracking import fish, tail, simple_kalman
+from stytra.tracking.online_bouts import (
+    warm_up_bout_detection,
+    find_bouts_online,
+    find_bout_edges_online,
+    BoutState,
+)
+from stytra.utilities import reduce_to_pi
+import numpy as np
+
+
+def signatures(*kernels):
+    return [list(kernel.signatures) for kernel in kernels]
+
+
+def test_pipelines_compiled_by_warm_up():
+    kernels = (
+        fish.fish_start,
+        fish._fish_direction_n,
+        fish.points_to_angles,
+        fish._minimal_angle_dif,
+        simple_kalman.predict_batch,
+        simple_kalman.update_batch,
+        tail._trace_tail_centroids,
+    )
+    for pipeline_cls in [TailTrackingPipeline, FishTrackingPipeline]:
+        pipeline = pipeline_cls()
+        pipeline.setup()
+        assert pipeline.warm_up() >= 0
+        compiled = signatures(*kernels)
+
+        # the frames of a camera do not require compiling again
+        cam = SyntheticCamera(framerate=1000, head_restrained=True, noise=0)
+        cam.open_camera()
+        frame = None
+        for _ in range(40):
+            frame = cam.read_into(frame)
+            _, output = pipeline.run(frame)
+        assert signatures(*kernels) == compiled
+
+
+def test_bout_detection_compiled_by_warm_up():
+    warm_up_bout_detection()
+    kernels = (find_bouts_online, find_bout_edges_online, reduce_to_pi)
+    compiled = signatures(*kernels)
+
+    # used with the types of the GUI bout plot
+    coords = np.random.uniform(0, 10, (30, 6))[:, [0, 2, 4]]
+    velocities = np.sum(np.diff(coords[:, :2], axis=0) ** 2, axis=1)
+    params = dict(
+        threshold=0.2, n_without_crossing=5, pad_before=5, pad_after=5, min_bout_len=1
+    )
+    for coords_layout in [coords, np.concatenate([coords, coords])]:
+        find_bouts_online(
+            velocities,
+            coords_layout,
+            BoutState(0, 0.0, 0, 0, 0),
+            [coords_layout[0, :]],
+            0,
+            **params
+        )
+    find_bout_edges_online(
+        velocities,
+        BoutState(0, 0.0, 0, 0, 0),
+        threshold=0.2,
+        n_without_crossing=5,
+        min_bout_len=1,
+    )
+    # on the bouts collected as a list of coordinates
+    reduce_to_pi(np.array(list(coords))[:, 2])
+    assert signatures(*kernels) == compiled
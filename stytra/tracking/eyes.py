@@ -116,7 +116,7 @@ def _pad(im, padding=0, val=0):
     -------
 
     """
-    padded = np.lib.pad(
+    padded = np.pad(
         im,
         ((padding, padding), (padding, padding)),
         mode="constant",
@@ -1,36 +1,81 @@
 import cv2
 import numpy as np
-from numba import jit, int64, float64
-
-try:
-    from numba.experimental import jitclass
-except ModuleNotFoundError:
-    from numba import jitclass
-
+import pandas as pd
+from numba import jit
+from scipy.optimize import linear_sum_assignment
 
 from stytra.tracking.tail import find_fish_midline
 from stytra.tracking.preprocessing import BackgroundSubtractor
 
 from itertools import chain
+from time import perf_counter
 
 from lightparam import Param
-from stytra.tracking.simple_kalman import predict_inplace, update_inplace
+from stytra.tracking.simple_kalman import predict_batch, update_batch
 from stytra.tracking.pipelines import ImageToDataNode, NodeOutput
 from collections import namedtuple
 
 
+def _state_names(n_segments):
+    return ["x", "vx", "y", "vy", "theta", "vtheta"] + [
+        "theta_{:02d}".format(i) for i in range(n_segments)
+    ]
+
+
 def _fish_column_names(i_fish, n_segments):
-    return [
-        "f{:d}_x".format(i_fish),
-        "f{:d}_vx".format(i_fish),
-        "f{:d}_y".format(i_fish),
-        "f{:d}_vy".format(i_fish),
-        "f{:d}_theta".format(i_fish),
-        "f{:d}_vtheta".format(i_fish),
-    ] + ["f{:d}_theta_{:02d}".format(i_fish, i) for i in range(n_segments)]
+    return ["f{:d}_{}".format(i_fish, name) for name in _state_names(n_segments)]
+
+
+def records_to_wide(records, n_fish_max=None, times=None, index="t"):
+    """Converts the long-format records of the tracked fish, saved with the
+    sparse output of :class:`FishTrackingMethod`, to the wide layout of the
+    default output, with the columns of every fish slot in each frame
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        records with the t (or index), track_id and i_fish columns and the
+        state of the fish
+    n_fish_max : int
+        number of fish slots, by default the highest slot in the records
+    times : array-like
+        times of all the tracked frames (e.g. the t column of the behavior
+        log), by default only the frames with at least one fish are included
+    index : str
+        column of the time points of the records, e.g. frame for the records
+        saved by the batch tracking
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per frame, with the index column and the f{i}_... columns of
+        each fish, NaN for the slots without a fish
+
+    """
+    state_names = [c for c in records.columns if c not in (index, "track_id", "i_fish")]
+    if n_fish_max is None:
+        n_fish_max = int(records["i_fish"].max()) + 1 if len(records) > 0 else 0
+
+    wide = records.assign(i_fish=records["i_fish"].astype(int)).pivot(
+        index=index, columns="i_fish", values=state_names
+    )
+    wide = wide.reindex(
+        columns=[(name, i_fish) for i_fish in range(n_fish_max) for name in state_names]
+    )
+    wide.columns = [
+        "f{:d}_{}".format(i_fish, name)
+        for i_fish in range(n_fish_max)
+        for name in state_names
+    ]
+    if times is not None:
+        wide = wide.reindex(pd.Index(times, name=index))
+    return wide.reset_index()
 
 
 class FishTrackingMethod(ImageToDataNode):
+    # time between the reports of the ways the fish were searched, in s
+    scan_report_interval = 1.0
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, name="fish_tracking", **kwargs)
         self.monitored_headers = ["biggest_area", "f0_theta"]
@@ -44,16 +89,50 @@ class FishTrackingMethod(ImageToDataNode):
         self.dilation_kernel = np.ones((3, 3), dtype=np.uint8)
         self.fishes = None
 
+        # frames since the full frame was last scanned, and number of frames
+        # in which the fish were searched only around their predicted
+        # positions or the full frame was scanned, periodically or because
+        # a fish was not found where predicted
+        self.i_since_scan = 0
+        self.scan_counts = dict(roi=0, periodic=0, fallback=0)
+
+        # the shares of the ways of searching are reported in a message
+        # every scan_report_interval seconds
+        self._reported_counts = dict(self.scan_counts)
+        self._t_scan_report = perf_counter()
+
+        # with the sparse output, the tracked fish are output as records
+        self.records = None
+        self.record_columns = None
+
+    @property
+    def stateful(self):
+        # the fish are tracked across frames with the Kalman filter
+        return True
+
     def changed(self, vals):
         if any(
-            p in vals.keys() for p in ["n_segments", "n_fish_max", "bg_downsample"]
+            p in vals.keys()
+            for p in [
+                "n_segments",
+                "n_fish_max",
+                "bg_downsample",
+                "roi_search",
+                "sparse_output",
+            ]
         ) or vals.get("reset", False):
             self.reset()
 
     def reset(self):
-        self._output_type = namedtuple(
-            "t",
-            list(
+        if self._params.sparse_output:
+            # only the number of fish is in the output, their states are
+            # in the records, one for each fish found
+            fish_columns = ["n_fish"]
+            self.record_columns = ("track_id", "i_fish") + tuple(
+                _state_names(self._params.n_segments - 1)
+            )
+        else:
+            fish_columns = list(
                 chain.from_iterable(
                     [
                         _fish_column_names(i_fish, self._params.n_segments - 1)
@@ -61,9 +140,18 @@ class FishTrackingMethod(ImageToDataNode):
                     ]
                 )
             )
-            + ["biggest_area"],
+            self.record_columns = None
+        self.records = None
+        self._output_type = namedtuple(
+            "t",
+            fish_columns
+            + ["biggest_area"]
+            + (["full_scan"] if self._params.roi_search else []),
         )
         self._output_type_changed = True
+        self.i_since_scan = 0
+        self.scan_counts = dict(roi=0, periodic=0, fallback=0)
+        self._reported_counts = dict(self.scan_counts)
 
         # used for booking a spot for one of the potentially tracked fish
         self.fishes = Fishes(
@@ -75,6 +163,32 @@ class FishTrackingMethod(ImageToDataNode):
             persist_fish_for=self._params.persist_fish_for,
         )
 
+    def warm_up(self):
+        # a blob in a background-subtracted image, of the same type as
+        # the output of the BackgroundSubtractor
+        bg = np.zeros((32, 32), dtype=np.uint8)
+        bg[10:22, 14:18] = 100
+        bg[12:15, 14:18] = 200
+        fish_coords = fish_start(bg, 35)
+        theta = _fish_direction_n(bg, fish_coords, 6)
+        points = find_fish_midline(bg, *fish_coords, theta, 3, 2.0, 5)
+        angles = points_to_angles(points)
+
+        # the states of a single fish are contiguous, unlike those of several
+        new_fish = np.concatenate([np.array(points[0][:2]), angles])
+        for n_fish_max in [1, 2]:
+            fishes = Fishes(
+                n_fish_max,
+                pos_std=1.0,
+                angle_std=np.pi / 10,
+                n_segments=len(angles) - 1,
+                pred_coef=0.1,
+                persist_fish_for=2,
+            )
+            fishes.add_fish(new_fish)
+            fishes.predict()
+            fishes.update(new_fish[None, :])
+
     def _process(
         self,
         bg,
@@ -98,6 +212,38 @@ class FishTrackingMethod(ImageToDataNode):
         border_margin: Param(5, (0, 100)),
         tail_length: Param(60.0, (1.0, 200.0)),
         tail_track_window: Param(3, (3, 70)),
+        max_displacement: Param(
+            15.0,
+            (1.0, 500.0),
+            desc="Maximal distance in pixels between a detection and the "
+            "predicted position of a fish for them to be matched",
+        ),
+        max_turn: Param(
+            np.pi / 2,
+            (0.01, np.pi),
+            desc="Maximal difference in heading between a detection and the "
+            "predicted heading of a fish for them to be matched",
+        ),
+        roi_search: Param(
+            False,
+            desc="Search the fish only around their predicted positions, "
+            "scanning the full frame periodically or when a fish is lost",
+        ),
+        roi_size: Param(
+            200,
+            (20, 2000),
+            desc="Side of the windows searched around the predicted positions",
+        ),
+        rescan_every: Param(
+            50,
+            (1, 10000),
+            desc="How many frames until the full frame is scanned for new fish",
+        ),
+        sparse_output: Param(
+            False,
+            desc="Output only the fish which are tracked, as records with "
+            "their track ID, instead of columns for all the n_fish_max fish",
+        ),
     ):
 
         # update the previously-detected fish using the Kalman filter
@@ -106,10 +252,134 @@ class FishTrackingMethod(ImageToDataNode):
         else:
             self.fishes.predict()
 
-        area_scale = bg_downsample * bg_downsample
-        border_margin = border_margin // bg_downsample
+        search_params = (
+            bg_downsample,
+            bg_dif_threshold,
+            threshold_eyes,
+            fish_area,
+            border_margin,
+            tail_length,
+            tail_track_window,
+            n_segments,
+        )
+
+        full_scan = True
+        if roi_search:
+            self.i_since_scan += 1
+            tracked = np.flatnonzero(~np.isnan(self.fishes.coords[:, 0]))
+            if self.i_since_scan >= rescan_every:
+                self.scan_counts["periodic"] += 1
+            elif len(tracked) == 0:
+                self.scan_counts["fallback"] += 1
+            else:
+                positions = self.fishes.coords[tracked][:, [0, 2]]
+                detections, candidates, messages, max_area = [], [], [], 0
+                for window in _search_windows(positions, roi_size, bg.shape):
+                    win_results = self._find_fish(bg, window, *search_params)
+                    detections.extend(win_results[0])
+                    candidates.extend(win_results[1])
+                    messages.extend(win_results[2])
+                    max_area = max(max_area, win_results[3])
+
+                # if no fish-sized region is in the window of one of the fish,
+                # it might have left it, and the full frame is searched again
+                found = np.zeros(len(positions), dtype=bool)
+                for centroid in candidates:
+                    found |= np.all(np.abs(positions - centroid) < roi_size // 2, 1)
+                if np.all(found):
+                    full_scan = False
+                    self.scan_counts["roi"] += 1
+                else:
+                    self.scan_counts["fallback"] += 1
+
+        if full_scan:
+            self.i_since_scan = 0
+            detections, _, messages, max_area = self._find_fish(
+                bg, (0, 0) + bg.shape, *search_params
+            )
+
+        if roi_search and (
+            perf_counter() - self._t_scan_report >= self.scan_report_interval
+        ):
+            messages.append(self.scan_report())
+
+        if len(detections) > 0:
+            # match the detections with the fish detected previously,
+            # the remaining ones are new fish
+            i_assigned = self.fishes.update(
+                np.array(detections), max_displacement, max_turn
+            )
+            for fish_coords, i_fish in zip(detections, i_assigned):
+                if i_fish >= 0:
+                    messages.append("I:Updated previous fish")
+                elif self.fishes.add_fish(fish_coords):
+                    messages.append("I:Added new fish")
+                else:
+                    messages.append("E:More fish than n_fish max")
+        else:
+            messages.append(
+                "W:No object of right area, between {:.0f} and {:.0f}".format(
+                    *fish_area
+                )
+            )
 
-        # downsample background
+        # if a debugging image is to be shown, set it
+        if self.set_diagnostic == "background difference":
+            self.diagnostic_image = bg
+        elif self.set_diagnostic == "thresholded background difference":
+            self.diagnostic_image = self._threshold(
+                bg, bg_downsample, bg_dif_threshold
+            )[1]
+        elif self.set_diagnostic == "fish detection":
+            bg_small, bg_thresh = self._threshold(bg, bg_downsample, bg_dif_threshold)
+            fishdet = bg_small.copy()
+            fishdet[bg_thresh == 0] = 0
+            self.diagnostic_image = fishdet
+        elif self.set_diagnostic == "thresholded for eye and swim bladder":
+            self.diagnostic_image = np.maximum(bg, threshold_eyes) - threshold_eyes
+
+        if self._output_type is None:
+            self.reset_state()
+        extra_outputs = (float(full_scan),) if roi_search else ()
+        if sparse_output:
+            alive = np.flatnonzero(~np.isnan(self.fishes.coords[:, 0]))
+            self.records = np.column_stack(
+                [self.fishes.track_ids[alive], alive, self.fishes.coords[alive]]
+            )
+            return NodeOutput(
+                messages,
+                self._output_type(len(alive), max_area * 1.0, *extra_outputs),
+            )
+        return NodeOutput(
+            messages,
+            self._output_type(
+                *self.fishes.coords.flatten(), max_area * 1.0, *extra_outputs
+            ),
+        )
+
+    def scan_report(self):
+        """Message with the shares of the frames in which the fish were
+        searched only in windows around their predicted positions, or the
+        full frame was scanned, since the previous report"""
+        counts = {k: n - self._reported_counts[k] for k, n in self.scan_counts.items()}
+        self._reported_counts = dict(self.scan_counts)
+        self._t_scan_report = perf_counter()
+        percent = {k: n * 100 / max(sum(counts.values()), 1) for k, n in counts.items()}
+        return (
+            "I:Fish searched in windows in {roi:.0f}% of the frames, full frame "
+            "scanned in {periodic:.0f}% periodically and in {fallback:.0f}% "
+            "after losing a fish".format(**percent)
+        )
+
+    def _threshold(self, bg, bg_downsample, bg_dif_threshold):
+        """Downsamples the background difference image and thresholds it
+
+        Returns
+        -------
+        tuple of np.ndarray
+            downsampled and thresholded images
+
+        """
         if bg_downsample > 1:
             bg_small = cv2.resize(bg, None, fx=1 / bg_downsample, fy=1 / bg_downsample)
         else:
@@ -118,6 +388,50 @@ class FishTrackingMethod(ImageToDataNode):
         bg_thresh = cv2.dilate(
             (bg_small > bg_dif_threshold).view(dtype=np.uint8), self.dilation_kernel
         )
+        return bg_small, bg_thresh
+
+    def _find_fish(
+        self,
+        bg,
+        window,
+        bg_downsample,
+        bg_dif_threshold,
+        threshold_eyes,
+        fish_area,
+        border_margin,
+        tail_length,
+        tail_track_window,
+        n_segments,
+    ):
+        """Finds the fish in a window of the background difference image
+
+        Parameters
+        ----------
+        bg : np.ndarray
+            background difference image
+        window : tuple
+            top, left, bottom and right edges of the window, the fish
+            have to be inside it, with a border margin
+
+        Returns
+        -------
+        detections : list of np.ndarray
+            position, heading and tail angles of each fish found
+        candidates : list of np.ndarray
+            centroids of the fish-sized regions inside the window, also
+            those in which no fish could be found
+        messages : list of str
+        max_area : float
+            area of the biggest region different from the background
+
+        """
+        top, left, bottom, right = window
+        area_scale = bg_downsample * bg_downsample
+        border_margin = border_margin // bg_downsample
+
+        _, bg_thresh = self._threshold(
+            bg[top:bottom, left:right], bg_downsample, bg_dif_threshold
+        )
 
         # find regions where there is a difference with the background
         n_comps, labels, stats, centroids = cv2.connectedComponentsWithStats(bg_thresh)
@@ -131,8 +445,9 @@ class FishTrackingMethod(ImageToDataNode):
         # to find fish
 
         messages = []
+        detections = []
+        candidates = []
 
-        nofish = True
         for row, centroid in zip(stats, centroids):
             # check if the contour is fish-sized and central enough
             if not fish_area[0] < row[cv2.CC_STAT_AREA] * area_scale < fish_area[1]:
@@ -148,16 +463,20 @@ class FishTrackingMethod(ImageToDataNode):
                     cv2.CC_STAT_WIDTH,
                 ]
             )
+            ftop += top
+            fleft += left
 
             if not (
-                (fleft - border_margin >= 0)
-                and (fleft + fwidth + border_margin < bg.shape[1])
-                and (ftop - border_margin >= 0)
-                and (ftop + fheight + border_margin < bg.shape[0])
+                (fleft - border_margin >= left)
+                and (fleft + fwidth + border_margin < right)
+                and (ftop - border_margin >= top)
+                and (ftop + fheight + border_margin < bottom)
             ):
                 messages.append("W:An object of right area found outside margins")
                 continue
 
+            candidates.append(centroid * bg_downsample + np.array([left, top]))
+
             # how much is this region shifted from the upper left corner of the image
             cent_shift = np.array([fleft - border_margin, ftop - border_margin])
 
@@ -201,59 +520,97 @@ class FishTrackingMethod(ImageToDataNode):
             angles[1:] = np.unwrap(angles[1:] - angles[0])
 
             # put the data together for one fish
-            fish_coords = np.concatenate([np.array(points[0][:2]), angles])
-
-            nofish = False
-            # check if this is a new fish, or it is an update of
-            # a fish detected previously
-            if self.fishes.update(fish_coords):
-                messages.append("I:Updated previous fish")
-            elif self.fishes.add_fish(fish_coords):
-                messages.append("I:Added new fish")
-            else:
-                messages.append("E:More fish than n_fish max")
+            detections.append(np.concatenate([np.array(points[0][:2]), angles]))
 
-        if nofish:
-            messages.append(
-                "W:No object of right area, between {:.0f} and {:.0f}".format(
-                    *fish_area
-                )
-            )
+        return detections, candidates, messages, max_area
 
-        # if a debugging image is to be shown, set it
-        if self.set_diagnostic == "background difference":
-            self.diagnostic_image = bg
-        elif self.set_diagnostic == "thresholded background difference":
-            self.diagnostic_image = bg_thresh
-        elif self.set_diagnostic == "fish detection":
-            fishdet = bg_small.copy()
-            fishdet[bg_thresh == 0] = 0
-            self.diagnostic_image = fishdet
-        elif self.set_diagnostic == "thresholded for eye and swim bladder":
-            self.diagnostic_image = np.maximum(bg, threshold_eyes) - threshold_eyes
 
-        if self._output_type is None:
-            self.reset_state()
-        return NodeOutput(
-            messages, self._output_type(*self.fishes.coords.flatten(), max_area * 1.0)
+def _search_windows(positions, size, shape):
+    """Windows of the image around the predicted positions of the fish,
+    overlapping windows being merged so that a fish is not found twice
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        x and y coordinates of the fish
+    size : int
+        side of the windows
+    shape : tuple
+        shape of the image
+
+    Returns
+    -------
+    list of tuple
+        top, left, bottom and right edges of the windows
+
+    """
+    half = size // 2
+    windows = []
+    for x, y in positions:
+        window = (
+            max(int(y) - half, 0),
+            max(int(x) - half, 0),
+            min(int(y) + half, shape[0]),
+            min(int(x) + half, shape[1]),
         )
+        if window[0] >= window[2] or window[1] >= window[3]:
+            continue
+        i_window = 0
+        while i_window < len(windows):
+            other = windows[i_window]
+            if (
+                window[0] < other[2]
+                and other[0] < window[2]
+                and window[1] < other[3]
+                and other[1] < window[3]
+            ):
+                window = (
+                    min(window[0], other[0]),
+                    min(window[1], other[1]),
+                    max(window[2], other[2]),
+                    max(window[3], other[3]),
+                )
+                windows.pop(i_window)
+                i_window = 0
+            else:
+                i_window += 1
+        windows.append(window)
+    return windows
+
+
+class Fishes:
+    """States of the tracked fish, positions and headings filtered with a
+    Kalman filter, and tail angles, predicted and updated for all the fish
+    at once.
 
+    Each new detection is assigned to at most one fish, by minimizing the
+    total distance between the detections and the predicted fish, among
+    the pairs closer than the gates in position and heading.
 
-spec = [
-    ("n_fish", int64),
-    ("coords", float64[:, :]),
-    ("i_not_updated", int64[:]),
-    ("F", float64[:, :]),
-    ("uncertainties", float64[:]),
-    ("Q", float64[:, :]),
-    ("Ps", float64[:, :, :, :]),
-    ("def_P", float64[:, :, :]),
-    ("persist_fish_for", int64),
-]
+    Parameters
+    ----------
+    n_fish_max : int
+        number of fish which can be tracked
+    pos_std : float
+        uncertainty of the detected positions (px)
+    angle_std : float
+        uncertainty of the detected headings (rad)
+    n_segments : int
+        number of tail angles
+    pred_coef : float
+        scaling of the process noise
+    persist_fish_for : int
+        number of frames for which a fish is kept if it is not detected
+
+    Attributes
+    ----------
+    track_ids : np.ndarray
+        identifier of the track of the fish in each slot, incremented for
+        each new fish, so that a fish which is lost and found again later
+        gets a new track ID even if it takes the same slot
 
+    """
 
-@jitclass(spec)
-class Fishes(object):
     def __init__(
         self, n_fish_max, pos_std, angle_std, n_segments, pred_coef, persist_fish_for
     ):
@@ -261,10 +618,11 @@ class Fishes(object):
         self.coords = np.full((n_fish_max, 6 + n_segments), np.nan)
         self.uncertainties = np.array((pos_std, angle_std, angle_std))
         self.def_P = np.zeros((3, 2, 2))
-        for i, uc in enumerate(self.uncertainties):
-            self.def_P[i, 0, 0] = uc
-            self.def_P[i, 1, 1] = uc
+        self.def_P[:, 0, 0] = self.uncertainties
+        self.def_P[:, 1, 1] = self.uncertainties
         self.i_not_updated = np.zeros(n_fish_max, dtype=np.int64)
+        self.track_ids = np.full(n_fish_max, -1, dtype=np.int64)
+        self.n_tracks = 0
         self.Ps = np.zeros((n_fish_max, 3, 2, 2))
         self.F = np.array([[1.0, 1.0], [0.0, 1.0]])
         dt = 0.02
@@ -274,68 +632,146 @@ class Fishes(object):
         )
         self.persist_fish_for = persist_fish_for
 
+    @property
+    def states(self):
+        """View of the filtered x, y and theta of the fish with their
+        velocities, of shape (n_fish, 3, 2)"""
+        return self.coords[:, :6].reshape(self.n_fish, 3, 2)
+
     def predict(self):
-        for i_fish in range(self.n_fish):
-            if not np.isnan(self.coords[i_fish, 0]):
-                for i_coord in range(0, 6, 2):
-                    predict_inplace(
-                        self.coords[i_fish, i_coord : i_coord + 2],
-                        self.Ps[i_fish, i_coord // 2],
-                        self.F,
-                        self.Q,
-                    )
-                self.i_not_updated[i_fish] += 1
-                if self.i_not_updated[i_fish] > self.persist_fish_for:
-                    self.coords[i_fish, :] = np.nan
-
-    def update(self, new_fish):
-        for i_fish in range(self.n_fish):
-            if not np.isnan(self.coords[i_fish, 0]):
-                if self.is_close(new_fish, i_fish) and self.i_not_updated[i_fish] != 0:
-                    # update position with Kalman filtering
-                    for i_coord in range(0, 3):
-                        # if it is the angle find the modulo 2pi closest
-                        nc = new_fish[i_coord]
-                        if i_coord == 2:
-                            nc = _minimal_angle_dif(self.coords[i_fish, 4], nc)
-                        update_inplace(
-                            nc,
-                            self.coords[i_fish, i_coord * 2 : i_coord * 2 + 2],
-                            self.Ps[i_fish, i_coord],
-                            self.uncertainties[i_coord],
-                        )
-                    # update tail angles
-                    self.coords[i_fish, 6:] = new_fish[3:]
-                    self.i_not_updated[i_fish] = 0
-                    return True
+        alive = ~np.isnan(self.coords[:, 0])
+        predict_batch(self.states, self.Ps, self.F, self.Q, alive)
+        self.i_not_updated[alive] += 1
+        self.coords[alive & (self.i_not_updated > self.persist_fish_for), :] = np.nan
+
+    def update(self, detections, max_distance=15.0, max_angle=np.pi / 2):
+        """Updates the fish which were predicted since their last update
+        with the detections assigned to them
+
+        Parameters
+        ----------
+        detections : np.ndarray
+            x, y, theta and tail angles of the detected fish, one per row
+        max_distance : float
+            maximal distance (px) between a detection and the predicted
+            position of a fish for it to be assigned to it
+        max_angle : float
+            maximal difference (rad) between the heading of a detection and
+            the predicted heading of a fish for it to be assigned to it
+
+        Returns
+        -------
+        np.ndarray
+            index of the fish updated by each detection, -1 if it was
+            not assigned
 
-    def add_fish(self, new_fish):
-        for i_fish in range(self.n_fish):
-            if np.isnan(self.coords[i_fish, 0]):
-                self.coords[i_fish, 0:6:2] = new_fish[:3]
-                self.coords[i_fish, 1:6:2] = 0.0
-                self.coords[i_fish, 6:] = new_fish[3:]
-                self.Ps[i_fish] = self.def_P
-                self.i_not_updated[i_fish] = 0
-                return True
-        return False
-
-    def is_close(self, new_fish, i_fish):
-        """Check whether the new coordinates are
-        within a certain number of pixels of the old estimate
-        and within a certain angle
         """
-        n_px = 15
-        d_theta = np.pi / 2
-        dists = new_fish[:2] - self.coords[i_fish, 0:4:2]
-        dtheta = np.abs(
-            np.mod(new_fish[2] - self.coords[i_fish, 4] + np.pi, np.pi * 2) - np.pi
+        detections = np.atleast_2d(detections)
+        i_candidates = np.flatnonzero(
+            ~np.isnan(self.coords[:, 0]) & (self.i_not_updated != 0)
+        )
+        if len(detections) == 0 or len(i_candidates) == 0:
+            return np.full(len(detections), -1)
+
+        costs, gated = _assignment_costs(
+            detections, self.coords, i_candidates, max_distance, max_angle
+        )
+        i_dets, i_cands = linear_sum_assignment(costs)
+        return _update_assigned(
+            detections,
+            self.coords,
+            self.states,
+            self.Ps,
+            self.uncertainties,
+            self.i_not_updated,
+            i_dets,
+            i_candidates[i_cands],
+            gated[i_dets, i_cands],
+        )
+
+    def add_fish(self, new_fish):
+        i_free = np.flatnonzero(np.isnan(self.coords[:, 0]))
+        if len(i_free) == 0:
+            return False
+        i_fish = i_free[0]
+        self.coords[i_fish, 0:6:2] = new_fish[:3]
+        self.coords[i_fish, 1:6:2] = 0.0
+        self.coords[i_fish, 6:] = new_fish[3:]
+        self.Ps[i_fish] = self.def_P
+        self.i_not_updated[i_fish] = 0
+        self.track_ids[i_fish] = self.n_tracks
+        self.n_tracks += 1
+        return True
+
+
+@jit(nopython=True, cache=True)
+def _assignment_costs(detections, coords, i_candidates, max_distance, max_angle):
+    """Costs of assigning the detections to the candidate fish, the sum of
+    their squared differences in position and heading relative to the gates.
+    The pairs outside of the gates cost more than all the pairs inside
+    together, so that as many detections as possible are assigned.
+
+    Returns
+    -------
+    costs : np.ndarray
+        cost of each pair of detection and fish
+    gated : np.ndarray
+        whether each pair is inside the gates
+
+    """
+    n_detections, n_candidates = detections.shape[0], len(i_candidates)
+    costs = np.empty((n_detections, n_candidates))
+    gated = np.empty((n_detections, n_candidates), dtype=np.bool_)
+    outside_cost = 2.0 * min(n_detections, n_candidates) + 1
+    for i_det in range(n_detections):
+        for i_cand in range(n_candidates):
+            fish = coords[i_candidates[i_cand]]
+            dist2 = (detections[i_det, 0] - fish[0]) ** 2 + (
+                detections[i_det, 1] - fish[2]
+            ) ** 2
+            dtheta = np.abs(
+                np.mod(detections[i_det, 2] - fish[4] + np.pi, np.pi * 2) - np.pi
+            )
+            gated[i_det, i_cand] = dist2 < max_distance**2 and dtheta < max_angle
+            if gated[i_det, i_cand]:
+                costs[i_det, i_cand] = (
+                    dist2 / max_distance**2 + (dtheta / max_angle) ** 2
+                )
+            else:
+                costs[i_det, i_cand] = outside_cost
+    return costs, gated
+
+
+@jit(nopython=True, cache=True)
+def _update_assigned(
+    detections, coords, states, Ps, uncertainties, i_not_updated, i_dets, i_fish, gated
+):
+    """Updates the fish with the detections assigned to them inside the
+    gates, returning the fish updated by each detection (-1 if none)"""
+    i_assigned = np.full(detections.shape[0], -1)
+    measured = np.empty((len(i_dets), 3))
+    i_updated = np.empty(len(i_dets), dtype=np.int64)
+    n_updated = 0
+    for i_pair in range(len(i_dets)):
+        if not gated[i_pair]:
+            continue
+        detection = detections[i_dets[i_pair]]
+        i_updated[n_updated] = i_fish[i_pair]
+        measured[n_updated, :2] = detection[:2]
+        # the heading is taken modulo 2pi closest to the predicted one
+        measured[n_updated, 2] = _minimal_angle_dif(
+            coords[i_fish[i_pair], 4], detection[2]
         )
+        coords[i_fish[i_pair], 6:] = detection[3:]
+        i_not_updated[i_fish[i_pair]] = 0
+        i_assigned[i_dets[i_pair]] = i_fish[i_pair]
+        n_updated += 1
 
-        return np.sum(dists**2) < n_px**2 and dtheta < d_theta
+    update_batch(measured[:n_updated], states, Ps, uncertainties, i_updated[:n_updated])
+    return i_assigned
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def points_to_angles(points):
     angles = np.empty(len(points) - 1, dtype=np.float64)
     for i, (p1, p2) in enumerate(zip(points[0:-1], points[1:])):
@@ -343,7 +779,7 @@ def points_to_angles(points):
     return angles
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def fish_start(mask, take_min):
     su = 0.0
     ret = np.full((2,), 0.0)
@@ -365,7 +801,7 @@ def fish_start(mask, take_min):
 # Utilities for drawing circles.
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _symmetry_points(x0, y0, x, y):
     return [
         (x0 + x, y0 + y),
@@ -379,7 +815,7 @@ def _symmetry_points(x0, y0, x, y):
     ]
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _circle_points(x0, y0, radius):
     """Bresenham's circle algorithm
 
@@ -417,7 +853,7 @@ def _circle_points(x0, y0, radius):
     return points
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _fish_direction_n(image, start_loc, radius):
     centre_int = start_loc.astype(np.int16)
     pixels_rad = _circle_points(centre_int[0], centre_int[1], radius)
@@ -433,6 +869,6 @@ def _fish_direction_n(image, start_loc, radius):
     return np.arctan2(max_point[1] - centre_int[1], max_point[0] - centre_int[0])
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _minimal_angle_dif(th_old, th_new):
     return th_old + np.mod(th_new - th_old + np.pi, np.pi * 2) - np.pi
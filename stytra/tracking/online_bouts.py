@@ -1,10 +1,14 @@
 from collections import namedtuple
+from time import perf_counter
+import numpy as np
 from numba import jit
+from lightparam import Param, Parametrized
+from stytra.utilities import reduce_to_pi
 
 BoutState = namedtuple("BoutState", "state vel i_inbout i_below n_after")
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _process_input(
     vel, prev, threshold=1, n_without_crossing=5, pad_after=5, min_bout_len=1
 ):
@@ -48,7 +52,7 @@ def _process_input(
     return BoutState(state, vel, i_inbout, i_below, n_after)
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def find_bouts_online(
     velocities,
     coords,
@@ -97,3 +101,240 @@ def find_bouts_online(
             bout_finished = True
         state = next_state
     return bout_coords, bout_finished, state
+
+
+@jit(nopython=True, cache=True)
+def find_bout_edges_online(
+    velocities,
+    initial_state,
+    threshold=1,
+    n_without_crossing=5,
+    min_bout_len=1,
+):
+    """Online detection of the beginning and end of bouts, with the
+    same criteria as find_bouts_online, but without collecting the coordinates
+
+    Parameters
+    ----------
+    velocities
+        new velocities
+    initial_state
+        BoutState after the previous velocities
+
+    Returns
+    -------
+    starts
+        indices of the velocities at which bouts started
+    ends
+        indices at which bouts were found to be over, n_without_crossing
+        samples after the velocity went below threshold
+    state
+        BoutState after the last velocity
+
+    """
+    starts = np.empty(len(velocities), np.int64)
+    ends = np.empty(len(velocities), np.int64)
+    n_starts = 0
+    n_ends = 0
+    state = initial_state
+    for i in range(len(velocities)):
+        next_state = _process_input(
+            velocities[i],
+            state,
+            threshold=threshold,
+            n_without_crossing=n_without_crossing,
+            pad_after=1,
+            min_bout_len=min_bout_len,
+        )
+        if state.state != 1 and next_state.state == 1:
+            starts[n_starts] = i
+            n_starts += 1
+        if state.state == 2 and next_state.state != 2:
+            ends[n_ends] = i
+            n_ends += 1
+        state = next_state
+    return starts[:n_starts], ends[:n_ends], state
+
+
+def warm_up_bout_detection():
+    """Compiles the functions used for the online bout detection in the
+    GUI with the types of the tracking data, so that the first bout does not
+    cause a stall. The compiled functions are cached on disk, so this takes
+    long only the first time.
+
+    Returns
+    -------
+    float
+        time taken, in seconds
+
+    """
+    t_start = perf_counter()
+    velocities = np.zeros(10)
+    coords = np.zeros((10, 3))
+    state = BoutState(0, 0.0, 0, 0, 0)
+    # the coordinates selected from the accumulator data are in Fortran
+    # order, and in C order once concatenated with previous ones
+    for coords_layout in [coords, np.asfortranarray(coords)]:
+        find_bouts_online(
+            velocities,
+            coords_layout,
+            state,
+            [coords_layout[0, :]],
+            shift=0,
+            threshold=0.2,
+            n_without_crossing=5,
+            pad_after=5,
+            min_bout_len=1,
+            pad_before=5,
+        )
+    find_bout_edges_online(
+        velocities, state, threshold=0.2, n_without_crossing=5, min_bout_len=1
+    )
+    # used on the bout coordinates and on single angles
+    reduce_to_pi(coords[:, 2])
+    reduce_to_pi(0.0)
+    return perf_counter() - t_start
+
+
+class BoutRecordingTrigger:
+    """Detects bouts in the tracking data as they arrive, and sends the
+    times of their beginning and end to the trigger queue of a
+    :class:`BoutTriggeredVideoWriter <stytra.hardware.video.write.BoutTriggeredVideoWriter>`,
+    so that only the frames around the bouts are recorded.
+
+    For freely-swimming fish, a bout is detected when any of the fish moves,
+    from the squared displacement between frames, as in the bout plot.
+    With the sparse output of the fish tracking, the positions of the fish
+    are read from their records.
+    For embedded fish, the absolute change of the tail sum is used.
+
+    Parameters
+    ----------
+    acc_tracking : DataFrameAccumulator
+        accumulator of the tracking data
+    trigger_queue : Queue
+        queue to which the start and stop events are sent
+    acc_records : RecordQueueAccumulator
+        (optional) accumulator of the records of the tracked fish, for the
+        sparse output
+    tree : ParameterTree
+        (optional) tree to which the detection parameters are added
+    max_samples : int
+        maximal number of new samples processed at every update
+
+    """
+
+    def __init__(
+        self,
+        acc_tracking,
+        trigger_queue,
+        acc_records=None,
+        tree=None,
+        max_samples=5000,
+    ):
+        self.acc = acc_tracking
+        self.acc_records = acc_records
+        self.trigger_queue = trigger_queue
+        self.max_samples = max_samples
+        self.detection_params = Parametrized(
+            name="recording/bout_detection",
+            params=dict(
+                threshold=Param(0.2, (0.001, 100.0)),
+                n_without_crossing=Param(5, (0, 50)),
+                min_bout_len=Param(1, (1, 30)),
+            ),
+            tree=tree,
+        )
+        self.reset()
+
+    def reset(self):
+        self.bout_state = BoutState(0, 0.0, 0, 0, 0)
+        self.last_t = -np.inf
+        self.last_values = None
+
+    def velocity_columns(self):
+        columns = self.acc.columns
+        fish_columns = []
+        i_fish = 0
+        while "f{}_x".format(i_fish) in columns:
+            fish_columns.extend(["f{}_x".format(i_fish), "f{}_y".format(i_fish)])
+            i_fish += 1
+        if fish_columns:
+            return fish_columns
+        if "tail_sum" in columns:
+            return ["tail_sum"]
+        return []
+
+    def use_records(self):
+        """Whether the positions of the fish are in their records"""
+        return (
+            self.acc_records is not None
+            and not self.acc_records.is_empty()
+            and "i_fish" in self.acc_records.columns
+        )
+
+    def recent_values(self):
+        """Times of the last samples and NxJ array of the values whose
+        changes are the movements, or None if there are no such values"""
+        columns = self.velocity_columns()
+        if columns:
+            t, arrays = self.acc.get_last_n_arrays(self.max_samples, columns)
+            return t, np.stack([arrays[c] for c in columns], 1)
+        if self.use_records():
+            t, _ = self.acc.get_last_n_arrays(self.max_samples, [])
+            # only the records of the new samples are arranged by fish,
+            # unless the accumulator was reset
+            if t[-1] >= self.last_t:
+                t = t[np.searchsorted(t, self.last_t) :]
+            slot_arrays = self.acc_records.get_slot_arrays(t, ["x", "y"])
+            if slot_arrays["x"].shape[1] > 0:
+                # x and y of each fish, as in the velocity columns
+                xy = np.stack([slot_arrays["x"], slot_arrays["y"]], 2)
+                return t, xy.reshape(len(t), -1)
+        return None
+
+    def velocities(self, values):
+        """Movement between successive samples, from an NxJ array of
+        the values of the velocity columns"""
+        steps = np.diff(values, axis=0)
+        if values.shape[1] == 1:
+            return np.abs(steps[:, 0])
+        # squared displacement of the fish which moved the most
+        disp = steps[:, 0::2] ** 2 + steps[:, 1::2] ** 2
+        return np.max(np.nan_to_num(disp), axis=1)
+
+    def update(self):
+        if self.acc.is_empty():
+            return
+        recent = self.recent_values()
+        if recent is None:
+            return
+        t, values = recent
+        if t[-1] < self.last_t:
+            # the accumulator was reset
+            self.reset()
+        new = t > self.last_t
+        if not np.any(new):
+            return
+        i_first = np.argmax(new)
+        values = values[i_first:]
+        times = t[i_first:]
+        self.last_t = t[-1]
+
+        if self.last_values is not None and self.last_values.shape == values[0].shape:
+            values = np.concatenate([self.last_values[None, :], values], 0)
+        else:
+            times = times[1:]
+        self.last_values = values[-1].copy()
+        if len(times) == 0:
+            return
+
+        starts, ends, self.bout_state = find_bout_edges_online(
+            self.velocities(values).astype(np.float64),
+            self.bout_state,
+            **self.detection_params.params.values
+        )
+        t0 = self.acc.exp.t0.timestamp()
+        events = sorted([(i, "start") for i in starts] + [(i, "stop") for i in ends])
+        for i, event in events:
+            self.trigger_queue.put((event, t0 + times[i]))
@@ -3,6 +3,11 @@ from anytree import PreOrderIter, Node, Resolver
 from multiprocessing import Queue
 from collections import namedtuple
 from itertools import chain
+from time import perf_counter
+
+import numpy as np
+
+from stytra.tracking.profiling import TimingRing
 
 
 NodeOutput = namedtuple("NodeOutput", "messages data")
@@ -17,12 +22,21 @@ class PipelineNode(Node):
         self.set_diagnostic = None
         self._output_type = None
 
+        # ring of the last execution times, if they are measured
+        self.timings = None
+
     def reset(self):
         pass
 
     def changed(self, vals):
         pass
 
+    def warm_up(self):
+        """Compiles the numba functions used by the node, with the types of
+        the data it processes, so that the first frames are not delayed
+        """
+        pass
+
     def setup(self):
         self._params = Parametrized(params=self._process, name="tracking+" + self.name)
 
@@ -30,12 +44,24 @@ class PipelineNode(Node):
     def output_type_changed(self):
         return False
 
+    @property
+    def stateful(self):
+        """Whether the output for a frame depends on the previous frames,
+        in which case the frames cannot be split between parallel workers
+        """
+        return False
+
     @property
     def strpath(self):
         return self.separator.join([""] + [str(node.name) for node in self.path])
 
     def process(self, *inputs) -> NodeOutput:
-        out = self._process(*inputs, **self._params.params.values)
+        if self.timings is None:
+            out = self._process(*inputs, **self._params.params.values)
+        else:
+            t_start = perf_counter()
+            out = self._process(*inputs, **self._params.params.values)
+            self.timings.append(perf_counter() - t_start)
         try:
             assert isinstance(out, NodeOutput)
         except AssertionError:
@@ -51,6 +77,36 @@ class PipelineNode(Node):
 class ImageToImageNode(PipelineNode):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._buffers = dict()
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """Array where the node can write its output, allocated once and
+        reused for all the frames, unless their shape or type changes.
+
+        The output of an image node is only read by its children during the
+        same run of the pipeline, so the buffers are overwritten at every
+        frame and must not be kept.
+
+        Parameters
+        ----------
+        name : str
+            name of the buffer, for nodes which need several of them
+        shape : tuple
+            shape of the array
+        dtype : np.dtype
+            type of the array
+
+        Returns
+        -------
+        np.ndarray
+            uninitialized array
+
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
 
     @property
     def output_type_changed(self):
@@ -76,6 +132,11 @@ class ImageToDataNode(PipelineNode):
         self._params = None
         self._output_type_changed = True  # Has to be true to initialize the class
 
+        # data nodes can also output a variable number of records at each
+        # frame, in an array with a row for each record
+        self.records = None
+        self.record_columns = None
+
     @property
     def output_type_changed(self):
         if self._output_type_changed:
@@ -105,6 +166,14 @@ class Pipeline:
         self._param_finder = Resolver()
         self.node_dict = dict()
 
+        # compiled execution plan, see compile_plan
+        self._plan = None
+        self._data_nodes = []
+        self._node_outputs = []
+        self._data_outputs = []
+        self._output_slots = []
+        self._output_record = []
+
     @property
     def headers_to_plot(self):
         hds = []
@@ -113,6 +182,10 @@ class Pipeline:
                 hds.extend(node.monitored_headers)
         return hds
 
+    @property
+    def stateful(self):
+        return any(node.stateful for node in self.node_dict.values())
+
     def setup(self, tree=None):
         """Due to multiprocessing limitations, the setup is
         run separately from the constructor
@@ -142,6 +215,59 @@ class Pipeline:
             params=dict(reset=Param(False, gui="button")),
             tree=tree,
         )
+        self.all_params["profiling"] = Parametrized(
+            name="tracking/profiling",
+            params=dict(
+                time_nodes=Param(False),
+                n_samples=Param(1000, (10, 100000)),
+            ),
+            tree=tree,
+        )
+        self.compile_plan()
+
+    def compile_plan(self):
+        """Flattens the node tree into a list of steps executed in order
+        at every frame, so that the tree does not have to be traversed
+        recursively. Each step is a tuple of the node, the index of the step
+        whose output is its input (-1 for the pipeline input) and, for
+        the data nodes, the index of their output among the data outputs.
+
+        The positions of the outputs of the data nodes in the final output
+        tuple are computed on the first run and recomputed only when the
+        output type of one of the nodes changes.
+
+        """
+        # data nodes are the leaves of the pipeline, their children are not run
+        nodes = list(
+            PreOrderIter(
+                self.root, stop=lambda n: isinstance(n.parent, ImageToDataNode)
+            )
+        )
+        step_indices = {node: i for i, node in enumerate(nodes)}
+        self._plan = []
+        self._data_nodes = []
+        for node in nodes:
+            i_input = step_indices[node.parent] if node.parent is not None else -1
+            if isinstance(node, ImageToDataNode):
+                self._plan.append((node, i_input, len(self._data_nodes)))
+                self._data_nodes.append(node)
+            else:
+                self._plan.append((node, i_input, None))
+        self._node_outputs = [None] * len(self._plan)
+        self._data_outputs = [None] * len(self._data_nodes)
+        self._output_type = None
+
+    def _compile_output_slots(self):
+        """Computes the output type of the pipeline and the slice of the
+        output record where each data node writes its values
+        """
+        fields = []
+        self._output_slots = []
+        for data in self._data_outputs:
+            self._output_slots.append(slice(len(fields), len(fields) + len(data)))
+            fields.extend(data._fields)
+        self._output_type = namedtuple("o", fields)
+        self._output_record = [None] * len(fields)
 
     @property
     def diagnostic_image(self):
@@ -167,7 +293,7 @@ class Pipeline:
     def deserialize_params(self, rec_params):
         for item, vals in rec_params.items():
             self.all_params[item].params.values = vals
-            if item != "diagnostics" and item != "reset":
+            if item not in ["diagnostics", "reset", "profiling"]:
                 self.node_dict[item].changed(vals)
         if "diagnostics" in rec_params.keys():
             imname = self.all_params["diagnostics"].image
@@ -185,8 +311,76 @@ class Pipeline:
         if "reset" in rec_params.keys() and "reset" in rec_params["reset"].keys():
             for node in self.node_dict.values():
                 node.reset()
+        if "profiling" in rec_params.keys() and rec_params["profiling"]:
+            self.set_node_timing(
+                self.all_params["profiling"].time_nodes,
+                self.all_params["profiling"].n_samples,
+            )
+
+    def warm_up(self):
+        """Compiles the numba functions used by the nodes before the
+        first frame, which takes long only the first time, as the compiled
+        functions are cached on disk
+
+        Returns
+        -------
+        float
+            time taken, in seconds
+
+        """
+        t_start = perf_counter()
+        for node in self.node_dict.values():
+            node.warm_up()
+        return perf_counter() - t_start
+
+    @property
+    def timing_nodes(self):
+        return self.all_params["profiling"].time_nodes
+
+    def set_node_timing(self, enabled, n_samples=1000):
+        """Starts or stops measuring the execution time of each node,
+        keeping the last n_samples times"""
+        for node in self.node_dict.values():
+            node.timings = TimingRing(n_samples) if enabled else None
+
+    def records(self):
+        """Records output in the last run by the first data node which
+        outputs them, see :class:`ImageToDataNode`
+
+        Returns
+        -------
+        tuple or None
+            names of the columns and array of the records, one per row,
+            or None if no node outputs records
+
+        """
+        for node in self._data_nodes:
+            if node.record_columns is not None and node.records is not None:
+                return node.record_columns, node.records
+        return None
+
+    def node_timings(self):
+        """Summaries of the execution times of the nodes which were timed
+
+        Returns
+        -------
+        dict
+            :class:`TimingSummary <stytra.tracking.profiling.TimingSummary>`
+            by node path
+
+        """
+        summaries = dict()
+        for name, node in self.node_dict.items():
+            if node.timings is not None:
+                summary = node.timings.summary()
+                if summary is not None:
+                    summaries[name] = summary
+        return summaries
 
     def recursive_run(self, node: PipelineNode, *input_data):
+        """Runs the subtree starting at node recursively, the
+        compiled plan used by run gives the same results with less overhead
+        """
         output = node.process(*input_data)
         if isinstance(node, ImageToDataNode):
             return output
@@ -214,6 +408,33 @@ class Pipeline:
         )
 
     def run(self, input):
-        out = self.recursive_run(self.root, input)
-        self.root.acknowledge_changes()
-        return out
+        if self._plan is None:
+            self.compile_plan()
+
+        messages = []
+        node_outputs = self._node_outputs
+        data_outputs = self._data_outputs
+        for i_step, (node, i_input, i_data) in enumerate(self._plan):
+            output = node.process(input if i_input < 0 else node_outputs[i_input])
+            messages.extend(output.messages)
+            if i_data is None:
+                node_outputs[i_step] = output.data
+            else:
+                data_outputs[i_data] = output.data
+
+        if self._output_type is None or any(
+            node.output_type_changed for node in self._data_nodes
+        ):
+            self._compile_output_slots()
+            for node in self._data_nodes:
+                node.acknowledge_changes()
+
+        record = self._output_record
+        for slot, data in zip(self._output_slots, data_outputs):
+            record[slot] = data
+
+        # the image outputs are not needed anymore
+        for i_step in range(len(node_outputs)):
+            node_outputs[i_step] = None
+
+        return NodeOutput(messages, self._output_type._make(record))
@@ -34,28 +34,59 @@ class Prefilter(ImageToImageNode):
         :param color_invert:
         :return:
         """
+        # each step writes into a buffer of the node instead of a new
+        # image, in place once the image is not the input frame anymore
         if image_scale != 1:
             im = cv2.resize(
-                im, None, fx=image_scale, fy=image_scale, interpolation=cv2.INTER_AREA
+                im,
+                None,
+                fx=image_scale,
+                fy=image_scale,
+                interpolation=cv2.INTER_AREA,
+                dst=self.buffer(
+                    "resized",
+                    (
+                        round(im.shape[0] * image_scale),
+                        round(im.shape[1] * image_scale),
+                    )
+                    + im.shape[2:],
+                    im.dtype,
+                ),
             )
         if filter_size > 0:
-            im = cv2.boxFilter(im, -1, (filter_size, filter_size))
+            im = cv2.boxFilter(
+                im,
+                -1,
+                (filter_size, filter_size),
+                dst=self.buffer("filtered", im.shape, im.dtype),
+            )
         if color_invert:
-            im = 255 - im
+            im = np.subtract(255, im, out=self._writable(im))
         if clip > 0:
             # Maxval only exists because it is required,
             # since we use cv2.THRES_TOZERO, we do not set things to maxval.
-            im = cv2.threshold(src=im, thresh=clip, maxval=255, type=cv2.THRESH_TOZERO)[
-                1
-            ]
+            im = cv2.threshold(
+                src=im,
+                thresh=clip,
+                maxval=255,
+                type=cv2.THRESH_TOZERO,
+                dst=self._writable(im),
+            )[1]
 
         if self.set_diagnostic == "filtered":
             self.diagnostic_image = im
 
         return NodeOutput([], im)
 
+    def _writable(self, im):
+        """The image itself if it is one of the buffers of the node,
+        otherwise a buffer where to write the result of processing it"""
+        if any(im is buffer for buffer in self._buffers.values()):
+            return im
+        return self.buffer("filtered", im.shape, im.dtype)
+
 
-@vectorize([uint8(float32, uint8)])
+@vectorize([uint8(float32, uint8)], cache=True)
 def negdif(xf, y):
     """
 
@@ -77,7 +108,7 @@ def negdif(xf, y):
         return 0
 
 
-@vectorize([uint8(float32, uint8)])
+@vectorize([uint8(float32, uint8)], cache=True)
 def absdif(xf, y):
     """
 
@@ -105,6 +136,10 @@ class BackgroundSubtractor(ImageToImageNode):
         self.background_image = None
         self.i = 0
 
+    @property
+    def stateful(self):
+        return True
+
     def reset(self):
         self.background_image = None
 
@@ -116,17 +151,18 @@ class BackgroundSubtractor(ImageToImageNode):
         only_darker: Param(True),
     ):
         messages = []
-        if self.background_image is None:
+        if self.background_image is None or self.background_image.shape != im.shape:
             self.background_image = im.astype(np.float32)
             messages.append("I:New backgorund image set")
         elif self.i == 0:
-            self.background_image[:, :] = im.astype(np.float32) * np.float32(
-                learning_rate
-            ) + self.background_image * np.float32(1 - learning_rate)
+            # updates the background in place, as
+            # im * learning_rate + background * (1 - learning_rate)
+            cv2.accumulateWeighted(im, self.background_image, learning_rate)
 
         self.i = (self.i + 1) % learn_every
 
+        out = self.buffer("difference", im.shape, np.uint8)
         if only_darker:
-            return NodeOutput(messages, negdif(self.background_image, im))
+            return NodeOutput(messages, negdif(self.background_image, im, out=out))
         else:
-            return NodeOutput(messages, absdif(self.background_image, im))
+            return NodeOutput(messages, absdif(self.background_image, im, out=out))
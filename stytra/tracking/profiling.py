@@ -0,0 +1,91 @@
+"""
+Measurement of the execution time of the nodes of the tracking pipelines
+"""
+
+from collections import namedtuple
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+
+
+TimingSummary = namedtuple("TimingSummary", "mean p95 max n")
+TimingSummary.__doc__ = """Execution times, in ms, of the last n runs of a
+pipeline node"""
+
+
+class TimingRing:
+    """Fixed-size ring of the last execution times of a pipeline node, in
+    seconds, which does not allocate memory when times are added
+
+    Parameters
+    ----------
+    n_samples : int
+        number of execution times kept
+
+    """
+
+    def __init__(self, n_samples=1000):
+        self.times = np.zeros(n_samples)
+        self.i_next = 0
+        self.n = 0
+
+    def append(self, t):
+        self.times[self.i_next] = t
+        self.i_next = (self.i_next + 1) % len(self.times)
+        if self.n < len(self.times):
+            self.n += 1
+
+    def summary(self):
+        """Summary of the times in the ring
+
+        Returns
+        -------
+        TimingSummary
+            mean, 95th percentile and maximum in ms, and number of samples,
+            None if there are no samples yet
+
+        """
+        if self.n == 0:
+            return None
+        times = self.times[: self.n] * 1000
+        return TimingSummary(
+            float(np.mean(times)),
+            float(np.percentile(times, 95)),
+            float(np.max(times)),
+            self.n,
+        )
+
+
+class TimingSender:
+    """Periodically sends the summaries of the execution times of the nodes
+    of a pipeline, if they are being measured, as tuples of (time, source,
+    dict of summaries by node)
+
+    Parameters
+    ----------
+    queue : multiprocessing.Queue
+        queue where the summaries are put
+    source : str
+        name of the process running the pipeline
+    interval : float
+        time between summaries, in seconds
+
+    """
+
+    def __init__(self, queue, source, interval=1.0):
+        self.queue = queue
+        self.source = source
+        self.interval = interval
+        self.t_last = perf_counter()
+
+    def update(self, pipeline):
+        if not pipeline.timing_nodes:
+            return
+        t = perf_counter()
+        if t - self.t_last < self.interval:
+            return
+        self.t_last = t
+        summaries = pipeline.node_timings()
+        if summaries:
+            self.queue.put((datetime.now(), self.source, summaries))
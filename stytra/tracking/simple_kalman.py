@@ -2,13 +2,13 @@ from numba import jit
 import numpy as np
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def predict_inplace(x, P, F, Q):
     x[0] = x[0] + x[1]
     P[:, :] = np.dot(np.dot(F, P), F.T) + Q
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def update_inplace(z, x, P, R):
     # error (residual) between measurement and prediction
     y = z - x[0]
@@ -24,3 +24,85 @@ def update_inplace(z, x, P, R):
     I_KH[1, 0] = -K[1]
 
     P[:, :] = ((I_KH @ P) @ I_KH.T) + R * (K @ K.T)
+
+
+@jit(nopython=True, cache=True)
+def predict_batch(xs, Ps, F, Q, active):
+    """Prediction step, as predict_inplace, for the states of several
+    tracks at once, each made of independent coordinates with their velocity
+
+    Parameters
+    ----------
+    xs : np.ndarray
+        states, of shape (n_tracks, n_coords, 2)
+    Ps : np.ndarray
+        covariances, of shape (n_tracks, n_coords, 2, 2)
+    F : np.ndarray
+        state transition matrix
+    Q : np.ndarray
+        process noise
+    active : np.ndarray
+        whether each track is predicted
+
+    """
+    for i_track in range(xs.shape[0]):
+        if not active[i_track]:
+            continue
+        for i_coord in range(xs.shape[1]):
+            x = xs[i_track, i_coord]
+            P = Ps[i_track, i_coord]
+            x[0] = x[0] + x[1]
+
+            fp00 = F[0, 0] * P[0, 0] + F[0, 1] * P[1, 0]
+            fp01 = F[0, 0] * P[0, 1] + F[0, 1] * P[1, 1]
+            fp10 = F[1, 0] * P[0, 0] + F[1, 1] * P[1, 0]
+            fp11 = F[1, 0] * P[0, 1] + F[1, 1] * P[1, 1]
+            P[0, 0] = fp00 * F[0, 0] + fp01 * F[0, 1] + Q[0, 0]
+            P[0, 1] = fp00 * F[1, 0] + fp01 * F[1, 1] + Q[0, 1]
+            P[1, 0] = fp10 * F[0, 0] + fp11 * F[0, 1] + Q[1, 0]
+            P[1, 1] = fp10 * F[1, 0] + fp11 * F[1, 1] + Q[1, 1]
+
+
+@jit(nopython=True, cache=True)
+def update_batch(zs, xs, Ps, Rs, i_tracks):
+    """Update step, as update_inplace, for the states of several tracks
+    at once, each made of independent coordinates with their velocity
+
+    Parameters
+    ----------
+    zs : np.ndarray
+        measurements, of shape (n_measurements, n_coords)
+    xs : np.ndarray
+        states, of shape (n_tracks, n_coords, 2)
+    Ps : np.ndarray
+        covariances, of shape (n_tracks, n_coords, 2, 2)
+    Rs : np.ndarray
+        measurement noise of each coordinate
+    i_tracks : np.ndarray
+        track updated by each measurement
+
+    """
+    for i_meas in range(zs.shape[0]):
+        i_track = i_tracks[i_meas]
+        for i_coord in range(zs.shape[1]):
+            x = xs[i_track, i_coord]
+            P = Ps[i_track, i_coord]
+            R = Rs[i_coord]
+
+            y = zs[i_meas, i_coord] - x[0]
+            S = P[0, 0] + R
+            k0 = P[0, 0] / S
+            k1 = P[1, 0] / S
+            x[0] += k0 * y
+            x[1] += k1 * y
+
+            # (I - KH) P (I - KH)^T + R K.K, with I - KH = [[1 - k0, 0], [-k1, 1]]
+            m00 = (1 - k0) * P[0, 0]
+            m01 = (1 - k0) * P[0, 1]
+            m10 = P[1, 0] - k1 * P[0, 0]
+            m11 = P[1, 1] - k1 * P[0, 1]
+            kk = R * (k0 * k0 + k1 * k1)
+            P[0, 0] = m00 * (1 - k0) + kk
+            P[0, 1] = m01 - m00 * k1 + kk
+            P[1, 0] = m10 * (1 - k0) + kk
+            P[1, 1] = m11 - m10 * k1 + kk
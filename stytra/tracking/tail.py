@@ -5,6 +5,7 @@ from scipy.ndimage.filters import gaussian_filter1d
 from stytra.utilities import reduce_to_pi
 from stytra.tracking.pipelines import ImageToDataNode, NodeOutput
 from collections import namedtuple
+from functools import lru_cache
 
 
 class TailTrackingMethod(ImageToDataNode):
@@ -37,6 +38,25 @@ class CentroidTrackingMethod(TailTrackingMethod):
         self.resting_angles = None
         self.previous_angles = None
 
+    @property
+    def stateful(self):
+        # the angles depend on previous frames only if filtered in time
+        # or if the resting angles are being estimated
+        return self._params.time_filter_weight > 0 or self._params.reset_zero
+
+    def warm_up(self):
+        # the images are usually 8-bit, after the Prefilter
+        _trace_tail_centroids(
+            np.ones((16, 16), dtype=np.uint8),
+            8.0,
+            2.0,
+            0.0,
+            2.0,
+            2.0,
+            3,
+            window_offsets(7),
+        )
+
     def _process(
         self,
         im,
@@ -104,19 +124,23 @@ class CentroidTrackingMethod(TailTrackingMethod):
         start_x *= scale
         start_y *= scale
 
-        halfwin = window_size / 2
-        for i in range(1, n_segments):
-            # Use next segment function for find next point
-            # with center-of-mass displacement:
-            start_x, start_y, disp_x, disp_y, acc = _next_segment(
-                im, start_x, start_y, disp_x, disp_y, halfwin, seg_length
-            )
-            if start_x < 0:
-                messages.append("W:segment {} not detected".format(i))
-                break
-
-            abs_angle = np.arctan2(disp_x, disp_y)
-            angles[i - 1] = abs_angle
+        # each point is displaced to the center of mass of the window
+        # around the continuation of the previous segment
+        points, _, n_found = _trace_tail_centroids(
+            im,
+            float(start_x),
+            float(start_y),
+            float(disp_x),
+            float(disp_y),
+            float(seg_length),
+            n_segments - 1,
+            window_offsets(window_size),
+        )
+        if n_found < n_segments - 1:
+            messages.append("W:segment {} not detected".format(n_found + 1))
+        angles[:n_found] = np.arctan2(
+            np.diff(points[: n_found + 1, 0]), np.diff(points[: n_found + 1, 1])
+        )
 
         # we want angles to be continuous, this removes potential 2pi discontinuities
         angles = np.unwrap(angles)
@@ -159,46 +183,46 @@ class CentroidTrackingMethod(TailTrackingMethod):
         )
 
 
-@jit(nopython=True, cache=True)
 def find_fish_midline(im, xm, ym, angle, r=9, m=3, n_points=20):
     """Finds a midline for a fish image, with the starting point and direction
 
     Parameters
     ----------
-    im :
-        param xm:
-    ym :
-        param angle:
-    r :
-        param m: (Default value = 9)
-    n_points :
-        return: (Default value = 20)
-    xm :
-
-    angle :
-
-    m :
-         (Default value = 3)
+    im : np.ndarray
+        image, with the fish brighter than the background
+    xm, ym : float
+        starting point of the midline
+    angle : float
+        direction of the first segment
+    r : float
+        radius of the window in which the next point is searched
+        (Default value = 9)
+    m : float
+        distance between the points (Default value = 3)
+    n_points : int
+        number of points (Default value = 20)
 
     Returns
     -------
+    list of tuple
+        x, y and the sum of the image in the window in which the point
+        was found, for each point, or [(-1.0, -1.0, 0.0)] if the midline
+        could not be completely traced
 
     """
-
-    dx = np.cos(angle) * m
-    dy = np.sin(angle) * m
-
-    points = [(xm, ym, 0)]
-    for i in range(1, n_points):
-        xm, ym, dx, dy, acc = _next_segment(im, xm, ym, dx, dy, r, m)
-        if xm > 0:
-            points.append((xm, ym, acc))
-        else:
-            return [
-                (-1.0, -1.0, 0.0)
-            ]  # if the tail is not completely tracked, return invalid value
-
-    return points
+    points, masses, n_found = _trace_tail_centroids(
+        im,
+        float(xm),
+        float(ym),
+        np.cos(angle) * m,
+        np.sin(angle) * m,
+        float(m),
+        n_points - 1,
+        window_offsets(2 * r),
+    )
+    if n_found < n_points - 1:
+        return [(-1.0, -1.0, 0.0)]
+    return [(x, y, acc) for (x, y), acc in zip(points, np.concatenate([[0.0], masses]))]
 
 
 class AnglesTrackingMethod(TailTrackingMethod):
@@ -212,6 +236,11 @@ class AnglesTrackingMethod(TailTrackingMethod):
             "theta_{:02}".format(i) for i in range(self.params.n_segments)
         ]
 
+    def warm_up(self):
+        _tail_trace_core_ls(
+            np.ones((16, 16), dtype=np.uint8), 8.0, 2.0, 0.0, 2.0, 4, 10.0
+        )
+
     def detect(
         self,
         im,
@@ -272,82 +301,118 @@ class AnglesTrackingMethod(TailTrackingMethod):
         return angle_list
 
 
-@jit(nopython=True)
-def _next_segment(fc, xm, ym, dx, dy, halfwin, next_point_dist):
-    """Find the endpoint of the next tail segment
-    by calculating the moments in a look-ahead area
+@lru_cache(maxsize=16)
+def window_offsets(window_size):
+    """Offsets from the center of the points of a circular window, on
+    which the center of mass of the next tail segment is computed. They
+    are computed once for each window size, and are read-only
 
     Parameters
     ----------
-    fc :
-        image to find tail
-    xm :
-        starting point x
-    ym :
-        starting point y
-    dx :
-        initial displacement x
-    dy :
-        initial displacement y
-    wind_size :
-        size of the window to estimate next tail point
-    next_point_dist :
-        distance to the next tail point
-    halfwin :
+    window_size : float
+        diameter of the window (px)
+
+    Returns
+    -------
+    np.ndarray
+        x and y offsets of the points, one per row
+
+    """
+    halfwin = window_size / 2
+    r = int(np.ceil(halfwin))
+    oy, ox = np.mgrid[-r : r + 1, -r : r + 1]
+    inside = ox**2 + oy**2 <= halfwin**2
+    offsets = np.stack([ox[inside], oy[inside]], 1).astype(np.float64)
+    offsets.flags.writeable = False
+    return offsets
+
 
+@jit(nopython=True, cache=True)
+def _trace_tail_centroids(
+    im, start_x, start_y, disp_x, disp_y, seg_length, n_segments, offsets
+):
+    """Traces the tail segment by segment, placing the end of each segment
+    in the direction of the center of mass of a circular window, centered
+    on the continuation of the previous segment. The image is sampled at
+    the points of the window with bilinear interpolation, so that the
+    window is centered with subpixel precision.
+
+    Parameters
+    ----------
+    im : np.ndarray
+        image, with the tail brighter than the background
+    start_x, start_y : float
+        starting point of the tail
+    disp_x, disp_y : float
+        initial displacement, giving the direction of the first segment
+    seg_length : float
+        length of the segments
+    n_segments : int
+        number of segments
+    offsets : np.ndarray
+        offsets of the points of the window, from :func:`window_offsets`
 
     Returns
     -------
+    points : np.ndarray
+        x and y of the start point and of the end of each segment,
+        NaN after the last segment found
+    masses : np.ndarray
+        sum of the image in the window of each segment found
+    n_found : int
+        number of segments found
 
     """
+    points = np.full((n_segments + 1, 2), np.nan)
+    masses = np.zeros(n_segments)
+    points[0, 0] = start_x
+    points[0, 1] = start_y
+    h, w = im.shape
+    x, y = start_x, start_y
+    for i_seg in range(n_segments):
+        cx = x + disp_x
+        cy = y + disp_y
+        acc = 0.0
+        acc_x = 0.0
+        acc_y = 0.0
+        for i_point in range(offsets.shape[0]):
+            px = cx + offsets[i_point, 0]
+            py = cy + offsets[i_point, 1]
+            # the points outside of the image do not count
+            if px < 0 or py < 0 or px > w - 1 or py > h - 1:
+                continue
+            x0 = min(int(px), w - 2)
+            y0 = min(int(py), h - 2)
+            fx = px - x0
+            fy = py - y0
+            val = (1 - fy) * ((1 - fx) * im[y0, x0] + fx * im[y0, x0 + 1]) + fy * (
+                (1 - fx) * im[y0 + 1, x0] + fx * im[y0 + 1, x0 + 1]
+            )
+            acc += val
+            acc_x += val * offsets[i_point, 0]
+            acc_y += val * offsets[i_point, 1]
+
+        if acc == 0:
+            return points, masses, i_seg
+
+        # center of mass relative to the end of the previous segment
+        mn_x = cx + acc_x / acc - x
+        mn_y = cy + acc_y / acc - y
+        norm = np.sqrt(mn_x**2 + mn_y**2)
+        if norm == 0:
+            return points, masses, i_seg
+
+        disp_x = mn_x * seg_length / norm
+        disp_y = mn_y * seg_length / norm
+        x += disp_x
+        y += disp_y
+        points[i_seg + 1, 0] = x
+        points[i_seg + 1, 1] = y
+        masses[i_seg] = acc
+    return points, masses, n_segments
+
 
-    # Generate square window for center of mass
-    halfwin2 = halfwin**2
-    y_max, x_max = fc.shape
-    xs = min(max(int(round(xm + dx - halfwin)), 0), x_max)
-    xe = min(max(int(round(xm + dx + halfwin)), 0), x_max)
-    ys = min(max(int(round(ym + dy - halfwin)), 0), y_max)
-    ye = min(max(int(round(ym + dy + halfwin)), 0), y_max)
-
-    # at the edge returns invalid data
-    if xs == xe and ys == ye:
-        return -1, -1, 0, 0, 0
-
-    # accumulators
-    acc = 0.0
-    acc_x = 0.0
-    acc_y = 0.0
-    for x in range(xs, xe):
-        for y in range(ys, ye):
-            lx = (xs + halfwin - x) ** 2
-            ly = (ys + halfwin - y) ** 2
-            if lx + ly <= halfwin2:
-                acc_x += x * fc[y, x]
-                acc_y += y * fc[y, x]
-                acc += fc[y, x]
-
-    if acc == 0:
-        return -1, -1, 0, 0, 0
-
-    # center of mass relative to the starting points
-    mn_y = acc_y / acc - ym
-    mn_x = acc_x / acc - xm
-
-    # normalise to segment length
-    a = np.sqrt(mn_y**2 + mn_x**2) / next_point_dist
-
-    # check center of mass validity
-    if a == 0:
-        return -1, -1, 0, 0, 0
-
-    # Use normalization factor
-    dx = mn_x / a
-    dy = mn_y / a
-
-    return xm + dx, ym + dy, dx, dy, acc
-
-
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _tail_trace_core_ls(img, start_x, start_y, disp_x, disp_y, num_points, tail_length):
     """Tail tracing based on min (or max) detection on arches. Wrapped by
     trace_tail_angular_sweep.
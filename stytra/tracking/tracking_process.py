@@ -1,10 +1,45 @@
 from queue import Empty, Full
-from multiprocessing import Event, Value
+from multiprocessing import Event, Value, Process, Queue
+from collections import OrderedDict, namedtuple
+import time as pytime
+
+import numpy as np
 
 from stytra.utilities import FrameProcess
+from stytra.hardware.video.frame_pool import FrameChannel
+from stytra.tracking.profiling import TimingSender
 from arrayqueues.shared_arrays import TimestampedArrayQueue
 
 
+def frame_output_queue(in_frame_queue, max_mbytes, maxsize=None):
+    """Creates a queue for the frames passed on by a process. If the frames
+    come from a :class:`FrameChannel`, it is a channel of the same pool,
+    so that they can be forwarded without copying them
+
+    Parameters
+    ----------
+    in_frame_queue
+        queue from which the process takes the frames
+    max_mbytes : int
+        size of the queue if it is not part of a frame pool
+    maxsize : int
+        maximal number of frames waiting in a channel
+
+    """
+    if isinstance(in_frame_queue, FrameChannel):
+        return in_frame_queue.pool.channel(maxsize=maxsize)
+    return TimestampedArrayQueue(max_mbytes=max_mbytes)
+
+
+def forward_frame(in_frame_queue, frame, out_queue, timestamp):
+    """Puts a frame in the output queue of a process, passing on the pool
+    slot if it is the last frame taken from a :class:`FrameChannel`"""
+    if isinstance(in_frame_queue, FrameChannel):
+        in_frame_queue.share(frame, out_queue, timestamp=timestamp)
+    else:
+        out_queue.put(frame, timestamp=timestamp)
+
+
 class TrackingProcess(FrameProcess):
     """A class which handles taking frames from the camera and processing them,
      as well as dispatching a subset for display
@@ -17,6 +52,12 @@ class TrackingProcess(FrameProcess):
 
     """
 
+    # maximal time (in s) to wait for the result of a frame in parallel mode
+    max_result_wait = 2.0
+
+    # maximal number of frames waiting to be displayed
+    max_gui_frames = 8
+
     def __init__(
         self,
         in_frame_queue,
@@ -28,6 +69,9 @@ class TrackingProcess(FrameProcess):
         recording_signal=None,
         gui_framerate=30,
         max_mb_queue=100,
+        n_workers=1,
+        worker_assignment="auto",
+        latency_trace=None,
         **kwargs
     ):
         """
@@ -53,7 +97,26 @@ class TrackingProcess(FrameProcess):
         gui_dispatcher
 
         max_mb_queue: int (200)
-            the maximal size of the image output queues
+            the maximal size of the image output queues, if the input
+            frames do not come from a frame pool (in which case the frames
+            are shared with the output queues without being copied)
+        n_workers: int (1)
+            number of processes running the tracking in parallel. If more
+            than one, this process only dispatches the frames to the
+            workers and puts their outputs in the output queue in the order
+            of the frames
+        worker_assignment: str ("auto")
+            how the frames are distributed among the workers:
+            "round_robin" sends each frame to the next worker,
+            "sticky" sends all frames to the same worker, which is needed
+            if the output depends on previous frames (e.g. with background
+            subtraction or Kalman filtering), as each worker has its own
+            pipeline. "auto" is sticky only if the pipeline is stateful,
+            which is reported with a warning, as the other workers are
+            then idle
+        latency_trace: LatencyTrace
+            if given, the start and end of the tracking of each frame are
+            marked in it
 
         kwargs
         """
@@ -61,11 +124,13 @@ class TrackingProcess(FrameProcess):
         super().__init__(name="tracking", **kwargs)
 
         self.frame_queue = in_frame_queue
-        self.gui_queue = TimestampedArrayQueue(max_mbytes=max_mb_queue)  # GUI queue for
+        self.gui_queue = frame_output_queue(
+            in_frame_queue, max_mb_queue, self.max_gui_frames
+        )  # GUI queue for
 
         self.recording_signal = recording_signal
         if recording_signal is not None:
-            self.frame_copy_queue = TimestampedArrayQueue(max_mbytes=max_mb_queue)
+            self.frame_copy_queue = frame_output_queue(in_frame_queue, max_mb_queue)
         else:
             self.frame_copy_queue = None
 
@@ -81,6 +146,27 @@ class TrackingProcess(FrameProcess):
         self.pipeline_cls = pipeline
         self.pipeline = None
 
+        self.max_mb_queue = max_mb_queue
+        self.n_workers = n_workers
+        if worker_assignment not in ["auto", "round_robin", "sticky"]:
+            raise ValueError("Unknown worker assignment {}".format(worker_assignment))
+        self.worker_assignment = worker_assignment
+        self.latency_trace = latency_trace
+
+        # mean latency (in ms) between receiving a frame and outputting its
+        # tracking result, reported every n_fps_frames in parallel mode
+        self.latency_queue = Queue()
+        self.latencies = []
+
+        # summaries of the execution times of the pipeline nodes, sent
+        # every second if they are measured
+        self.timing_queue = Queue()
+
+        # records of the nodes with a variable-length output, as
+        # (time, column names if they changed, array of records)
+        self.record_queue = Queue()
+        self._record_columns = None
+
         self.i = 0
 
     def process_internal(self, frame):
@@ -99,20 +185,65 @@ class TrackingProcess(FrameProcess):
 
         """
 
-    def retrieve_params(self):
+    def retrieve_params(self, forward_queues=()):
         while True:
             try:
                 param_dict = self.processing_parameter_queue.get(timeout=0.0001)
                 self.pipeline.deserialize_params(param_dict)
+                for q in forward_queues:
+                    q.put(param_dict)
             except Empty:
                 break
 
+    def copy_for_recording(self, time, frame, messages):
+        """If we are copying the frames to another queue
+        (e.g. for video recording), do it here
+        """
+        if self.recording_signal is not None and self.recording_signal.is_set():
+            try:
+                forward_frame(self.frame_queue, frame, self.frame_copy_queue, time)
+            except Full:
+                messages.append("W:Dropping frames from recording")
+
+    def send_output(self, time, messages, output, records=None):
+        for msg in messages:
+            self.message_queue.put(msg)
+
+        self.output_queue.put(time, output)
+
+        if self.second_output_queue is not None:
+            self.second_output_queue.put(time, output)
+
+        if records is not None:
+            self.send_records(time, *records)
+
+        # calculate the frame rate
+        self.update_framerate()
+
+    def send_records(self, time, columns, values):
+        """Puts the records of a frame in the record queue, if there are
+        any, with the column names only when they change"""
+        if len(values) == 0:
+            return
+        if columns != self._record_columns:
+            self._record_columns = columns
+        else:
+            columns = None
+        self.record_queue.put((time, columns, values))
+
     def run(self):
         """Loop where the tracking function runs."""
 
         self.pipeline = self.pipeline_cls()
         self.pipeline.setup()
 
+        if self.n_workers > 1:
+            self.run_parallel()
+            return
+
+        self.warm_up(self.pipeline)
+        timing_sender = TimingSender(self.timing_queue, "tracking")
+
         while not self.finished_signal.is_set():
 
             # Gets the processing parameters from their queue
@@ -126,26 +257,19 @@ class TrackingProcess(FrameProcess):
                 continue
 
             messages = []
-            # If we are copying the frames to another queue (e.g. for video recording), do it here
-            if self.recording_signal is not None and self.recording_signal.is_set():
-                try:
-                    self.frame_copy_queue.put(frame.copy(), timestamp=time)
-                except:
-                    messages.append("W:Dropping frames from recording")
+            self.copy_for_recording(time, frame, messages)
 
             # If a processing function is specified, apply it:
 
+            if self.latency_trace is not None:
+                self.latency_trace.mark("tracking_start", frame_idx)
             new_messages, output = self.pipeline.run(frame)
-            for msg in messages + new_messages:
-                self.message_queue.put(msg)
-
-            self.output_queue.put(time, output)
-
-            if self.second_output_queue is not None:
-                self.second_output_queue.put(time, output)
-
-            # calculate the frame rate
-            self.update_framerate()
+            if self.latency_trace is not None:
+                self.latency_trace.mark("tracking_end", frame_idx)
+            self.send_output(
+                time, messages + new_messages, output, self.pipeline.records()
+            )
+            timing_sender.update(self.pipeline)
 
             # put current frame into the GUI queue
             self.send_to_gui(
@@ -157,21 +281,300 @@ class TrackingProcess(FrameProcess):
 
         return
 
-    def send_to_gui(self, frametime, frame):
-        """Sends the current frame to the GUI queue at the appropriate framerate"""
+    def run_parallel(self):
+        """Loop distributing the frames to the tracking workers and
+        collecting their outputs in the order of the frames"""
+        job_queues = [
+            frame_output_queue(self.frame_queue, self.max_mb_queue)
+            for _ in range(self.n_workers)
+        ]
+        param_queues = [Queue() for _ in range(self.n_workers)]
+        result_queue = Queue()
+        workers = [
+            TrackingWorker(
+                i_worker,
+                job_queue=job_queues[i_worker],
+                parameter_queue=param_queues[i_worker],
+                result_queue=result_queue,
+                finished_signal=self.finished_signal,
+                pipeline=self.pipeline_cls,
+                latency_trace=self.latency_trace,
+                timing_queue=self.timing_queue,
+            )
+            for i_worker in range(self.n_workers)
+        ]
+        t_start = pytime.perf_counter()
+        for worker in workers:
+            worker.start()
+
+        # wait for the workers to set up and compile their pipelines
+        for worker in workers:
+            while not (worker.ready.wait(0.1) or self.finished_signal.is_set()):
+                pass
+        self.message_queue.put(
+            "I:Tracking workers started and compiled in {:.2f} s".format(
+                pytime.perf_counter() - t_start
+            )
+        )
+
+        # frames sent to the workers, in order, with the frame time
+        # and the time they were dispatched
+        pending = OrderedDict()
+        results = dict()
+        output_types = [None] * self.n_workers
+        i_next_worker = 0
+        serialised = False
+
+        while not self.finished_signal.is_set():
+            self.retrieve_params(param_queues)
+
+            try:
+                time, frame_idx, frame = self.frame_queue.get(timeout=0.001)
+            except Empty:
+                frame = None
+
+            if frame is not None:
+                messages = []
+                self.copy_for_recording(time, frame, messages)
+
+                # the state of the pipeline depends on its parameters, so
+                # the serialisation is reported whenever it starts
+                stateful = self.worker_assignment == "auto" and self.pipeline.stateful
+                if stateful and not serialised:
+                    self.message_queue.put(
+                        "W:Stateful pipeline, all frames are tracked by one "
+                        "of the {} workers".format(self.n_workers)
+                    )
+                serialised = stateful
+
+                if self.worker_assignment == "sticky" or stateful:
+                    i_worker = 0
+                else:
+                    i_worker = i_next_worker
+                    i_next_worker = (i_next_worker + 1) % self.n_workers
+
+                # the workers send back the diagnostic image only when it
+                # has to be displayed
+                show_frame = self.gui_frame_due()
+                diagnostic = self.pipeline.all_params["diagnostics"].image
+                send_diagnostic = show_frame and diagnostic != "unprocessed"
+                try:
+                    forward_frame(
+                        self.frame_queue,
+                        frame,
+                        job_queues[i_worker],
+                        (time, frame_idx, send_diagnostic),
+                    )
+                    pending[frame_idx] = (time, pytime.perf_counter())
+                except Full:
+                    messages.append("W:Dropped frame, tracking workers too slow")
+                if show_frame and not send_diagnostic:
+                    self.put_to_gui(time, frame)
+
+                for msg in messages:
+                    self.message_queue.put(msg)
+
+            while True:
+                try:
+                    (
+                        i_worker,
+                        frame_idx,
+                        messages,
+                        fields,
+                        values,
+                        records,
+                        diag,
+                    ) = result_queue.get_nowait()
+                except Empty:
+                    break
+                if fields is not None:
+                    output_types[i_worker] = namedtuple("o", fields)
+                # the frames which were given up on are not kept
+                if frame_idx not in pending:
+                    continue
+                results[frame_idx] = (
+                    messages,
+                    output_types[i_worker]._make(values),
+                    records,
+                    diag,
+                )
+
+            # if a worker failed, do not wait for its results forever
+            while pending and (
+                pytime.perf_counter() - next(iter(pending.values()))[1]
+                > self.max_result_wait
+            ):
+                frame_idx, _ = pending.popitem(last=False)
+                results.pop(frame_idx, None)
+                self.message_queue.put("E:Tracking result lost")
+
+            # put out the results which are complete, in the order of the frames
+            while pending and next(iter(pending)) in results:
+                frame_idx, (time, t_dispatched) = pending.popitem(last=False)
+                messages, output, records, diag = results.pop(frame_idx)
+                self.latencies.append(pytime.perf_counter() - t_dispatched)
+                self.send_output(time, messages, output, records)
+                if diag is not None:
+                    self.put_to_gui(time, diag)
+
+        for worker in workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+
+    def warm_up(self, pipeline):
+        """Compiles the numba functions of the pipeline before taking the
+        frames, reporting the time it took"""
+        self.message_queue.put(
+            "I:Tracking compiled in {:.2f} s".format(pipeline.warm_up())
+        )
+
+    def update_framerate(self):
+        super().update_framerate()
+        if self.framerate_rec.i_fps == 0 and len(self.latencies) > 0:
+            self.latency_queue.put(
+                (self.framerate_rec.current_time, np.mean(self.latencies) * 1000)
+            )
+            self.latencies = []
+
+    def gui_frame_due(self):
+        """Whether the current frame should be displayed to keep the
+        GUI at the appropriate framerate"""
         if self.framerate_rec.current_framerate:
             every_x = max(
                 int(self.framerate_rec.current_framerate / self.gui_framerate), 1
             )
         else:
             every_x = 1
-        if self.i == 0:
+        due = self.i == 0
+        self.i = (self.i + 1) % every_x
+        return due
+
+    def put_to_gui(self, frametime, frame):
+        try:
+            forward_frame(self.frame_queue, frame, self.gui_queue, frametime)
+        except Full:
+            self.message_queue.put("E:GUI queue full")
+
+    def send_to_gui(self, frametime, frame):
+        """Sends the current frame to the GUI queue at the appropriate framerate"""
+        if self.gui_frame_due():
+            self.put_to_gui(frametime, frame)
+
+
+class TrackingWorker(Process):
+    """Process running a copy of the tracking pipeline on the frames sent by
+    a parallel :class:`TrackingProcess`
+
+    Parameters
+    ----------
+    i_worker: int
+        index of the worker
+    job_queue: FrameChannel or TimestampedArrayQueue
+        queue of the frames to track, with (time, frame index, whether to
+        send back the diagnostic image) as timestamp
+    parameter_queue: Queue
+        queue of the changed pipeline parameters
+    result_queue: Queue
+        queue, shared between the workers, where the outputs are put
+    finished_signal: Event
+        signal for the end of the acquisition
+    pipeline: type
+        tracking pipeline class
+    latency_trace: LatencyTrace
+        if given, the start and end of the tracking of each frame are marked
+        in it
+    timing_queue: Queue
+        queue where the summaries of the execution times of the pipeline
+        nodes are sent, if they are measured
+
+    """
+
+    def __init__(
+        self,
+        i_worker,
+        job_queue,
+        parameter_queue,
+        result_queue,
+        finished_signal,
+        pipeline,
+        latency_trace=None,
+        timing_queue=None,
+    ):
+        super().__init__(name="tracking_worker_{}".format(i_worker))
+        self.i_worker = i_worker
+        self.job_queue = job_queue
+        self.parameter_queue = parameter_queue
+        self.result_queue = result_queue
+        self.finished_signal = finished_signal
+        self.pipeline_cls = pipeline
+        self.latency_trace = latency_trace
+        self.timing_queue = timing_queue
+        self.ready = Event()
+
+    def run(self):
+        pipeline = self.pipeline_cls()
+        pipeline.setup()
+        pipeline.warm_up()
+        output_type = None
+        if self.timing_queue is not None:
+            timing_sender = TimingSender(self.timing_queue, self.name)
+        else:
+            timing_sender = None
+        self.ready.set()
+
+        while not self.finished_signal.is_set():
+            while True:
+                try:
+                    pipeline.deserialize_params(self.parameter_queue.get_nowait())
+                except Empty:
+                    break
+
             try:
-                self.gui_queue.put(frame, timestamp=frametime)
-            except Full:
-                self.message_queue.put("E:GUI queue full")
+                (time, frame_idx, send_diagnostic), frame = self.job_queue.get(
+                    timeout=0.001
+                )
+            except Empty:
+                continue
 
-        self.i = (self.i + 1) % every_x
+            if self.latency_trace is not None:
+                self.latency_trace.mark("tracking_start", frame_idx)
+            messages, output = pipeline.run(frame)
+            if self.latency_trace is not None:
+                self.latency_trace.mark("tracking_end", frame_idx)
+
+            # the field names are sent only when they change, as the
+            # namedtuple types of the pipeline cannot be pickled
+            fields = None
+            if type(output) != output_type:
+                output_type = type(output)
+                fields = output._fields
+
+            diag = None
+            if send_diagnostic:
+                diag = pipeline.diagnostic_image
+                if diag is None:
+                    diag = frame
+                diag = diag.copy()
+
+            self.result_queue.put(
+                (
+                    self.i_worker,
+                    frame_idx,
+                    messages,
+                    fields,
+                    tuple(output),
+                    pipeline.records(),
+                    diag,
+                )
+            )
+            if timing_sender is not None:
+                timing_sender.update(pipeline)
+
+        # do not wait for the results to be consumed when exiting
+        self.result_queue.cancel_join_thread()
+        if self.timing_queue is not None:
+            self.timing_queue.cancel_join_thread()
 
 
 class DispatchProcess(FrameProcess):
@@ -204,9 +607,11 @@ class DispatchProcess(FrameProcess):
         super().__init__(name="tracking", **kwargs)
 
         self.frame_queue = in_frame_queue
-        self.gui_queue = TimestampedArrayQueue(max_mbytes=600)  # GUI queue
+        self.gui_queue = frame_output_queue(
+            in_frame_queue, 600, TrackingProcess.max_gui_frames
+        )  # GUI queue
         # for displaying the image
-        self.output_frame_queue = TimestampedArrayQueue(max_mbytes=600)
+        self.output_frame_queue = frame_output_queue(in_frame_queue, 600)
 
         self.dispatching_set_evt = dispatching_set_evt
         self.finished_signal = finished_evt
@@ -228,7 +633,12 @@ class DispatchProcess(FrameProcess):
                 continue
 
             if self.dispatching_set_evt.is_set():
-                self.output_frame_queue.put(frame.copy(), time)
+                try:
+                    forward_frame(
+                        self.frame_queue, frame, self.output_frame_queue, time
+                    )
+                except Full:
+                    self.message_queue.put("W:Dropping frames from recording")
 
             # put current frame into the GUI queue
             self.send_to_gui(time, frame)
@@ -247,5 +657,8 @@ class DispatchProcess(FrameProcess):
         else:
             every_x = 1
         if self.i == 0:
-            self.gui_queue.put(frame, timestamp=frametime)
+            try:
+                forward_frame(self.frame_queue, frame, self.gui_queue, frametime)
+            except Full:
+                self.message_queue.put("E:GUI queue full")
         self.i = (self.i + 1) % every_x
@@ -246,7 +246,7 @@ def recursive_update(d, u):
     return d
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def reduce_to_pi(angle):
     """Puts an angle or array of angles inside the (-pi, pi) range"""
     return np.mod(angle + np.pi, 2 * np.pi) - np.pi